@@ -0,0 +1,101 @@
+import argparse
+import os
+import tempfile
+import time
+
+import sandbox
+from nova_metrics import percentile
+from nova_replay import REPLAY_URL, ReplayAdapter, ReplayTokenProvider, TrafficArchive
+from nova_standin import add_standin_arguments, standin_from_arguments
+from nova_throttle import DEFAULT_RATE
+
+
+def print_latency_table(title, samples):
+    """Prints count, p50, p95 and max in milliseconds for each name -> list of seconds in samples."""
+    print(f"\n{title:<20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, seconds in samples.items():
+        print(f"{name:<20} {len(seconds):>7} {percentile(seconds, 50) * 1000:>9.1f} {percentile(seconds, 95) * 1000:>9.1f} {max(seconds) * 1000:>9.1f}")
+
+
+def seed_rows(rows):
+    """Writes rows as fresh input rows of the sagsflyt table in the current directory."""
+    conn = sandbox.connect_db()
+    sandbox.upsert_input_rows(conn, rows)
+    conn.close()
+
+
+def count_processed():
+    conn = sandbox.connect_db()
+    processed = conn.execute(f"SELECT COUNT(*) FROM {sandbox.TABLE_NAME} WHERE processed_at IS NOT NULL").fetchone()[0]
+    conn.close()
+    return processed
+
+
+def enter_workdir(workdir):
+    """Changes into workdir (created if missing), or a fresh temporary directory if workdir is None."""
+    if workdir:
+        os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir or tempfile.mkdtemp(prefix="nova-benchmark-"))
+
+
+def report_run(elapsed, rows, run):
+    processed = count_processed()
+    print(f"\nProcessed {processed} of {rows} row(s) in {elapsed:.1f}s: {processed / elapsed * 60:.0f} rows/minute.")
+    print(f"SQLite files in {os.getcwd()}")
+    print_latency_table("Step", run.step_seconds)
+
+
+def replay_benchmark(args):
+    """Replays a recorded archive: the input rows are rebuilt from the recording and no request leaves the machine."""
+    adapter = ReplayAdapter(TrafficArchive(os.path.abspath(args.replay)), args.replay_latency_scale)
+    enter_workdir(args.workdir)
+    rows = adapter.pipeline_rows()
+    seed_rows(rows)
+
+    started = time.perf_counter()
+    run = sandbox.run_pipeline_for_unprocessed_rows(args.task_workers, args.hedge_percentile, nova=(REPLAY_URL, ReplayTokenProvider()), adapter=adapter,
+                                                    rate=args.rate)
+    elapsed = time.perf_counter() - started
+
+    report_run(elapsed, len(rows), run)
+    print(f"\nReplayed {adapter.hits} request(s), {adapter.misses} not in the recording.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark run_pipeline_for_unprocessed_rows against the local Nova stand-in or a recording.")
+    add_standin_arguments(parser)
+    parser.add_argument("--rows", type=int, default=200, help="Input rows to process.")
+    parser.add_argument("--task-workers", type=int, default=sandbox.TASK_UPDATE_WORKERS, help="Threads updating the tasks of one case.")
+    parser.add_argument("--hedge-percentile", type=float, help="Hedge reads slower than this latency percentile.")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Requests per second the client allows per Nova endpoint.")
+    parser.add_argument("--workdir", help="Directory for the SQLite files. A fresh temporary directory by default.")
+    parser.add_argument("--replay", metavar="ARCHIVE", help="Replay an archive recorded with `sandbox.py run --record` instead of using the stand-in.")
+    parser.add_argument("--replay-latency-scale", type=float, default=1.0, help="Factor on the recorded response times; 0 for none.")
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        replay_benchmark(args)
+        return
+
+    # sandbox keeps its SQLite files relative to the working directory; start from empty ones
+    enter_workdir(args.workdir)
+
+    with standin_from_arguments(args) as standin:
+        seed_rows(standin.data.pipeline_rows(args.rows))
+
+        started = time.perf_counter()
+        run = sandbox.run_pipeline_for_unprocessed_rows(args.task_workers, args.hedge_percentile, nova=(standin.url, standin.token_provider()),
+                                                        rate=args.rate)
+        elapsed = time.perf_counter() - started
+
+    report_run(elapsed, args.rows, run)
+    print_latency_table("Endpoint (server)", {endpoint: [seconds for _, seconds in answers] for endpoint, answers in standin.requests.items()})
+
+    print(f"\n{'Endpoint':<20} {'2xx':>7} {'401':>7} {'429':>7} {'5xx':>7}")
+    for endpoint, answers in standin.requests.items():
+        statuses = [status for status, _ in answers]
+        print(f"{endpoint:<20} {sum(200 <= s < 300 for s in statuses):>7} {statuses.count(401):>7} {statuses.count(429):>7} {sum(s >= 500 for s in statuses):>7}")
+
+
+if __name__ == "__main__":
+    main()
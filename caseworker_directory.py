@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+import time
+
+import msgspec
+
+from nova_models import Caseworker, FkOrgIdentity, KspIdentity, LosIdentity
+
+
+# Seconds a found caseworker is trusted before it is looked up again
+DEFAULT_TTL = 7 * 24 * 3600
+# Seconds a "not found" answer is trusted, shorter so new employees show up quickly
+DEFAULT_NEGATIVE_TTL = 3600
+
+TABLE_NAME = "caseworker_directory"
+
+
+class CaseworkerDirectory:
+    """
+    Persistent cache of Nova caseworker identities, stored in its own SQLite file and shared across runs
+    and worker processes.
+
+    Entries are keyed by lowercased racfId and hold the full kspIdentity, losIdentity and fkOrgIdentity
+    blocks as returned by lookup_caseworker_by_racfId. Racfids that were not found are stored as
+    negative entries with their own, shorter TTL.
+
+    Parameters:
+        path (str): Path of the SQLite file.
+        ttl (float): Seconds a found caseworker stays valid.
+        negative_ttl (float): Seconds a "not found" answer stays valid.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+            racf_id TEXT PRIMARY KEY,           -- lowercased
+            found INTEGER NOT NULL,             -- 1 if Nova knows the racfId, 0 for a negative entry
+            ksp_identity TEXT,                  -- JSON
+            los_identity TEXT,                  -- JSON
+            fk_org_identity TEXT,               -- JSON
+            caseworker_ctrl_by TEXT,            -- JSON
+            fetched_at REAL NOT NULL            -- unix time
+        );
+        """)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, racfId):
+        """
+        Returns (hit, caseworker). hit is False if there is no fresh entry for racfId.
+        On a hit, caseworker is the cached Caseworker, or None for a fresh negative entry.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT found, ksp_identity, los_identity, fk_org_identity, caseworker_ctrl_by, fetched_at FROM {TABLE_NAME} WHERE racf_id = ?",
+                (racfId.strip().lower(),)
+            ).fetchone()
+        if row is None:
+            return False, None
+
+        found, ksp, los, fk_org, ctrl_by, fetched_at = row
+        max_age = self.ttl if found else self.negative_ttl
+        if time.time() - fetched_at > max_age:
+            return False, None
+        if not found:
+            return True, None
+
+        return True, Caseworker(
+            ksp_identity=_decode_or_none(ksp, KspIdentity),
+            los_identity=_decode_or_none(los, LosIdentity),
+            fk_org_identity=_decode_or_none(fk_org, FkOrgIdentity),
+            caseworker_ctrl_by=_decode_or_none(ctrl_by, object),
+        )
+
+    def put(self, racfId, caseworker):
+        """Stores the lookup result for racfId. caseworker=None stores a negative entry."""
+        if caseworker:
+            values = (
+                1,
+                _json_or_none(caseworker.ksp_identity),
+                _json_or_none(caseworker.los_identity),
+                _json_or_none(caseworker.fk_org_identity),
+                _json_or_none(caseworker.caseworker_ctrl_by),
+            )
+        else:
+            values = (0, None, None, None, None)
+
+        with self._lock, self._conn:
+            self._conn.execute(f"""
+            INSERT INTO {TABLE_NAME} (racf_id, found, ksp_identity, los_identity, fk_org_identity, caseworker_ctrl_by, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(racf_id) DO UPDATE SET
+                found=excluded.found,
+                ksp_identity=excluded.ksp_identity,
+                los_identity=excluded.los_identity,
+                fk_org_identity=excluded.fk_org_identity,
+                caseworker_ctrl_by=excluded.caseworker_ctrl_by,
+                fetched_at=excluded.fetched_at
+            """, (racfId.strip().lower(), *values, time.time()))
+
+    def resolve(self, client, racfId, raw_responses=None):
+        """
+        Returns the caseworker for racfId from the directory, looking it up in Nova via client if the entry is missing or stale.
+        The bodies of a Nova lookup are appended to the list raw_responses, if given.
+        """
+        hit, caseworker = self.get(racfId)
+        if hit:
+            return caseworker
+        caseworker = client.lookup_caseworker_by_racfId(racfId.strip(), raw_responses=raw_responses)
+        self.put(racfId, caseworker)
+        return caseworker
+
+    def warm_up(self, client, racfIds):
+        """
+        Resolves every racfId in racfIds up front. The ones without a fresh entry are looked up
+        in one batch via client.lookup_caseworkers_by_racfIds.
+        Returns a dict of lowercased racfId -> caseworker or None.
+        """
+        resolved = {}
+        stale = []
+        for racfId in racfIds:
+            key = racfId.strip().lower()
+            if not key or key in resolved:
+                continue
+            hit, caseworker = self.get(key)
+            resolved[key] = caseworker
+            if not hit:
+                stale.append(racfId)
+
+        for key, caseworker in client.lookup_caseworkers_by_racfIds(stale).items():
+            self.put(key, caseworker)
+            resolved[key] = caseworker
+        return resolved
+
+
+def _json_or_none(value):
+    return None if value is None else msgspec.json.encode(value).decode("utf-8")
+
+
+def _decode_or_none(value, type_):
+    return None if value is None else msgspec.json.decode(value, type=type_)
@@ -0,0 +1,132 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import sandbox
+
+
+# Rows selected per claim, like a worker picking up its next batch
+CLAIM_BATCH_SIZE = 100
+
+
+def legacy_connect():
+    """A sagsflyt database as before the tuning: default journal and sync settings, no pending-row indexes."""
+    conn = sandbox.connect_db()
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("PRAGMA synchronous = FULL")
+    conn.execute(f"DROP INDEX IF EXISTS {sandbox.TABLE_NAME}_unprocessed")
+    conn.execute(f"DROP INDEX IF EXISTS {sandbox.TABLE_NAME}_unfinished")
+    return conn
+
+
+def input_rows(count):
+    return [(f"S2024-{i:06d}", f"AZ{i % 50:05d}", f"AZ{(i + 1) % 50:05d}") for i in range(count)]
+
+
+def row_updates(sagsnr):
+    updates = sandbox.empty_updates()
+    updates.update({
+        "fetch_case_status": 200,
+        "fetch_case_response": f'{{"cases":[{{"caseAttributes":{{"userFriendlyCaseNumber":"{sagsnr}"}}}}]}}',
+        "lookup_new_caseworker_status": 200,
+        "update_tasks_status": "updated:4;failed:0",
+        "update_case_status": 200,
+        "create_task_status": 200,
+        "case_uuid": sagsnr,
+        "processed_at": datetime.now().isoformat(timespec="seconds"),
+    })
+    return updates
+
+
+def ingest_legacy(conn, rows):
+    # One INSERT ... ON CONFLICT per row inside one transaction, as load_xlsx_into_db did
+    with conn:
+        for row in rows:
+            conn.execute(f"""
+            INSERT INTO {sandbox.TABLE_NAME} (sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler)
+            VALUES (?, ?, ?)
+            ON CONFLICT(sagsnummer) DO UPDATE SET
+                oprindelig_sagsbehandler=excluded.oprindelig_sagsbehandler,
+                ny_sagsbehandler=excluded.ny_sagsbehandler
+            """, row)
+
+
+def claim_legacy(conn):
+    # Select a batch of pending rows and mark it taken, until none are left; no leases
+    query = f"SELECT sagsnummer FROM {sandbox.TABLE_NAME} WHERE {sandbox.UNPROCESSED_CONDITION} LIMIT {CLAIM_BATCH_SIZE}"
+    while batch := conn.execute(query).fetchall():
+        with conn:
+            conn.executemany(f"UPDATE {sandbox.TABLE_NAME} SET fetch_case_status = 200 WHERE sagsnummer = ?", batch)
+
+
+def claim_leased(conn):
+    # Claim leased batches with claim_rows, mark them taken like claim_legacy and release them, as each worker of run does
+    worker_id = sandbox.new_worker_id()
+    while batch := sandbox.claim_rows(conn, worker_id, CLAIM_BATCH_SIZE):
+        sagsnrs = [row[0] for row in batch]
+        with conn:
+            conn.executemany(f"UPDATE {sandbox.TABLE_NAME} SET fetch_case_status = 200 WHERE sagsnummer = ?", [(sagsnr,) for sagsnr in sagsnrs])
+        sandbox.release_leases(conn, worker_id, sagsnrs)
+
+
+def update_legacy(conn, rows):
+    # One UPDATE and transaction per row, as the drivers did with save_row
+    for sagsnr, _, _ in rows:
+        sandbox.save_row(conn, sagsnr, row_updates(sagsnr))
+
+
+def update_batched(conn, rows):
+    writer = sandbox.RowWriter(conn)
+    for sagsnr, _, _ in rows:
+        writer.save(sagsnr, row_updates(sagsnr))
+    writer.flush()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def run_phases(connect, ingest, claim, update, rows):
+    """Returns phase -> seconds for one database set up by connect."""
+    conn = connect()
+    seconds = {
+        "ingest": timed(ingest, conn, rows),
+        # The same file again: the tuned upsert skips rows whose hash is unchanged
+        "reingest": timed(ingest, conn, rows),
+        "claim": timed(claim, conn),
+        "update": timed(update, conn, rows),
+    }
+    conn.close()
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare rows per second of the sagsflyt table before and after the SQLite tuning.")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows to ingest, re-ingest, claim and update.")
+    parser.add_argument("--workdir", help="Directory for the SQLite files. A fresh temporary directory by default.")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="sagsflyt-db-benchmark-")
+    rows = input_rows(args.rows)
+    results = {}
+    for name, connect, ingest, claim, update in (
+        ("legacy", legacy_connect, ingest_legacy, claim_legacy, update_legacy),
+        ("tuned", sandbox.connect_db, sandbox.upsert_input_rows, claim_leased, update_batched),
+    ):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+        os.chdir(os.path.join(workdir, name))
+        results[name] = run_phases(connect, ingest, claim, update, rows)
+
+    print(f"\n{args.rows} rows, SQLite files in {workdir}")
+    print(f"{'Phase':<8} {'legacy rows/s':>14} {'tuned rows/s':>14} {'speedup':>8}")
+    for phase in ("ingest", "reingest", "claim", "update"):
+        legacy, tuned = results["legacy"][phase], results["tuned"][phase]
+        print(f"{phase:<8} {args.rows / legacy:>14.0f} {args.rows / tuned:>14.0f} {legacy / tuned:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import csv
+import os
+from itertools import islice
+
+from openpyxl import load_workbook
+
+
+# Accepted header names (lowercased) per input field: the sheet from the business uses the Danish
+# names, older sheets made for convert_to_txt.py the short ones
+COLUMN_ALIASES = {
+    "sagsnummer": ("sagsnummer",),
+    "oldazident": ("oprindelig sagsbehandler", "oldazident"),
+    "newazident": ("ny sagsbehandler", "newazident"),
+}
+# Bytes of a CSV file read to detect its delimiter
+CSV_SNIFF_BYTES = 4096
+
+
+def _cell_text(value):
+    """Cell value as stripped text; whole numbers lose the ".0" Excel gives them."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _header_positions(header, path):
+    """Returns the positions of (sagsnummer, oldazident, newazident) in header."""
+    names = [_cell_text(name).lower() for name in header]
+    positions = []
+    for field, aliases in COLUMN_ALIASES.items():
+        position = next((names.index(alias) for alias in aliases if alias in names), None)
+        if position is None:
+            raise ValueError(f"{path} has no {field} column; expected one of {', '.join(repr(alias) for alias in aliases)}")
+        positions.append(position)
+    return positions
+
+
+def _project(rows, positions):
+    for row in rows:
+        values = tuple(_cell_text(row[position]) if position < len(row) else "" for position in positions)
+        # Rows without a case number cannot be stored; they are usually blank lines at the end of the sheet
+        if values[0]:
+            yield values
+
+
+def read_xlsx_rows(path):
+    """Streams (sagsnummer, oldazident, newazident) from the first sheet of an .xlsx file with a header row."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        positions = _header_positions(next(rows, ()), path)
+        yield from _project(rows, positions)
+    finally:
+        workbook.close()
+
+
+def read_csv_rows(path):
+    """Streams (sagsnummer, oldazident, newazident) from a CSV file with a header row, separated by , ; or tab."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        dialect = csv.Sniffer().sniff(f.read(CSV_SNIFF_BYTES), delimiters=",;\t")
+        f.seek(0)
+        rows = csv.reader(f, dialect)
+        positions = _header_positions(next(rows, []), path)
+        yield from _project(rows, positions)
+
+
+def read_txt_rows(path):
+    """Streams (sagsnummer, oldazident, newazident) from input_cases.txt lines "sagsnummer,oldazident,newazident"."""
+    with open(path, encoding="utf-8") as f:
+        yield from _project((line.split(",") for line in f if line.strip()), (0, 1, 2))
+
+
+def read_input_rows(path):
+    """Streams the input rows of an .xlsx, .csv or .txt file, picked by its extension."""
+    readers = {".xlsx": read_xlsx_rows, ".csv": read_csv_rows, ".txt": read_txt_rows}
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in readers:
+        raise ValueError(f"Cannot read {path}: expected one of {', '.join(readers)}")
+    return readers[extension](path)
+
+
+def batched(rows, size):
+    """Yields lists of up to size rows; keeps only one batch in memory."""
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
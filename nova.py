@@ -1,138 +1,332 @@
 import requests
+from requests.adapters import HTTPAdapter
+from nova_models import (
+    as_builtins,
+    decode_case_list,
+    decode_task_list,
+    racf_id_of,
+)
+from nova_throttle import (
+    DEFAULT_MAX_RETRIES,
+    AdaptiveRateLimiter,
+    CircuitBreaker,
+    LatencyTracker,
+    backoff_delay,
+    is_retryable_status,
+    retry_after_seconds,
+)
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+import json
+import os
+import threading
+import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
-def get_access_token(orchestrator_connection: OrchestratorConnection):
-    NovaToken = orchestrator_connection.get_credential("KMDAccessToken")
-    Secret = orchestrator_connection.get_credential("KMDClientSecret")
-    
-
-    NovaTokenAPI = NovaToken.username
-    secret = Secret.password
-    id = Secret.username
-    
-    # Authenticate
-    auth_payload = {
-        "client_secret": secret,
-        "grant_type": "client_credentials",
-        "client_id": id,
-        "scope": "client"
-    }
-    
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post(NovaTokenAPI, data=auth_payload, headers=headers)
 
-    response.raise_for_status()
-    access_token = response.json().get("access_token")
-    return access_token
+API_VERSION = "2.0-Case"
+
+# Read-only endpoints that are safe to retry on any transient failure, and to hedge
+IDEMPOTENT_ENDPOINTS = {"Case/GetList", "Task/GetList"}
+
+# (connect, read) timeouts in seconds per endpoint. Reads can return large pages, writes are small.
+DEFAULT_TIMEOUTS = {
+    "Case/GetList": (5, 60),
+    "Task/GetList": (5, 60),
+    "Task/Update": (5, 30),
+    "Task/Import": (5, 30),
+    "Case/Update": (5, 30),
+}
+# Timeouts for endpoints not listed above, and for the token endpoint
+DEFAULT_TIMEOUT = (5, 30)
+
+# Max number of keep-alive connections kept open to Nova per client
+DEFAULT_POOL_SIZE = 10
+
+# Output specification for the caseworker block, shared by the Case/GetList calls
+CASEWORKER_OUTPUT = {
+    "kspIdentity": {
+        "novaUserId": True,
+        "racfId": True,
+        "fullName": True
+    },
+    "fkOrgIdentity": {
+        "fkUuid": True,
+        "type": True,
+        "fullName": True
+    },
+    "losIdentity": {
+        "novaUnitId": True,
+        "administrativeUnitId": True,
+        "fullName": True,
+        "userKey": True
+    },
+    "caseworkerCtrlBy": True
+}
+
+# Output specifications for caseworker lookups, which only need the caseworker block
+CASEWORKER_LOOKUP_CASE_OUTPUT = {"caseworker": CASEWORKER_OUTPUT}
+CASEWORKER_LOOKUP_TASK_OUTPUT = {"caseworker": CASEWORKER_OUTPUT}
+
+# Max number of caseworker lookups run at once by lookup_caseworkers_by_racfIds
+DEFAULT_LOOKUP_CONCURRENCY = 4
+
+# Mapping of Task/GetList fields → Task/Update schema fields
+TASK_UPDATE_FIELD_MAPPING = {
+    "taskUuid": "uuid",
+    "caseUuid": "caseUuid",
+    "taskTitle": "title",
+    "taskDescription": "description",
+    "taskDeadline": "deadline",
+    "taskStartDate": "startDate",
+    "taskCloseDate": "closeDate",
+    "kle": "kle",
+    "taskStatusCode": "statusCode",
+    "taskType": "taskType",
+    "taskRepeat": "taskRepeat",
+}
+
+
+def _task_output_from_mapping():
+    """
+    Builds the Task/GetList output specification from the fields the update path consumes:
+    everything in TASK_UPDATE_FIELD_MAPPING plus the caseworker's racfId used to select tasks.
+    """
+    output = {}
+    for field in TASK_UPDATE_FIELD_MAPPING:
+        output[field] = {"taskTypeName": True} if field == "taskType" else True
+    output["caseworker"] = {"kspIdentity": {"racfId": True}}
+    return output
 
-def fetch_case(Sagsnummer, transaction, access_token, KMDNovaURL, orchestrator_connection: OrchestratorConnection):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
-    
-    Caseurl = f"{KMDNovaURL}/Case/GetList?api-version=2.0-Case"
 
-    data = {
-            "common": {
-                "transactionId": transaction
-            },
-            "paging": {
-                "startRow": 1,
-                "numberOfRows": 500
-            },
-            "caseAttributes": {
-                "userFriendlyCaseNumber": Sagsnummer
-            },
-           "caseGetOutput": {
-                "caseAttributes": {
-                    "userFriendlyCaseNumber": True
-                },
-                "caseworker": {
-                    "kspIdentity": {
-                        "novaUserId": True,
-                        "racfId": True,
-                        "fullName": True
-                    },
-                    "fkOrgIdentity": {
-                        "fkUuid": True,
-                        "type": True,
-                        "fullName": True
-                    },
-                    "losIdentity": {
-                        "novaUnitId": True,
-                        "administrativeUnitId": True,
-                        "fullName": True,
-                        "userKey": True
-                    },
-                    "caseworkerCtrlBy": True
-                }
-            }
-        }
+# Output specification for task listing; keeps Task/GetList responses to the fields we use
+TASK_GET_OUTPUT = _task_output_from_mapping()
 
-    response = requests.put(Caseurl, headers=headers, json=data)
+TRANSFER_TASK_TITLE = "99. Overført sag"
+# Output specification for looking for an existing transfer task; only the title and owner are needed
+TRANSFER_TASK_OUTPUT = {"taskTitle": True, "caseworker": {"kspIdentity": {"racfId": True}}}
 
-    response.raise_for_status()
+# Number of tasks requested per Task/GetList page
+TASK_PAGE_SIZE = 500
+# Max number of Task/GetList pages fetched at once for one case
+DEFAULT_PAGE_CONCURRENCY = 4
+# Number of cases requested per Case/GetList page
+CASE_PAGE_SIZE = 500
 
-    response_json = response.json()
-    return response_json
+# Token lifetime assumed when the token endpoint does not return expires_in
+DEFAULT_TOKEN_LIFETIME = 300
+# Refresh the token this many seconds before it expires
+DEFAULT_TOKEN_REFRESH_MARGIN = 60
 
-def get_task_list(transaction, case_uuid, access_token, KMDNovaURL):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
 
-    url = f"{KMDNovaURL}/Task/GetList?api-version=2.0-Case"
-    start_row = 1
-    page_size = 500
-    all_tasks = []
+def get_access_token(orchestrator_connection: OrchestratorConnection):
+    return AccessTokenProvider.from_orchestrator(orchestrator_connection).get_token()
 
-    while True:
-        data = {
-            "common": {
-                "transactionId": transaction
-            },
-            "paging": {
-                "startRow": start_row,
-                "numberOfRows": page_size
-            },
-            "caseUuid": case_uuid
-        }
 
-        response = requests.put(url, headers=headers, json=data)
-        response.raise_for_status()
-        response_json = response.json()
+class AccessTokenProvider:
+    """
+    Hands out a Nova access token and fetches a new one shortly before the current one expires.
 
-        task_page = response_json.get("taskList", [])
-        all_tasks.extend(task_page)
+    With cache_path set, the token is stored in a locked file, so parallel worker processes
+    share one token instead of each doing their own client-credentials round trip.
 
-        paging_info = response_json.get("pagingInformation", {})
-        if not paging_info.get("hasMoreRows", False):
-            break
+    Parameters:
+        token_url (str): URL of the KMD token endpoint.
+        client_id (str): Client id for the client-credentials grant.
+        client_secret (str): Client secret for the client-credentials grant.
+        refresh_margin (float): Seconds before expiry at which the token is refreshed.
+        cache_path (str): Optional path of the on-disk token cache shared between processes.
+    """
 
-        start_row += page_size
+    def __init__(self, token_url, client_id, client_secret, refresh_margin=DEFAULT_TOKEN_REFRESH_MARGIN, cache_path=None):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self.cache_path = cache_path
+        if cache_path:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), mode=0o700, exist_ok=True)
+
+        self._access_token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_orchestrator(cls, orchestrator_connection: OrchestratorConnection, **kwargs):
+        NovaToken = orchestrator_connection.get_credential("KMDAccessToken")
+        Secret = orchestrator_connection.get_credential("KMDClientSecret")
+        return cls(NovaToken.username, Secret.username, Secret.password, **kwargs)
+
+    def get_token(self):
+        with self._lock:
+            if not self._is_fresh():
+                if self.cache_path:
+                    with _FileLock(self.cache_path + ".lock"):
+                        self._read_cache()
+                        if not self._is_fresh():
+                            self._request_token()
+                            self._write_cache()
+                else:
+                    self._request_token()
+            return self._access_token
+
+    def invalidate(self, access_token=None):
+        """
+        Forgets the current token, e.g. after Nova answered 401.
+        If access_token is given, the token is only dropped if it is still the current one,
+        so a token another worker has already refreshed is kept.
+        """
+        with self._lock:
+            if access_token is not None and access_token != self._access_token:
+                return
+            self._access_token = None
+            self._expires_at = 0.0
+            if self.cache_path:
+                with _FileLock(self.cache_path + ".lock"):
+                    cached = self._load_cache_file()
+                    if cached and (access_token is None or cached.get("access_token") == access_token):
+                        os.remove(self.cache_path)
+
+    def _is_fresh(self):
+        return self._access_token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _request_token(self):
+        # Authenticate
+        auth_payload = {
+            "client_secret": self.client_secret,
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "scope": "client"
+        }
 
-    return all_tasks
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        response = requests.post(self.token_url, data=auth_payload, headers=headers, timeout=DEFAULT_TIMEOUT)
 
+        response.raise_for_status()
+        response_json = response.json()
+        self._access_token = response_json.get("access_token")
+        self._expires_at = time.time() + float(response_json.get("expires_in") or DEFAULT_TOKEN_LIFETIME)
+
+    def _load_cache_file(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("client_id") != self.client_id:
+            return None
+        return cached
+
+    def _read_cache(self):
+        cached = self._load_cache_file()
+        if cached:
+            self._access_token = cached.get("access_token")
+            self._expires_at = float(cached.get("expires_at", 0))
+
+    def _write_cache(self):
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        # Only the current user may read the token
+        with open(os.open(tmp_path, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600), "w", encoding="utf-8") as f:
+            json.dump({"client_id": self.client_id, "access_token": self._access_token, "expires_at": self._expires_at}, f)
+        os.replace(tmp_path, self.cache_path)
+
+
+class _FileLock:
+    """Cross-process lock based on exclusive creation of a lock file. Works the same on Windows and Linux."""
+
+    def __init__(self, path, timeout=30.0, stale_after=60.0):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                # A crashed process may have left its lock behind
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Could not acquire lock {self.path}")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc_info):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# ---------- Payload builders (shared by NovaClient and AsyncNovaClient) ----------
+
+def build_fetch_case_payload(Sagsnummer, transaction=None):
+    return {
+        "common": {
+            "transactionId": transaction or str(uuid.uuid4())
+        },
+        "paging": {
+            "startRow": 1,
+            "numberOfRows": 500
+        },
+        "caseAttributes": {
+            "userFriendlyCaseNumber": Sagsnummer
+        },
+        "caseGetOutput": {
+            "caseAttributes": {
+                "userFriendlyCaseNumber": True
+            },
+            "caseworker": CASEWORKER_OUTPUT
+        }
+    }
 
-def lookup_caseworker_by_racfId(racfId, transaction, access_token, KMDNovaURL):
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
+
+def build_task_list_payload(case_uuid, start_row, page_size, transaction=None, output=None, caseworker_racfId=None, status_codes=None):
+    """
+    Builds a Task/GetList payload for one page of a case's tasks.
+    output defaults to TASK_GET_OUTPUT; pass an empty dict to get every field.
+    caseworker_racfId and status_codes, if given, are sent as filters so Nova leaves out other tasks.
+    """
+    if output is None:
+        output = TASK_GET_OUTPUT
+    payload = {
+        "common": {
+            "transactionId": transaction or str(uuid.uuid4())
+        },
+        "paging": {
+            "startRow": start_row,
+            "numberOfRows": page_size
+        },
+        "caseUuid": case_uuid
     }
+    if caseworker_racfId:
+        payload["caseworker"] = {"kspIdentity": {"racfId": caseworker_racfId}}
+    if status_codes:
+        payload["statusCode"] = list(status_codes)
+    if output:
+        payload["taskGetOutput"] = output
+    return payload
 
-    # First: Try searching cases
-    case_url = f"{KMDNovaURL}/Case/GetList?api-version=2.0-Case"
-    case_data = {
+
+def build_case_lookup_payload(racfId, transaction=None, start_row=1, page_size=500, minimal=False):
+    """
+    Builds a Case/GetList payload filtered on the caseworker's racfId.
+    With minimal=True only the caseworker block is requested, for lookups that need nothing else.
+    """
+    payload = {
         "common": {
-            "transactionId": transaction
+            "transactionId": transaction or str(uuid.uuid4())
         },
         "paging": {
-            "startRow": 1,
-            "numberOfRows": 500
+            "startRow": start_row,
+            "numberOfRows": page_size
         },
         "caseWorker": {
             "kspIdentity": {
@@ -143,44 +337,22 @@ def lookup_caseworker_by_racfId(racfId, transaction, access_token, KMDNovaURL):
             "caseAttributes": {
                 "userFriendlyCaseNumber": True
             },
-            "caseworker": {
-                "kspIdentity": {
-                    "novaUserId": True,
-                    "racfId": True,
-                    "fullName": True
-                },
-                "fkOrgIdentity": {
-                    "fkUuid": True,
-                    "type": True,
-                    "fullName": True
-                },
-                "losIdentity": {
-                    "novaUnitId": True,
-                    "administrativeUnitId": True,
-                    "fullName": True,
-                    "userKey": True
-                },
-                "caseworkerCtrlBy": True
-            }
+            "caseworker": CASEWORKER_OUTPUT
         }
     }
+    if minimal:
+        payload["caseGetOutput"] = CASEWORKER_LOOKUP_CASE_OUTPUT
+    return payload
 
-    case_response = requests.put(case_url, headers=headers, json=case_data)
-    case_response.raise_for_status()
-    case_json = case_response.json()
-
-    # Check if any case matches the RACF ID
-    for case in case_json.get("cases", []):
-        caseworker = case.get("caseworker", {})
-        ksp = caseworker.get("kspIdentity", {})
-        if ksp.get("racfId", "").lower() == racfId.lower():
-            return caseworker
 
-    # Second: Try searching tasks
-    task_url = f"{KMDNovaURL}/Task/GetList?api-version=2.0-Case"
-    task_data = {
+def build_task_lookup_payload(racfId, transaction=None, minimal=False):
+    """
+    Builds a Task/GetList payload filtered on the caseworker's racfId.
+    With minimal=True a single row is requested and only its caseworker block is returned.
+    """
+    payload = {
         "common": {
-            "transactionId": str(uuid.uuid4())
+            "transactionId": transaction or str(uuid.uuid4())
         },
         "caseworker": {
             "kspIdentity": {
@@ -189,54 +361,77 @@ def lookup_caseworker_by_racfId(racfId, transaction, access_token, KMDNovaURL):
         },
         "paging": {
             "startRow": 1,
-            "numberOfRows": 500
+            "numberOfRows": 1 if minimal else 500
         }
     }
+    if minimal:
+        payload["taskGetOutput"] = CASEWORKER_LOOKUP_TASK_OUTPUT
+    return payload
 
-    task_response = requests.put(task_url, headers=headers, json=task_data)
-    task_response.raise_for_status()
-    task_json = task_response.json()
 
-    for task in task_json.get("taskList", []):
-        caseworker = task.get("caseworker", {})
-        ksp = caseworker.get("kspIdentity", {})
-        if ksp.get("racfId", "").lower() == racfId.lower():
-            return caseworker
+def next_page_starts(next_row, paging_info, max_concurrency):
+    """
+    Returns the start rows of the next batch of pages to fetch concurrently.
+    If paging_info holds the total row count, the batch covers the rest of the list (capped at
+    max_concurrency pages); otherwise max_concurrency pages are fetched speculatively.
+    """
+    total_rows = paging_info.total_number_of_rows or paging_info.number_of_rows
+    if isinstance(total_rows, int) and total_rows >= next_row:
+        page_count = -(-(total_rows - next_row + 1) // TASK_PAGE_SIZE)
+    else:
+        page_count = max_concurrency
+    page_count = max(1, min(page_count, max_concurrency))
+    return [next_row + i * TASK_PAGE_SIZE for i in range(page_count)]
 
-    return None  # No match found
 
+def keep_raw_response(raw_responses, content):
+    """Appends the response body content to raw_responses, unless it is None."""
+    if raw_responses is not None:
+        raw_responses.append(content)
 
-def update_caseworker_task(task, access_token, KMDNovaURL, new_caseworker):
+
+def index_cases_by_number(cases):
+    """Indexes cases on lowercased userFriendlyCaseNumber."""
+    index = {}
+    for case in cases:
+        number = case.case_number
+        if number:
+            index[number.strip().lower()] = case
+    return index
+
+
+def find_caseworker(items, racfId):
+    """Returns the Caseworker of the first case or task in items that belongs to racfId."""
+    for item in items:
+        if racf_id_of(item) == racfId.lower():
+            return item.caseworker
+    return None
+
+
+def is_transfer_task(task, racfId):
+    """True if task is a TRANSFER_TASK_TITLE notification assigned to racfId."""
+    owner = task.caseworker.racf_id if task.caseworker is not None else None
+    return task.task_title == TRANSFER_TASK_TITLE and (owner or "").lower() == (racfId or "").strip().lower()
+
+
+def build_task_update_payload(task, new_caseworker):
     """
-    Updates a single task's caseworker via the KMD Nova Task/Update API.
+    Builds the Task/Update payload that moves a task to new_caseworker.
+    task and new_caseworker may be models or dicts in the wire format.
     - Renames task-prefixed fields to match schema.
     - Filters and includes only schema-allowed fields.
     - Replaces the caseworker field with the new kspIdentity.
     """
+    task = as_builtins(task)
 
     # Ensure kspIdentity is provided
-    new_ksp_identity = new_caseworker.get("kspIdentity")
+    new_ksp_identity = as_builtins(new_caseworker).get("kspIdentity")
     if not new_ksp_identity:
         raise ValueError("new_caseworker must contain 'kspIdentity'")
 
-    # Mapping of Task/GetList fields → Task/Update schema fields
-    field_mapping = {
-        "taskUuid": "uuid",
-        "caseUuid": "caseUuid",
-        "taskTitle": "title",
-        "taskDescription": "description",
-        "taskDeadline": "deadline",
-        "taskStartDate": "startDate",
-        "taskCloseDate": "closeDate",
-        "kle": "kle",
-        "taskStatusCode": "statusCode",
-        "taskType": "taskType",
-        "taskRepeat": "taskRepeat",
-    }
-
     # Extract and rename allowed fields
     transformed_task = {}
-    for old_key, new_key in field_mapping.items():
+    for old_key, new_key in TASK_UPDATE_FIELD_MAPPING.items():
         if old_key == "taskType":
             task_type_obj = task.get(old_key)
             if isinstance(task_type_obj, dict):
@@ -250,56 +445,26 @@ def update_caseworker_task(task, access_token, KMDNovaURL, new_caseworker):
     transformed_task["caseworker"] = {"kspIdentity": new_ksp_identity}
 
     # Build final payload with flattened structure
-    payload = {
+    return {
         "common": {
             "transactionId": str(uuid.uuid4())
         },
         **transformed_task
     }
 
-    # Perform the update call
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
 
-    url = f"{KMDNovaURL}/Task/Update?api-version=2.0-Case"
-    response = requests.put(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.status_code
-
-def create_task(case_uuid, new_caseworker, description, access_token, KMDNovaURL):
-    """
-    Imports a new task using the KMD Nova API.
-
-    Parameters:
-        case_uuid (str): UUID of the related case.
-        new_caseworker (dict): Dictionary containing 'kspIdentity' info (from lookup_caseworker_by_racfId).
-        description (str): Description of the task.
-        access_token (str): Bearer token for authorization.
-        KMDNovaURL (str): Base URL of the KMD Nova API.
-
-    Returns:
-        dict: JSON response from the API.
-    """
-
-    ksp_identity = new_caseworker.get("kspIdentity")
+def build_create_task_payload(case_uuid, new_caseworker, description):
+    ksp_identity = as_builtins(new_caseworker).get("kspIdentity")
     if not ksp_identity:
         raise ValueError("new_caseworker must contain 'kspIdentity'")
 
-    url = f"{KMDNovaURL}/Task/Import?api-version=2.0-Case"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
-
-    payload = {
+    return {
         "common": {
             "transactionId": str(uuid.uuid4()),
             "uuid": case_uuid
         },
         "caseUuid": case_uuid,
-        "title": "99. Overført sag",
+        "title": TRANSFER_TASK_TITLE,
         "description": description,
         "startDate": datetime.now().isoformat(),
         "statusCode": "N",  # Default to "New"
@@ -309,22 +474,13 @@ def create_task(case_uuid, new_caseworker, description, access_token, KMDNovaURL
         }
     }
 
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.status_code
 
-
-
-def update_caseworker_case(case_uuid, new_caseworker, access_token, KMDNovaURL):
-    """
-    Updates the caseworker on a case using the full kspIdentity element
-    from the new_caseworker lookup result.
-    """
-    ksp_identity = new_caseworker.get("kspIdentity")
+def build_case_update_payload(case_uuid, new_caseworker):
+    ksp_identity = as_builtins(new_caseworker).get("kspIdentity")
     if not ksp_identity:
         raise ValueError("new_caseworker must contain 'kspIdentity'")
 
-    payload = {
+    return {
         "common": {
             "transactionId": str(uuid.uuid4()),
             "uuid": case_uuid
@@ -332,22 +488,403 @@ def update_caseworker_case(case_uuid, new_caseworker, access_token, KMDNovaURL):
         "caseworker": {
             "kspIdentity": ksp_identity
         }
-    
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}"
-    }
 
-    url = f"{KMDNovaURL}/Case/Update?api-version=2.0-Case"
+class NovaClient:
+    """
+    Pooled, keep-alive client for the KMD Nova API.
+
+    All calls go through one requests.Session, so the TCP and TLS connections to Nova
+    are reused across calls instead of being set up again for every request.
+
+    Parameters:
+        KMDNovaURL (str): Base URL of the KMD Nova API.
+        access_token (str): Bearer token for authorization. Not needed if token_provider is given.
+        pool_size (int): Max number of connections kept open to Nova. Should be at least
+            the number of threads sharing the client.
+        token_provider (AccessTokenProvider): Optional provider used instead of a fixed access_token.
+            The token is then refreshed before it expires, and a request answered with 401 is retried
+            once with a new token.
+        rate_limiter (AdaptiveRateLimiter): Per-endpoint limiter; a default one is created if not given.
+            Pass the same instance to several clients to make them share it.
+        circuit_breaker (CircuitBreaker): Breaker pausing all calls when Nova is down; created if not given.
+        max_retries (int): Retries for reads (GetList) on 429, 5xx and connection errors, and for
+            writes on 429 only, with jittered exponential backoff.
+        timeouts (dict): Per-endpoint (connect, read) timeouts overriding DEFAULT_TIMEOUTS.
+        hedge (HedgePolicy): Optional hedging for idempotent reads. If a read has not answered within
+            the policy's delay, a duplicate request is sent and the first response wins.
+            Writes are never hedged.
+        adapter (requests.adapters.BaseAdapter): Transport mounted on the session instead of the pooled
+            HTTPAdapter, e.g. a RecordingAdapter or ReplayAdapter from nova_replay.py.
+        metrics (MetricsRecorder): Optional recorder receiving the endpoint, status, latency and
+            response size of every HTTP attempt, see nova_metrics.py.
+    """
+
+    def __init__(self, KMDNovaURL, access_token=None, pool_size=DEFAULT_POOL_SIZE, token_provider=None,
+                 rate_limiter=None, circuit_breaker=None, max_retries=DEFAULT_MAX_RETRIES, timeouts=None, hedge=None, adapter=None,
+                 metrics=None):
+        if access_token is None and token_provider is None:
+            raise ValueError("NovaClient needs either an access_token or a token_provider")
+        self.base_url = KMDNovaURL.rstrip("/")
+        self.access_token = access_token
+        self.token_provider = token_provider
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.hedge = hedge
+        self.metrics = metrics
+        self.latencies = LatencyTracker()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=pool_size) if hedge else None
+
+        self.session = requests.Session()
+        adapter = adapter or HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+
+    def _url(self, endpoint):
+        return f"{self.base_url}/{endpoint}?api-version={API_VERSION}"
+
+    def _token(self):
+        if self.token_provider is not None:
+            return self.token_provider.get_token()
+        return self.access_token
+
+    def _attempt(self, method, endpoint, payload, access_token):
+        """Sends one HTTP request and records its latency."""
+        headers = {"Authorization": f"Bearer {access_token}"}
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self._url(endpoint), headers=headers, json=payload,
+                                            timeout=self.timeouts.get(endpoint, DEFAULT_TIMEOUT))
+        except requests.RequestException:
+            if self.metrics is not None:
+                self.metrics.record_request(endpoint, None, time.perf_counter() - started)
+            raise
+        elapsed = time.perf_counter() - started
+
+        if response.status_code < 400:
+            self.latencies.record(endpoint, elapsed)
+        if self.metrics is not None:
+            self.metrics.record_request(endpoint, response.status_code, elapsed, len(response.content))
+        return response
+
+    def _send(self, method, endpoint, payload):
+        access_token = self._token()
+        response = self._attempt(method, endpoint, payload, access_token)
+
+        # The token may have been revoked or expired early; retry once with a fresh one
+        if response.status_code == 401 and self.token_provider is not None:
+            self.token_provider.invalidate(access_token)
+            response = self._attempt(method, endpoint, payload, self._token())
+
+        return response
+
+    def _send_hedged(self, method, endpoint, payload):
+        """
+        Sends a read and, if it has not answered within the hedge delay, a duplicate of it.
+        Returns the first 2xx response; the slower one is discarded. An error response or failure is
+        only returned once the other attempt has finished too, so a fast 429 does not beat a slower 200.
+        """
+        delay = self.hedge.delay(self.latencies, endpoint)
+        if delay is None:
+            return self._send(method, endpoint, payload)
+
+        first = self._hedge_pool.submit(self._send, method, endpoint, payload)
+        done, _ = wait([first], timeout=delay)
+        # Do not add load while Nova is throttling us; a hedge that is not sent takes no token
+        if done or not self.rate_limiter.try_reserve(endpoint):
+            return first.result()
+
+        second = self._hedge_pool.submit(self._send, method, endpoint, payload)
+        pending = {first, second}
+        answered = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future.result().status_code < 300:
+                        return future.result()
+                    answered = future
+        # Neither attempt succeeded; hand an error response to _request's retry handling, or else the first one's error
+        return (answered or first).result()
+
+    def _wait_for_capacity(self, endpoint):
+        """Blocks while the circuit is open, then until the endpoint's rate limiter lets a request through."""
+        while (delay := self.circuit_breaker.before_call()) > 0:
+            time.sleep(delay)
+        delay = self.rate_limiter.reserve(endpoint)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _request(self, method, endpoint, payload):
+        idempotent = endpoint in IDEMPOTENT_ENDPOINTS
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            self._wait_for_capacity(endpoint)
+
+            try:
+                if idempotent and self.hedge is not None:
+                    response = self._send_hedged(method, endpoint, payload)
+                else:
+                    response = self._send(method, endpoint, payload)
+            except (requests.ConnectionError, requests.Timeout):
+                self.circuit_breaker.record_failure()
+                if last_attempt or not idempotent:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            except requests.RequestException:
+                self.circuit_breaker.record_failure()
+                raise
+            except BaseException:
+                # Not an answer from Nova (e.g. the token cache lock timed out); do not leave the circuit waiting on this call
+                self.circuit_breaker.release_probe()
+                raise
+
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+            if response.status_code == 429:
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                self.rate_limiter.on_throttled(endpoint, retry_after)
+                if not last_attempt:
+                    time.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+                    continue
+            elif response.status_code < 400:
+                self.rate_limiter.on_success(endpoint)
+
+            if not last_attempt and is_retryable_status(response.status_code, idempotent):
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def fetch_case(self, Sagsnummer, transaction=None, raw_responses=None):
+        """
+        Returns the cases with the given Sagsnummer as a CaseList.
+        The body Nova sent is appended to the list raw_responses, if given.
+        """
+        response = self._request("PUT", "Case/GetList", build_fetch_case_payload(Sagsnummer, transaction))
+        keep_raw_response(raw_responses, response.content)
+        return decode_case_list(response.content)
+
+    def _get_task_page(self, case_uuid, start_row, transaction=None, output=None, caseworker_racfId=None, status_codes=None,
+                       raw_responses=None):
+        data = build_task_list_payload(case_uuid, start_row, TASK_PAGE_SIZE, transaction, output, caseworker_racfId, status_codes)
+        content = self._request("PUT", "Task/GetList", data).content
+        keep_raw_response(raw_responses, content)
+        task_list = decode_task_list(content)
+        return task_list.task_list, task_list.paging_information
+
+    def get_task_list(self, case_uuid, transaction=None, max_concurrency=DEFAULT_PAGE_CONCURRENCY, stop_when=None, output=None,
+                      caseworker_racfId=None, status_codes=None, raw_responses=None):
+        """
+        Returns all tasks on a case as a list of Task, fetched in pages of TASK_PAGE_SIZE.
+
+        The first page tells how many rows there are (or at least that there are more), after which
+        the remaining pages are fetched up to max_concurrency at a time and merged in order.
+
+        Parameters:
+            case_uuid (str): UUID of the case.
+            transaction (str): Optional transaction id for the requests.
+            max_concurrency (int): Max number of pages fetched at once.
+            stop_when (callable): Optional predicate on the tasks merged so far. Paging stops
+                as soon as it returns True.
+            output (dict): Output specification sent as taskGetOutput. Defaults to TASK_GET_OUTPUT,
+                the fields update_caseworker_task needs; an empty dict returns every field.
+            caseworker_racfId (str): Only return tasks assigned to this racfId.
+            status_codes (list): Only return tasks with one of these status codes, e.g. ["N"].
+            raw_responses (list): Optional list the body of every page is appended to, in the order they arrive.
+        """
+        filters = {"caseworker_racfId": caseworker_racfId, "status_codes": status_codes, "raw_responses": raw_responses}
+        all_tasks, paging_info = self._get_task_page(case_uuid, 1, transaction, output, **filters)
+        next_row = 1 + TASK_PAGE_SIZE
+        has_more = paging_info.has_more_rows
+        if stop_when and stop_when(all_tasks):
+            return all_tasks
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+            while has_more:
+                start_rows = next_page_starts(next_row, paging_info, max_concurrency)
+                pages = list(pool.map(lambda start_row: self._get_task_page(case_uuid, start_row, transaction, output, **filters), start_rows))
+
+                for task_page, paging_info in pages:
+                    all_tasks.extend(task_page)
+                    has_more = paging_info.has_more_rows
+                    if not has_more:
+                        break
+
+                next_row = start_rows[-1] + TASK_PAGE_SIZE
+                if stop_when and stop_when(all_tasks):
+                    break
+
+        return all_tasks
+
+    def has_transfer_task(self, case_uuid, racfId, transaction=None):
+        """
+        True if the case already has a transfer notification task (open or closed) assigned to racfId,
+        i.e. create_task already ran for this move. Paging stops at the first match.
+        """
+        tasks = self.get_task_list(case_uuid, transaction, stop_when=lambda tasks: any(is_transfer_task(t, racfId) for t in tasks),
+                                   output=TRANSFER_TASK_OUTPUT, caseworker_racfId=racfId)
+        return any(is_transfer_task(t, racfId) for t in tasks)
+
+    def list_cases_by_caseworker(self, racfId, transaction=None):
+        """Pages through Case/GetList and returns every case owned by racfId as a list of Case."""
+        start_row = 1
+        all_cases = []
+
+        while True:
+            data = build_case_lookup_payload(racfId, transaction, start_row, CASE_PAGE_SIZE)
+            case_list = decode_case_list(self._request("PUT", "Case/GetList", data).content)
+
+            all_cases.extend(case_list.cases)
+
+            if not case_list.paging_information.has_more_rows:
+                break
+
+            start_row += CASE_PAGE_SIZE
+
+        return all_cases
+
+    def lookup_caseworker_by_racfId(self, racfId, transaction=None, minimal=True, raw_responses=None):
+        """
+        Returns the Caseworker (kspIdentity, losIdentity, fkOrgIdentity, ...) for racfId, or None.
+
+        The default minimal mode asks Nova for a single row with only the caseworker fields and stops
+        at the first hit, so the cost does not grow with the number of cases the person owns.
+        With minimal=False up to 500 full rows are fetched, as in earlier versions.
+        The bodies Nova sent are appended to the list raw_responses, if given.
+        """
+        page_size = 1 if minimal else 500
+
+        # First: Try searching cases
+        data = build_case_lookup_payload(racfId, transaction, page_size=page_size, minimal=minimal)
+        content = self._request("PUT", "Case/GetList", data).content
+        keep_raw_response(raw_responses, content)
+        caseworker = find_caseworker(decode_case_list(content).cases, racfId)
+        if caseworker:
+            return caseworker
+
+        # Second: Try searching tasks
+        content = self._request("PUT", "Task/GetList", build_task_lookup_payload(racfId, minimal=minimal)).content
+        keep_raw_response(raw_responses, content)
+        return find_caseworker(decode_task_list(content).task_list, racfId)
+
+    def lookup_caseworkers_by_racfIds(self, racfIds, max_concurrency=DEFAULT_LOOKUP_CONCURRENCY):
+        """
+        Resolves many racfIds at once. Nova's GetList calls only filter on one caseworker, so the
+        distinct racfIds are looked up concurrently in minimal mode rather than in one request.
+
+        Returns:
+            dict: Lowercased racfId -> Caseworker, or None if not found.
+        """
+        distinct = {}
+        for racfId in racfIds:
+            if racfId and racfId.strip():
+                distinct.setdefault(racfId.strip().lower(), racfId.strip())
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+            caseworkers = pool.map(self.lookup_caseworker_by_racfId, distinct.values())
+            return dict(zip(distinct.keys(), caseworkers))
+
+    def update_caseworker_task(self, task, new_caseworker):
+        """Updates a single task's caseworker via the KMD Nova Task/Update API. See build_task_update_payload."""
+        response = self._request("PUT", "Task/Update", build_task_update_payload(task, new_caseworker))
+        return response.status_code
+
+    def create_task(self, case_uuid, new_caseworker, description):
+        """
+        Imports a new task using the KMD Nova API.
+
+        Parameters:
+            case_uuid (str): UUID of the related case.
+            new_caseworker (Caseworker): The new caseworker (from lookup_caseworker_by_racfId).
+            description (str): Description of the task.
+
+        Returns:
+            int: HTTP status code of the import call.
+        """
+        response = self._request("POST", "Task/Import", build_create_task_payload(case_uuid, new_caseworker, description))
+        return response.status_code
+
+    def update_caseworker_case(self, case_uuid, new_caseworker):
+        """
+        Updates the caseworker on a case using the full kspIdentity element
+        from the new_caseworker lookup result.
+        """
+        payload = build_case_update_payload(case_uuid, new_caseworker)
+
+        try:
+            response = self._request("PATCH", "Case/Update", payload)
+        except requests.RequestException:
+            print(f"Failed for {case_uuid}, check if succesful")
+            raise
+
+        return response.status_code
+
+
+# Clients shared by the module-level functions below, one per Nova base URL
+_shared_clients: dict[str, NovaClient] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(KMDNovaURL, access_token):
+    """
+    Returns the process-wide NovaClient for KMDNovaURL, creating it on first use.
+    The client's token is updated to access_token, so callers can keep passing the
+    token they hold without losing the pooled connections.
+    """
+    with _shared_clients_lock:
+        client = _shared_clients.get(KMDNovaURL)
+        if client is None:
+            client = NovaClient(KMDNovaURL, access_token)
+            _shared_clients[KMDNovaURL] = client
+        client.access_token = access_token
+    return client
+
+
+# The functions below keep the dict-based interface used before NovaClient; models are converted to
+# plain dicts with the camelCase wire names on the way out.
+
+# pylint: disable-next=unused-argument
+def fetch_case(Sagsnummer, transaction, access_token, KMDNovaURL, orchestrator_connection: OrchestratorConnection):
+    return as_builtins(get_shared_client(KMDNovaURL, access_token).fetch_case(Sagsnummer, transaction))
+
+
+def get_task_list(transaction, case_uuid, access_token, KMDNovaURL):
+    return as_builtins(get_shared_client(KMDNovaURL, access_token).get_task_list(case_uuid, transaction))
 
-    try:
-        response = requests.patch(url, headers=headers, json=payload)
-    except:
-        print(f"Failed for {case_uuid}, check if succesful")
-    response.raise_for_status()
 
-    return response.status_code
+def lookup_caseworker_by_racfId(racfId, transaction, access_token, KMDNovaURL):
+    return as_builtins(get_shared_client(KMDNovaURL, access_token).lookup_caseworker_by_racfId(racfId, transaction))
 
 
+def update_caseworker_task(task, access_token, KMDNovaURL, new_caseworker):
+    return get_shared_client(KMDNovaURL, access_token).update_caseworker_task(task, new_caseworker)
+
+
+def create_task(case_uuid, new_caseworker, description, access_token, KMDNovaURL):
+    return get_shared_client(KMDNovaURL, access_token).create_task(case_uuid, new_caseworker, description)
+
+
+def update_caseworker_case(case_uuid, new_caseworker, access_token, KMDNovaURL):
+    return get_shared_client(KMDNovaURL, access_token).update_caseworker_case(case_uuid, new_caseworker)
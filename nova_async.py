@@ -0,0 +1,309 @@
+import asyncio
+import time
+
+import aiohttp
+import requests
+
+from nova import (
+    API_VERSION,
+    CASE_PAGE_SIZE,
+    DEFAULT_PAGE_CONCURRENCY,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    DEFAULT_TIMEOUTS,
+    IDEMPOTENT_ENDPOINTS,
+    TASK_PAGE_SIZE,
+    TRANSFER_TASK_OUTPUT,
+    build_case_lookup_payload,
+    build_case_update_payload,
+    build_create_task_payload,
+    build_fetch_case_payload,
+    build_task_list_payload,
+    build_task_lookup_payload,
+    build_task_update_payload,
+    find_caseworker,
+    is_transfer_task,
+    keep_raw_response,
+    next_page_starts,
+)
+from nova_models import decode_case_list, decode_task_list
+from nova_throttle import (
+    DEFAULT_MAX_RETRIES,
+    AdaptiveRateLimiter,
+    CircuitBreaker,
+    LatencyTracker,
+    backoff_delay,
+    is_retryable_status,
+    retry_after_seconds,
+)
+
+# Max number of Nova requests in flight at once, across all rows
+DEFAULT_MAX_IN_FLIGHT = 10
+
+
+class AsyncNovaClient:
+    """
+    Asyncio version of NovaClient built on aiohttp.
+
+    Uses the same payload builders as nova.py, one connection pool, and a semaphore that caps
+    the number of requests in flight across everything sharing the client.
+    Must be used as an async context manager:
+
+        async with AsyncNovaClient(Nova_URL, token_provider=provider) as client:
+            ...
+
+    Parameters:
+        KMDNovaURL (str): Base URL of the KMD Nova API.
+        access_token (str): Bearer token for authorization. Not needed if token_provider is given.
+        max_in_flight (int): Global limit on concurrent requests.
+        pool_size (int): Max number of connections kept open to Nova.
+        token_provider (AccessTokenProvider): Optional provider used instead of a fixed access_token.
+        rate_limiter (AdaptiveRateLimiter): Per-endpoint limiter; a default one is created if not given.
+        circuit_breaker (CircuitBreaker): Breaker pausing all calls when Nova is down; created if not given.
+        max_retries (int): Retries on transient failures, see NovaClient.
+        timeouts (dict): Per-endpoint (connect, read) timeouts overriding DEFAULT_TIMEOUTS.
+        hedge (HedgePolicy): Optional hedging for idempotent reads, see NovaClient. Writes are never hedged.
+        metrics (MetricsRecorder): Optional recorder for every HTTP attempt, see NovaClient.
+    """
+
+    def __init__(self, KMDNovaURL, access_token=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT, pool_size=DEFAULT_POOL_SIZE, token_provider=None,
+                 rate_limiter=None, circuit_breaker=None, max_retries=DEFAULT_MAX_RETRIES, timeouts=None, hedge=None, metrics=None):
+        if access_token is None and token_provider is None:
+            raise ValueError("AsyncNovaClient needs either an access_token or a token_provider")
+        self.base_url = KMDNovaURL.rstrip("/")
+        self.access_token = access_token
+        self.token_provider = token_provider
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.hedge = hedge
+        self.metrics = metrics
+        self.latencies = LatencyTracker()
+        self.pool_size = max(pool_size, max_in_flight)
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector, headers={"Content-Type": "application/json"})
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def _url(self, endpoint):
+        return f"{self.base_url}/{endpoint}?api-version={API_VERSION}"
+
+    async def _token(self):
+        if self.token_provider is not None:
+            # The provider does blocking HTTP and file locking, keep it off the event loop
+            return await asyncio.to_thread(self.token_provider.get_token)
+        return self.access_token
+
+    async def _send(self, method, endpoint, payload, access_token):
+        headers = {"Authorization": f"Bearer {access_token}"}
+        connect_timeout, read_timeout = self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                async with self.session.request(method, self._url(endpoint), headers=headers, json=payload, timeout=timeout) as response:
+                    body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if self.metrics is not None:
+                    self.metrics.record_request(endpoint, None, time.perf_counter() - started)
+                raise
+            elapsed = time.perf_counter() - started
+            if response.status < 400:
+                self.latencies.record(endpoint, elapsed)
+            if self.metrics is not None:
+                self.metrics.record_request(endpoint, response.status, elapsed, len(body))
+            return response, (body if response.status < 400 else None)
+
+    async def _send_with_token(self, method, endpoint, payload):
+        access_token = await self._token()
+        response, body = await self._send(method, endpoint, payload, access_token)
+
+        # The token may have been revoked or expired early; retry once with a fresh one
+        if response.status == 401 and self.token_provider is not None:
+            await asyncio.to_thread(self.token_provider.invalidate, access_token)
+            response, body = await self._send(method, endpoint, payload, await self._token())
+
+        return response, body
+
+    async def _send_hedged(self, method, endpoint, payload):
+        """Async version of NovaClient._send_hedged."""
+        delay = self.hedge.delay(self.latencies, endpoint)
+        if delay is None:
+            return await self._send_with_token(method, endpoint, payload)
+
+        first = asyncio.ensure_future(self._send_with_token(method, endpoint, payload))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        # Do not add load while Nova is throttling us; a hedge that is not sent takes no token
+        if done or not self.rate_limiter.try_reserve(endpoint):
+            return await first
+
+        second = asyncio.ensure_future(self._send_with_token(method, endpoint, payload))
+        pending = {first, second}
+        answered = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task.result()[0].status < 300:
+                        for other in pending:
+                            other.cancel()
+                        return task.result()
+                    answered = task
+        # Neither attempt succeeded; hand an error response to _request's retry handling, or else the first one's error
+        return await (answered or first)
+
+    async def _wait_for_capacity(self, endpoint):
+        while (delay := self.circuit_breaker.before_call()) > 0:
+            await asyncio.sleep(delay)
+        delay = self.rate_limiter.reserve(endpoint)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _request(self, method, endpoint, payload):
+        """
+        Sends one request and returns (status_code, body bytes).
+        Retries, rate limiting and circuit breaking follow NovaClient._request.
+        """
+        idempotent = endpoint in IDEMPOTENT_ENDPOINTS
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            await self._wait_for_capacity(endpoint)
+
+            try:
+                if idempotent and self.hedge is not None:
+                    response, body = await self._send_hedged(method, endpoint, payload)
+                else:
+                    response, body = await self._send_with_token(method, endpoint, payload)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.circuit_breaker.record_failure()
+                if last_attempt or not idempotent:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            except (aiohttp.ClientError, requests.RequestException):
+                self.circuit_breaker.record_failure()
+                raise
+            except BaseException:
+                # Not an answer from Nova (e.g. cancelled, or the token cache lock timed out); do not leave the circuit waiting on this call
+                self.circuit_breaker.release_probe()
+                raise
+
+            if response.status >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+            if response.status == 429:
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+                self.rate_limiter.on_throttled(endpoint, retry_after)
+                if not last_attempt:
+                    await asyncio.sleep(retry_after if retry_after is not None else backoff_delay(attempt))
+                    continue
+            elif response.status < 400:
+                self.rate_limiter.on_success(endpoint)
+
+            if not last_attempt and is_retryable_status(response.status, idempotent):
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+
+            response.raise_for_status()
+            return response.status, body
+
+    async def fetch_case(self, Sagsnummer, transaction=None, raw_responses=None):
+        _, body = await self._request("PUT", "Case/GetList", build_fetch_case_payload(Sagsnummer, transaction))
+        keep_raw_response(raw_responses, body)
+        return decode_case_list(body)
+
+    async def _get_task_page(self, case_uuid, start_row, transaction=None, output=None, caseworker_racfId=None, status_codes=None,
+                             raw_responses=None):
+        data = build_task_list_payload(case_uuid, start_row, TASK_PAGE_SIZE, transaction, output, caseworker_racfId, status_codes)
+        _, body = await self._request("PUT", "Task/GetList", data)
+        keep_raw_response(raw_responses, body)
+        task_list = decode_task_list(body)
+        return task_list.task_list, task_list.paging_information
+
+    async def get_task_list(self, case_uuid, transaction=None, max_concurrency=DEFAULT_PAGE_CONCURRENCY, stop_when=None, output=None,
+                            caseworker_racfId=None, status_codes=None, raw_responses=None):
+        """Async version of NovaClient.get_task_list."""
+        filters = {"caseworker_racfId": caseworker_racfId, "status_codes": status_codes, "raw_responses": raw_responses}
+        all_tasks, paging_info = await self._get_task_page(case_uuid, 1, transaction, output, **filters)
+        next_row = 1 + TASK_PAGE_SIZE
+        has_more = paging_info.has_more_rows
+        if stop_when and stop_when(all_tasks):
+            return all_tasks
+
+        while has_more:
+            start_rows = next_page_starts(next_row, paging_info, max_concurrency)
+            pages = await asyncio.gather(*(self._get_task_page(case_uuid, start_row, transaction, output, **filters) for start_row in start_rows))
+
+            for task_page, paging_info in pages:
+                all_tasks.extend(task_page)
+                has_more = paging_info.has_more_rows
+                if not has_more:
+                    break
+
+            next_row = start_rows[-1] + TASK_PAGE_SIZE
+            if stop_when and stop_when(all_tasks):
+                break
+
+        return all_tasks
+
+    async def has_transfer_task(self, case_uuid, racfId, transaction=None):
+        """Async version of NovaClient.has_transfer_task."""
+        tasks = await self.get_task_list(case_uuid, transaction, stop_when=lambda tasks: any(is_transfer_task(t, racfId) for t in tasks),
+                                         output=TRANSFER_TASK_OUTPUT, caseworker_racfId=racfId)
+        return any(is_transfer_task(t, racfId) for t in tasks)
+
+    async def list_cases_by_caseworker(self, racfId, transaction=None):
+        start_row = 1
+        all_cases = []
+
+        while True:
+            data = build_case_lookup_payload(racfId, transaction, start_row, CASE_PAGE_SIZE)
+            _, body = await self._request("PUT", "Case/GetList", data)
+            case_list = decode_case_list(body)
+
+            all_cases.extend(case_list.cases)
+
+            if not case_list.paging_information.has_more_rows:
+                break
+
+            start_row += CASE_PAGE_SIZE
+
+        return all_cases
+
+    async def lookup_caseworker_by_racfId(self, racfId, transaction=None, minimal=True, raw_responses=None):
+        page_size = 1 if minimal else 500
+
+        # First: Try searching cases
+        data = build_case_lookup_payload(racfId, transaction, page_size=page_size, minimal=minimal)
+        _, body = await self._request("PUT", "Case/GetList", data)
+        keep_raw_response(raw_responses, body)
+        caseworker = find_caseworker(decode_case_list(body).cases, racfId)
+        if caseworker:
+            return caseworker
+
+        # Second: Try searching tasks
+        _, body = await self._request("PUT", "Task/GetList", build_task_lookup_payload(racfId, minimal=minimal))
+        keep_raw_response(raw_responses, body)
+        return find_caseworker(decode_task_list(body).task_list, racfId)
+
+    async def update_caseworker_task(self, task, new_caseworker):
+        status, _ = await self._request("PUT", "Task/Update", build_task_update_payload(task, new_caseworker))
+        return status
+
+    async def create_task(self, case_uuid, new_caseworker, description):
+        status, _ = await self._request("POST", "Task/Import", build_create_task_payload(case_uuid, new_caseworker, description))
+        return status
+
+    async def update_caseworker_case(self, case_uuid, new_caseworker):
+        status, _ = await self._request("PATCH", "Case/Update", build_case_update_payload(case_uuid, new_caseworker))
+        return status
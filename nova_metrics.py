@@ -0,0 +1,168 @@
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+METRICS_TABLE_NAME = "nova_metrics"
+# Samples kept in memory before they are written in one transaction
+DEFAULT_BATCH_SIZE = 500
+# Seconds after which buffered samples are written even if the batch is not full
+DEFAULT_FLUSH_INTERVAL = 10.0
+# Upper bounds in milliseconds of the latency histogram buckets in the report
+HISTOGRAM_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def new_run_id():
+    return f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile (0-100) of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+class MetricsRecorder:
+    """
+    Collects per-request, per-step and per-row measurements of a pipeline run and writes them in
+    batches to METRICS_TABLE_NAME in the given SQLite file, next to the sagsflyt table.
+
+    Safe to share between threads and between NovaClient/AsyncNovaClient and the pipeline.
+
+    Parameters:
+        path (str): SQLite file to write to.
+        run_id (str): Id grouping the samples of one run; a timestamped id is made if not given.
+        batch_size (int): Samples buffered before they are written.
+        flush_interval (float): Seconds after which a partial batch is written anyway.
+    """
+
+    def __init__(self, path, run_id=None, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.run_id = run_id or new_run_id()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        create_metrics_table(self._conn)
+
+    def record_request(self, endpoint, status, seconds, response_bytes=None):
+        """One HTTP attempt against Nova. status is None if no response came back (timeout, connection error)."""
+        self._add(("request", endpoint, None, status, seconds, response_bytes))
+
+    def record_step(self, step, seconds, sagsnr=None):
+        """Time one row spent in one pipeline step."""
+        self._add(("step", step, sagsnr, None, seconds, None))
+
+    def record_row(self, sagsnr, seconds, ok):
+        """Total time of one row; status is 1 if the row was fully processed, 0 if it failed."""
+        self._add(("row", "row", sagsnr, 1 if ok else 0, seconds, None))
+
+    def _add(self, sample):
+        with self._lock:
+            self._buffer.append((self.run_id, *sample, time.time()))
+            if len(self._buffer) >= self.batch_size or time.monotonic() - self._flushed_at >= self.flush_interval:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        batch, self._buffer = self._buffer, []
+        self._flushed_at = time.monotonic()
+        if batch:
+            with self._conn:
+                self._conn.executemany(f"""
+                INSERT INTO {METRICS_TABLE_NAME} (run_id, kind, name, sagsnummer, status, seconds, bytes, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, batch)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+def create_metrics_table(conn):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {METRICS_TABLE_NAME} (
+        run_id TEXT NOT NULL,
+        kind TEXT NOT NULL,                     -- 'request', 'step' or 'row'
+        name TEXT NOT NULL,                     -- endpoint, step name or 'row'
+        sagsnummer TEXT,
+        status INTEGER,                         -- HTTP status (NULL: no response); for rows 1 = processed, 0 = failed
+        seconds REAL NOT NULL,
+        bytes INTEGER,                          -- response body size
+        recorded_at REAL NOT NULL               -- unix time
+    );
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {METRICS_TABLE_NAME}_run ON {METRICS_TABLE_NAME} (run_id, kind, name)")
+    conn.commit()
+
+
+def latest_run_id(conn):
+    row = conn.execute(f"SELECT run_id FROM {METRICS_TABLE_NAME} ORDER BY recorded_at DESC LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def _histogram(seconds):
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for value in seconds:
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if value * 1000 <= bound), len(HISTOGRAM_BUCKETS_MS))
+        counts[index] += 1
+    return counts
+
+
+def _ms(value):
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def print_report(conn, run_id=None):
+    """Prints the endpoint, step and row metrics of run_id (the latest run by default) from conn."""
+    create_metrics_table(conn)
+    run_id = run_id or latest_run_id(conn)
+    if run_id is None:
+        print("No metrics recorded yet.")
+        return
+
+    samples = {}
+    for kind, name, status, seconds, size, recorded_at in conn.execute(
+            f"SELECT kind, name, status, seconds, bytes, recorded_at FROM {METRICS_TABLE_NAME} WHERE run_id = ?", (run_id,)):
+        samples.setdefault(kind, {}).setdefault(name, []).append((status, seconds, size, recorded_at))
+
+    print(f"Run {run_id}")
+
+    requests_by_endpoint = samples.get("request", {})
+    print(f"\n{'Endpoint':<16} {'count':>6} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'avg KB':>7}  statuses")
+    for endpoint, rows in sorted(requests_by_endpoint.items()):
+        seconds = [row[1] for row in rows]
+        sizes = [row[2] for row in rows if row[2] is not None]
+        statuses = {}
+        for row in rows:
+            statuses[row[0] or "none"] = statuses.get(row[0] or "none", 0) + 1
+        status_text = " ".join(f"{status}:{count}" for status, count in sorted(statuses.items(), key=str))
+        avg_kb = sum(sizes) / len(sizes) / 1024 if sizes else 0
+        print(f"{endpoint:<16} {len(rows):>6} {_ms(percentile(seconds, 50)):>7} {_ms(percentile(seconds, 95)):>7} {_ms(percentile(seconds, 99)):>7} {avg_kb:>7.1f}  {status_text}")
+
+    bounds = [f"≤{bound}" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}"]
+    print(f"\n{'Latency (ms)':<16} " + " ".join(f"{bound:>6}" for bound in bounds))
+    for endpoint, rows in sorted(requests_by_endpoint.items()):
+        print(f"{endpoint:<16} " + " ".join(f"{count:>6}" for count in _histogram([row[1] for row in rows])))
+
+    print(f"\n{'Step':<18} {'count':>6} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}")
+    for step, rows in samples.get("step", {}).items():
+        seconds = [row[1] for row in rows]
+        print(f"{step:<18} {len(rows):>6} {_ms(percentile(seconds, 50)):>7} {_ms(percentile(seconds, 95)):>7} {_ms(percentile(seconds, 99)):>7}")
+
+    row_samples = samples.get("row", {}).get("row", [])
+    if row_samples:
+        processed = sum(1 for row in row_samples if row[0])
+        first_start = min(row[3] - row[1] for row in row_samples)
+        last_end = max(row[3] for row in row_samples)
+        minutes = max(last_end - first_start, 1e-9) / 60
+        print(f"\nRows: {len(row_samples)} ({processed} processed, {len(row_samples) - processed} failed) "
+              f"in {minutes * 60:.1f}s: {len(row_samples) / minutes:.0f} rows/minute.")
@@ -0,0 +1,145 @@
+from typing import Any
+
+import msgspec
+
+
+class NovaModel(msgspec.Struct, rename="camel", omit_defaults=True):
+    """
+    Base for the typed Nova response models.
+
+    Fields are snake_case in Python and camelCase on the wire. Structs are slotted, fields Nova adds
+    that are not declared here are skipped while decoding, and a field of the wrong type fails the
+    decode with msgspec.ValidationError instead of surfacing later as a None somewhere.
+    """
+
+
+class KspIdentity(NovaModel):
+    nova_user_id: str | None = None
+    racf_id: str | None = None
+    full_name: str | None = None
+
+
+class LosIdentity(NovaModel):
+    nova_unit_id: str | None = None
+    administrative_unit_id: Any = None
+    full_name: str | None = None
+    user_key: str | None = None
+
+
+class FkOrgIdentity(NovaModel):
+    fk_uuid: str | None = None
+    type: str | None = None
+    full_name: str | None = None
+
+
+class Caseworker(NovaModel):
+    ksp_identity: KspIdentity | None = None
+    los_identity: LosIdentity | None = None
+    fk_org_identity: FkOrgIdentity | None = None
+    caseworker_ctrl_by: Any = None
+
+    @property
+    def racf_id(self):
+        return self.ksp_identity.racf_id if self.ksp_identity else None
+
+    @property
+    def full_name(self):
+        return self.ksp_identity.full_name if self.ksp_identity else None
+
+
+class CaseCommon(NovaModel):
+    uuid: str | None = None
+
+
+class CaseAttributes(NovaModel):
+    user_friendly_case_number: str | None = None
+
+
+class Case(NovaModel):
+    common: CaseCommon | None = None
+    case_attributes: CaseAttributes | None = None
+    caseworker: Caseworker | None = None
+
+    @property
+    def uuid(self):
+        return self.common.uuid if self.common else None
+
+    @property
+    def case_number(self):
+        return self.case_attributes.user_friendly_case_number if self.case_attributes else None
+
+
+class TaskType(NovaModel):
+    task_type_name: str | None = None
+
+
+class Task(NovaModel):
+    task_uuid: str | None = None
+    case_uuid: str | None = None
+    task_title: str | None = None
+    task_description: str | None = None
+    task_deadline: str | None = None
+    task_start_date: str | None = None
+    task_close_date: str | None = None
+    kle: Any = None
+    task_status_code: str | None = None
+    task_type: TaskType | None = None
+    task_repeat: Any = None
+    caseworker: Caseworker | None = None
+
+
+class PagingInformation(NovaModel):
+    has_more_rows: bool = False
+    number_of_rows: int | None = None
+    total_number_of_rows: int | None = None
+
+
+class CaseList(NovaModel):
+    cases: list[Case] = msgspec.field(default_factory=list)
+    paging_information: PagingInformation = msgspec.field(default_factory=PagingInformation)
+
+
+class TaskList(NovaModel):
+    task_list: list[Task] = msgspec.field(default_factory=list)
+    paging_information: PagingInformation = msgspec.field(default_factory=PagingInformation)
+
+
+# Decoders are built once; they decode straight from the response bytes
+_case_list_decoder = msgspec.json.Decoder(CaseList)
+_task_list_decoder = msgspec.json.Decoder(TaskList)
+
+
+def decode_case_list(content):
+    """Decodes a Case/GetList response body. An empty body decodes to an empty CaseList."""
+    return _case_list_decoder.decode(content) if content else CaseList()
+
+
+def decode_task_list(content):
+    """Decodes a Task/GetList response body. An empty body decodes to an empty TaskList."""
+    return _task_list_decoder.decode(content) if content else TaskList()
+
+
+def racf_id_of(item):
+    """Lowercased racfId of the caseworker on a Case or Task, or "" if it has none."""
+    caseworker = item.caseworker
+    racf_id = caseworker.racf_id if caseworker else None
+    return (racf_id or "").lower()
+
+
+def as_builtins(value):
+    """Converts models (or containers of them) to plain dicts/lists with the camelCase wire names."""
+    return msgspec.to_builtins(value)
+
+
+def as_caseworker(value):
+    """Returns value as a Caseworker, converting a caseworker dict in the wire format if needed."""
+    if value is None or isinstance(value, Caseworker):
+        return value
+    return msgspec.convert(value, Caseworker)
+
+
+def as_task(value):
+    """Returns value as a Task, converting a task dict in the wire format if needed."""
+    if isinstance(value, Task):
+        return value
+    return msgspec.convert(value, Task)
@@ -0,0 +1,289 @@
+import gzip
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from nova import TRANSFER_TASK_TITLE
+
+
+ARCHIVE_FORMAT = "nova-traffic"
+ARCHIVE_VERSION = 1
+
+# Keys whose values are replaced before anything is written to an archive
+SENSITIVE_KEYS = {"access_token", "refresh_token", "client_secret", "client_id", "password", "authorization"}
+REDACTED = "***"
+# Keys holding citizen or caseworker data; their values are replaced by a keyed hash, so the same value
+# gets the same pseudonym throughout an archive and a replay still finds its cases, tasks and caseworkers
+PSEUDONYMIZED_KEYS = {"fullName", "racfId", "userFriendlyCaseNumber", "taskTitle", "taskDescription", "title", "description"}
+# Values written by the robot itself, kept so a replay recognizes its own transfer tasks
+PUBLIC_VALUES = {TRANSFER_TASK_TITLE}
+# Response headers kept in the archive; everything else (cookies, auth, tracing ids) is dropped
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+# Request fields that differ on every call and are ignored when matching a replayed request
+VOLATILE_KEYS = {"transactionId", "startDate"}
+# Request fields ignored when matching as well: the Task/Import description is built from caseworker names,
+# and a replay builds it from their pseudonyms
+UNMATCHED_KEYS = VOLATILE_KEYS | {"description"}
+
+# Base URL handed to NovaClient when replaying; the replay adapter never connects to it
+REPLAY_URL = "https://nova.replay.invalid"
+
+
+def endpoint_of(url):
+    """Returns the Nova endpoint of a request URL, e.g. "Case/GetList"."""
+    return "/".join(urlparse(url).path.rstrip("/").split("/")[-2:])
+
+
+def sanitize(value):
+    """Returns value with the values of SENSITIVE_KEYS replaced, at any depth."""
+    if isinstance(value, dict):
+        return {key: REDACTED if key.lower() in SENSITIVE_KEYS else sanitize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    return value
+
+
+def pseudonym(value, key):
+    """Returns the pseudonym of a string under key. Case is ignored, like the pipeline compares racfIds and case numbers."""
+    return "p" + hmac.new(key, value.strip().lower().encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+
+def pseudonymize(value, key):
+    """Returns value with the strings under PSEUDONYMIZED_KEYS replaced by their pseudonym, at any depth."""
+    if isinstance(value, dict):
+        return {
+            name: pseudonym(item, key) if name in PSEUDONYMIZED_KEYS and isinstance(item, str) and item not in PUBLIC_VALUES
+            else pseudonymize(item, key)
+            for name, item in value.items()
+        }
+    if isinstance(value, list):
+        return [pseudonymize(item, key) for item in value]
+    return value
+
+
+def _without_volatile(value):
+    if isinstance(value, dict):
+        return {key: _without_volatile(item) for key, item in value.items() if key not in UNMATCHED_KEYS}
+    if isinstance(value, list):
+        return [_without_volatile(item) for item in value]
+    return value
+
+
+def request_key(method, endpoint, payload):
+    """Key matching a replayed request to a recorded one: method, endpoint and the payload minus UNMATCHED_KEYS."""
+    canonical = json.dumps(_without_volatile(payload), sort_keys=True, ensure_ascii=False)
+    return f"{method} {endpoint} {hashlib.sha1(canonical.encode('utf-8')).hexdigest()}"
+
+
+def _decode_json(content):
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+class TrafficArchive:
+    """
+    Gzipped JSON-lines archive of sanitized Nova request/response pairs.
+
+    The first line is a header; every following line is one exchange with its method, endpoint,
+    request payload, status, kept headers, response body and the seconds Nova took to answer.
+    Credentials are redacted and citizen and caseworker data is pseudonymized (see pseudonymize).
+
+    Parameters:
+        path (str): Path of the archive, e.g. "nova_traffic.jsonl.gz".
+        pseudonym_key (bytes): Key of the pseudonyms. A random key by default, which is never written, so
+            pseudonyms cannot be traced back to names or racfIds. Pass the same key to correlate several recordings.
+    """
+
+    def __init__(self, path, pseudonym_key=None):
+        self.path = path
+        self.pseudonym_key = pseudonym_key or secrets.token_bytes(32)
+        self._lock = threading.Lock()
+        self._file = None
+        self._started = None
+
+    def open_for_writing(self):
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._started = time.monotonic()
+        self._write({"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "recorded_at": datetime.now().isoformat(timespec="seconds")})
+        return self
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def append(self, method, endpoint, payload, status, headers, body, elapsed):
+        decoded = _decode_json(body)
+        record = {
+            "offset": round(time.monotonic() - self._started, 4),
+            "method": method,
+            "endpoint": endpoint,
+            "request": self._clean(payload),
+            "status": status,
+            "headers": {name: headers[name] for name in RECORDED_HEADERS if name in headers},
+            "body": body.decode("utf-8", "replace") if decoded is None else json.dumps(self._clean(decoded), ensure_ascii=False),
+            "elapsed": round(elapsed, 4),
+        }
+        with self._lock:
+            self._write(record)
+
+    def _clean(self, value):
+        return pseudonymize(sanitize(value), self.pseudonym_key)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def read(self):
+        """Returns the recorded exchanges, oldest first."""
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != ARCHIVE_FORMAT or header.get("version") != ARCHIVE_VERSION:
+                raise ValueError(f"{self.path} is not a version {ARCHIVE_VERSION} {ARCHIVE_FORMAT} archive")
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that sends requests as usual and writes every exchange to a TrafficArchive.
+    Authorization headers are never written, tokens or secrets in the bodies are redacted, and
+    names, task texts, case numbers and racfIds are pseudonymized.
+
+        adapter = RecordingAdapter(TrafficArchive("nova_traffic.jsonl.gz"), pool_maxsize=10)
+        client = NovaClient(Nova_URL, token_provider=provider, adapter=adapter)
+
+    The archive is closed when the client (and so the adapter) is closed.
+    """
+
+    def __init__(self, archive, pool_maxsize=10):
+        super().__init__(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.archive = archive.open_for_writing()
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ
+        started = time.perf_counter()
+        response = super().send(request, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        self.archive.append(request.method, endpoint_of(request.url), _decode_json(request.body), response.status_code,
+                            response.headers, response.content, elapsed)
+        return response
+
+    def close(self):
+        super().close()
+        self.archive.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport that answers requests from a TrafficArchive instead of the network.
+
+    A request is matched on method, endpoint and payload (see request_key). Requests recorded more
+    than once, e.g. a read answered 429 and then 200, are answered in the recorded order, and the
+    last answer is repeated once they run out. Unmatched requests are answered 404 and counted in misses.
+
+    Parameters:
+        archive (TrafficArchive): Recorded traffic.
+        latency_scale (float): Factor applied to the recorded response times; 0 answers at once.
+    """
+
+    def __init__(self, archive, latency_scale=1.0):
+        super().__init__()
+        self.latency_scale = latency_scale
+        self.records = archive.read()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._answers = {}
+        for record in self.records:
+            key = request_key(record["method"], record["endpoint"], record["request"])
+            self._answers.setdefault(key, []).append(record)
+        self._served = {key: 0 for key in self._answers}
+
+    def _next_answer(self, key):
+        with self._lock:
+            answers = self._answers.get(key)
+            if not answers:
+                self.misses += 1
+                return None
+            index = min(self._served[key], len(answers) - 1)
+            self._served[key] += 1
+            self.hits += 1
+            return answers[index]
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ
+        endpoint = endpoint_of(request.url)
+        record = self._next_answer(request_key(request.method, endpoint, sanitize(_decode_json(request.body))))
+        if record is None:
+            return self._response(request, 404, {"Content-Type": "application/json"}, json.dumps({"message": f"{endpoint} request not in recording"}))
+
+        if self.latency_scale > 0:
+            time.sleep(record["elapsed"] * self.latency_scale)
+        return self._response(request, record["status"], record["headers"], record["body"])
+
+    @staticmethod
+    def _response(request, status, headers, body):
+        response = requests.Response()
+        response.status_code = status
+        try:
+            response.reason = HTTPStatus(status).phrase
+        except ValueError:
+            response.reason = ""
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body.encode("utf-8")  # pylint: disable=protected-access
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+    def pipeline_rows(self):
+        """
+        Reconstructs the (sagsnummer, old racfId, new racfId) input rows of the recorded run: the case
+        number and first owner of each case come from the Case/GetList answers, the new owner from Case/Update.
+        """
+        owners = {}
+        for record in self.records:
+            if record["endpoint"] != "Case/GetList" or record["status"] != 200:
+                continue
+            for case in (_decode_json(record["body"]) or {}).get("cases") or []:
+                case_uuid = (case.get("common") or {}).get("uuid")
+                number = (case.get("caseAttributes") or {}).get("userFriendlyCaseNumber")
+                racfId = ((case.get("caseworker") or {}).get("kspIdentity") or {}).get("racfId")
+                if case_uuid and number and racfId:
+                    owners.setdefault(case_uuid, (number, racfId))
+
+        rows = {}
+        for record in self.records:
+            if record["endpoint"] != "Case/Update" or record["request"] is None:
+                continue
+            case_uuid = (record["request"].get("common") or {}).get("uuid")
+            racfId = ((record["request"].get("caseworker") or {}).get("kspIdentity") or {}).get("racfId")
+            if case_uuid in owners and racfId:
+                number, old = owners[case_uuid]
+                rows.setdefault(number, (number, old, racfId))
+        return list(rows.values())
+
+
+class ReplayTokenProvider:
+    """Token provider for replays; the replay adapter does not check tokens."""
+
+    def get_token(self):
+        return "replay"
+
+    def invalidate(self, access_token=None):
+        pass
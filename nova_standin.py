@@ -0,0 +1,413 @@
+import argparse
+import json
+import math
+import random
+import secrets
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from nova import TRANSFER_TASK_TITLE, AccessTokenProvider
+
+
+# (median seconds, lognormal sigma) of the simulated service time per endpoint
+DEFAULT_LATENCY = {
+    "token": (0.05, 0.3),
+    "Case/GetList": (0.15, 0.6),
+    "Task/GetList": (0.12, 0.6),
+    "Task/Update": (0.08, 0.5),
+    "Task/Import": (0.10, 0.5),
+    "Case/Update": (0.10, 0.5),
+}
+# Largest page the stand-in returns, whatever numberOfRows asks for
+MAX_PAGE_SIZE = 500
+# Seconds a stand-in token is valid
+TOKEN_LIFETIME = 3600
+# Share of the generated tasks that are closed (status F)
+CLOSED_TASK_RATIO = 0.3
+
+
+class SyntheticNova:
+    """
+    In-memory Nova data set: N caseworkers, M cases spread over them and K tasks per case.
+
+    The data is generated from seed, so two runs with the same arguments see the same cases.
+
+    Parameters:
+        caseworkers (int): Number of caseworkers, with racfIds AZ00001, AZ00002, ...
+        cases (int): Number of cases, with case numbers S2024-000001, S2024-000002, ...
+        tasks_per_case (int): Tasks created on each case, CLOSED_TASK_RATIO of them closed.
+        seed (int): Seed for the generator.
+    """
+
+    def __init__(self, caseworkers=50, cases=2000, tasks_per_case=10, seed=1):
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.caseworkers = {}
+        for i in range(1, caseworkers + 1):
+            racfId = f"AZ{i:05d}"
+            self.caseworkers[racfId.lower()] = {
+                "kspIdentity": {"novaUserId": str(uuid.UUID(int=rng.getrandbits(128))), "racfId": racfId, "fullName": f"Sagsbehandler {i}"},
+                "losIdentity": {"novaUnitId": str(uuid.UUID(int=rng.getrandbits(128))), "administrativeUnitId": 70 + i % 5,
+                                "fullName": f"Team {i % 5}", "userKey": f"team{i % 5}"},
+                "fkOrgIdentity": {"fkUuid": str(uuid.UUID(int=rng.getrandbits(128))), "type": "Medarbejder", "fullName": f"Sagsbehandler {i}"},
+                "caseworkerCtrlBy": "Automatic",
+            }
+
+        racfIds = list(self.caseworkers)
+        self.cases = {}
+        self.tasks = {}
+        self.tasks_by_case = {}
+        for i in range(1, cases + 1):
+            case_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+            owner = self.caseworkers[racfIds[(i - 1) % len(racfIds)]]
+            self.cases[case_uuid] = {
+                "common": {"uuid": case_uuid},
+                "caseAttributes": {"userFriendlyCaseNumber": f"S2024-{i:06d}"},
+                "caseworker": json.loads(json.dumps(owner)),
+            }
+            self.tasks_by_case[case_uuid] = []
+            for k in range(tasks_per_case):
+                task_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+                self._add_task({
+                    "taskUuid": task_uuid,
+                    "caseUuid": case_uuid,
+                    "taskTitle": f"{k + 1:02d}. Opgave",
+                    "taskDescription": "Syntetisk opgave",
+                    "taskDeadline": "2025-12-31T00:00:00",
+                    "taskStartDate": "2024-01-01T00:00:00",
+                    "taskStatusCode": "F" if rng.random() < CLOSED_TASK_RATIO else rng.choice(["N", "S"]),
+                    "taskType": {"taskTypeName": "Aktivitet"},
+                    "caseworker": {"kspIdentity": dict(owner["kspIdentity"])},
+                })
+        self.case_numbers = {case["caseAttributes"]["userFriendlyCaseNumber"].lower(): case for case in self.cases.values()}
+
+    def _add_task(self, task):
+        self.tasks[task["taskUuid"]] = task
+        self.tasks_by_case[task["caseUuid"]].append(task)
+
+    def pipeline_rows(self, count, seed=2):
+        """
+        Returns count (sagsnummer, old racfId, new racfId) rows moving existing cases from their owner
+        to another caseworker, in the shape of the sagsflyt input.
+        """
+        rng = random.Random(seed)
+        racfIds = [caseworker["kspIdentity"]["racfId"] for caseworker in self.caseworkers.values()]
+        rows = []
+        for case in rng.sample(list(self.cases.values()), min(count, len(self.cases))):
+            old = case["caseworker"]["kspIdentity"]["racfId"]
+            new = rng.choice([racfId for racfId in racfIds if racfId != old] or [old])
+            rows.append((case["caseAttributes"]["userFriendlyCaseNumber"], old, new))
+        return rows
+
+    def list_cases(self, body):
+        number = (body.get("caseAttributes") or {}).get("userFriendlyCaseNumber")
+        racfId = _racf_filter(body.get("caseWorker"))
+        if number:
+            case = self.case_numbers.get(number.lower())
+            cases = [case] if case else []
+        else:
+            cases = list(self.cases.values())
+        if racfId:
+            cases = [case for case in cases if case["caseworker"]["kspIdentity"]["racfId"].lower() == racfId]
+        return cases
+
+    def list_tasks(self, body):
+        tasks = self.tasks_by_case.get(body["caseUuid"], []) if body.get("caseUuid") else list(self.tasks.values())
+        racfId = _racf_filter(body.get("caseworker"))
+        if racfId:
+            tasks = [task for task in tasks if task["caseworker"]["kspIdentity"]["racfId"].lower() == racfId]
+        status_codes = body.get("statusCode")
+        if status_codes:
+            tasks = [task for task in tasks if task["taskStatusCode"] in status_codes]
+        return tasks
+
+    def update_task(self, body):
+        task = self.tasks.get(body.get("uuid"))
+        if task is None:
+            return False
+        task["caseworker"] = body["caseworker"]
+        return True
+
+    def import_task(self, body):
+        if body.get("caseUuid") not in self.cases:
+            return False
+        self._add_task({
+            "taskUuid": str(uuid.uuid4()),
+            "caseUuid": body["caseUuid"],
+            "taskTitle": body.get("title", TRANSFER_TASK_TITLE),
+            "taskDescription": body.get("description"),
+            "taskStartDate": body.get("startDate"),
+            "taskStatusCode": body.get("statusCode", "N"),
+            "taskType": {"taskTypeName": body.get("taskTypeName")},
+            "caseworker": body["caseworker"],
+        })
+        return True
+
+    def update_case(self, body):
+        case = self.cases.get((body.get("common") or {}).get("uuid"))
+        if case is None:
+            return False
+        racfId = body["caseworker"]["kspIdentity"]["racfId"].lower()
+        case["caseworker"] = json.loads(json.dumps(self.caseworkers.get(racfId, body["caseworker"])))
+        return True
+
+
+class FaultProfile:
+    """
+    How the stand-in misbehaves.
+
+    Parameters:
+        latency (dict): Endpoint -> (median seconds, lognormal sigma), overriding DEFAULT_LATENCY.
+        latency_scale (float): Factor applied to every simulated service time; 0 answers at once.
+        error_rate (float): Share of API requests answered with 500.
+        throttle_rate (float): Share of API requests answered with 429 at random.
+        rate_limit (float): Requests per second accepted before answering 429, None for no limit.
+        retry_after (float): Seconds sent in Retry-After on a 429.
+        seed (int): Seed for the random faults and latencies.
+    """
+
+    def __init__(self, latency=None, latency_scale=1.0, error_rate=0.0, throttle_rate=0.0, rate_limit=None, retry_after=1.0, seed=None):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._allowance = rate_limit or 0.0
+        self._checked_at = time.monotonic()
+
+    def service_time(self, endpoint):
+        median, sigma = self.latency.get(endpoint, (0.1, 0.5))
+        if self.latency_scale <= 0 or median <= 0:
+            return 0.0
+        with self._lock:
+            return self.latency_scale * self._random.lognormvariate(math.log(median), sigma)
+
+    def fault(self):
+        """Returns 429, 500 or None for a request arriving now."""
+        with self._lock:
+            if self.rate_limit:
+                now = time.monotonic()
+                self._allowance = min(self.rate_limit, self._allowance + (now - self._checked_at) * self.rate_limit)
+                self._checked_at = now
+                if self._allowance < 1:
+                    return 429
+                self._allowance -= 1
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+
+class NovaStandIn:
+    """
+    Local HTTP server answering the Nova endpoints nova.py uses (token, Case/GetList, Task/GetList,
+    Task/Update, Task/Import and Case/Update) from a SyntheticNova, with the latency and faults of a
+    FaultProfile. Paging and the output specifications of the GetList calls are honoured.
+
+        with NovaStandIn(SyntheticNova(cases=500)) as standin:
+            client = NovaClient(standin.url, token_provider=standin.token_provider())
+
+    Parameters:
+        data (SyntheticNova): Data set to serve and mutate.
+        profile (FaultProfile): Latency and fault injection; no faults and default latency if not given.
+        host (str): Interface to listen on.
+        port (int): Port to listen on, 0 for any free port.
+    """
+
+    def __init__(self, data, profile=None, host="127.0.0.1", port=0):
+        self.data = data
+        self.profile = profile or FaultProfile()
+        self.tokens = {}
+        # Endpoint -> list of (status, service seconds) of every request answered
+        self.requests = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def token_provider(self):
+        return AccessTokenProvider(f"{self.url}/token", "standin", "standin")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def issue_token(self):
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self.tokens[token] = time.time() + TOKEN_LIFETIME
+        return token
+
+    def is_valid_token(self, authorization):
+        token = (authorization or "").removeprefix("Bearer ").strip()
+        with self._lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.requests.setdefault(endpoint, []).append((status, seconds))
+
+    def handle(self, endpoint, body):
+        """Returns (status, response body) for one API request."""
+        data = self.data
+        with data.lock:
+            if endpoint == "Case/GetList":
+                return 200, _page(data.list_cases(body), "cases", body.get("paging"), body.get("caseGetOutput"))
+            if endpoint == "Task/GetList":
+                return 200, _page(data.list_tasks(body), "taskList", body.get("paging"), body.get("taskGetOutput"))
+            if endpoint == "Task/Update":
+                return (200, {}) if data.update_task(body) else (404, {"message": "Unknown task"})
+            if endpoint == "Task/Import":
+                return (200, {}) if data.import_task(body) else (404, {"message": "Unknown case"})
+            if endpoint == "Case/Update":
+                return (200, {}) if data.update_case(body) else (404, {"message": "Unknown case"})
+        return 404, {"message": f"Unknown endpoint {endpoint}"}
+
+
+def _racf_filter(caseworker):
+    racfId = ((caseworker or {}).get("kspIdentity") or {}).get("racfId")
+    return racfId.lower() if racfId else None
+
+
+# Fields Nova returns whatever the output specification asks for
+ALWAYS_RETURNED = {"common": True}
+
+
+def _project(value, output):
+    """Keeps the parts of value selected by a Nova output specification ({field: True | nested spec})."""
+    if not isinstance(output, dict) or not isinstance(value, dict):
+        return value
+    return {key: _project(value[key], spec) for key, spec in output.items() if spec and key in value}
+
+
+def _page(items, key, paging, output):
+    paging = paging or {}
+    start = max(1, int(paging.get("startRow", 1)))
+    size = max(1, min(MAX_PAGE_SIZE, int(paging.get("numberOfRows", MAX_PAGE_SIZE))))
+    page = items[start - 1:start - 1 + size]
+    return {
+        key: [_project(item, {**ALWAYS_RETURNED, **output} if output else None) for item in page],
+        "pagingInformation": {
+            "hasMoreRows": start - 1 + size < len(items),
+            "numberOfRows": len(page),
+            "totalNumberOfRows": len(items),
+        },
+    }
+
+
+def _make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; with Nagle on, each response waits about 40 ms for a delayed ACK
+        disable_nagle_algorithm = True
+
+        def _reply(self, status, body, headers=None):
+            content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _handle(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            endpoint = urlparse(self.path).path.strip("/")
+            started = time.perf_counter()
+            time.sleep(standin.profile.service_time(endpoint))
+
+            if endpoint == "token":
+                status, body, headers = 200, {"access_token": standin.issue_token(), "expires_in": TOKEN_LIFETIME, "token_type": "Bearer"}, None
+            elif not standin.is_valid_token(self.headers.get("Authorization")):
+                status, body, headers = 401, {"message": "Invalid token"}, None
+            else:
+                fault = standin.profile.fault()
+                if fault == 429:
+                    status, body, headers = 429, {"message": "Too many requests"}, {"Retry-After": f"{standin.profile.retry_after:g}"}
+                elif fault == 500:
+                    status, body, headers = 500, {"message": "Injected error"}, None
+                else:
+                    try:
+                        payload = json.loads(raw or b"{}")
+                    except ValueError:
+                        payload = None
+                    if not isinstance(payload, dict):
+                        status, body = 400, {"message": "Body must be a JSON object"}
+                    else:
+                        status, body = standin.handle(endpoint, payload)
+                    headers = None
+
+            standin.record(endpoint, status, time.perf_counter() - started)
+            self._reply(status, body, headers)
+
+        do_GET = do_POST = do_PUT = do_PATCH = _handle
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    return Handler
+
+
+def add_standin_arguments(parser):
+    """Adds the data set and fault options shared by the stand-in and benchmark.py."""
+    parser.add_argument("--caseworkers", type=int, default=50, help="Number of synthetic caseworkers.")
+    parser.add_argument("--cases", type=int, default=2000, help="Number of synthetic cases.")
+    parser.add_argument("--tasks-per-case", type=int, default=10, help="Tasks on each synthetic case.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the data set, latencies and faults.")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Factor on the simulated service times; 0 for none.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429 at random.")
+    parser.add_argument("--rate-limit", type=float, help="Requests per second accepted before answering 429.")
+
+
+def standin_from_arguments(args, host="127.0.0.1", port=0):
+    data = SyntheticNova(args.caseworkers, args.cases, args.tasks_per_case, args.seed)
+    profile = FaultProfile(latency_scale=args.latency_scale, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                           rate_limit=args.rate_limit, seed=args.seed)
+    return NovaStandIn(data, profile, host, port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the KMD Nova API, for load testing.")
+    add_standin_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on.")
+    parser.add_argument("--port", type=int, default=8099, help="Port to listen on.")
+    args = parser.parse_args(argv)
+
+    standin = standin_from_arguments(args, args.host, args.port)
+    print(f"Nova stand-in on {standin.url} (token URL {standin.url}/token) with {len(standin.data.cases)} case(s).")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
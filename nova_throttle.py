@@ -0,0 +1,241 @@
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+
+# Requests per second allowed per endpoint when Nova is not pushing back
+DEFAULT_RATE = 20.0
+# Lowest rate the limiter backs off to after repeated 429 answers
+DEFAULT_MIN_RATE = 1.0
+# Factor the rate is multiplied by on a 429, and requests/second added back per success
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_STEP = 0.1
+
+# Retry backoff: full jitter on base * 2**attempt, capped
+DEFAULT_MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# Consecutive failures (5xx / connection errors) that open the circuit, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 15.0
+BREAKER_MAX_COOLDOWN = 300.0
+
+# Latencies remembered per endpoint for hedging decisions
+LATENCY_WINDOW = 200
+# Default hedging: duplicate a read once it has run longer than the p95 of recent latencies
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Seconds to wait before retry number attempt (0-based), with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(value):
+    """Parses a Retry-After header (seconds or HTTP date). Returns None if missing or unreadable."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to throttling: halved on every 429 (down to min_rate) and
+    slowly raised again on each success (up to max_rate).
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes one token and returns the seconds the caller must wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            delay = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(delay, self.paused_until - now)
+
+    def try_reserve(self):
+        """Takes one token only if the caller may send right now; unlike reserve, never leaves the bucket in debt."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1 or now < self.paused_until:
+                return False
+            self.tokens -= 1
+            return True
+
+    def on_throttled(self, retry_after=None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE_FACTOR)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE_STEP)
+
+
+class AdaptiveRateLimiter:
+    """One adaptive TokenBucket per Nova endpoint, shared by every thread or task using the client."""
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=DEFAULT_MIN_RATE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, endpoint):
+        with self._lock:
+            if endpoint not in self._buckets:
+                self._buckets[endpoint] = TokenBucket(self.rate, self.min_rate)
+            return self._buckets[endpoint]
+
+    def reserve(self, endpoint):
+        return self.bucket(endpoint).reserve()
+
+    def try_reserve(self, endpoint):
+        return self.bucket(endpoint).try_reserve()
+
+    def on_throttled(self, endpoint, retry_after=None):
+        self.bucket(endpoint).on_throttled(retry_after)
+
+    def on_success(self, endpoint):
+        self.bucket(endpoint).on_success()
+
+
+class CircuitBreaker:
+    """
+    Stops all callers when Nova is clearly down.
+
+    After failure_threshold consecutive failures the circuit opens and every caller waits out
+    the cooldown. Then one probe request is let through: if it succeeds the circuit closes,
+    otherwise it opens again with a doubled cooldown (up to max_cooldown).
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = None
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Returns 0 if the caller may send now, otherwise the seconds to wait before asking again."""
+        with self._lock:
+            if self.open_until is None:
+                return 0.0
+            now = time.monotonic()
+            if now < self.open_until:
+                return self.open_until - now
+            if self.probe_in_flight:
+                return min(1.0, self.cooldown)
+            self.probe_in_flight = True
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = None
+            self.probe_in_flight = False
+            self.cooldown = self.base_cooldown
+
+    def release_probe(self):
+        """Lets the next caller probe again, for a probe that ended without an answer from Nova."""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probe_in_flight:
+                self.probe_in_flight = False
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self.open_until = time.monotonic() + self.cooldown
+            elif self.open_until is None and self.failures >= self.failure_threshold:
+                print(f"Nova looks down after {self.failures} failures in a row, pausing for {self.cooldown:.0f}s.")
+                self.open_until = time.monotonic() + self.cooldown
+
+
+def is_retryable_status(status_code, idempotent):
+    """429 means Nova did not process the request, so any request may be retried. 5xx is only retried for reads."""
+    return status_code == 429 or (idempotent and status_code >= 500)
+
+
+class LatencyTracker:
+    """
+    Keeps the most recent latencies per endpoint and answers percentile queries, used to decide
+    when a slow read should be hedged.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            if endpoint not in self._samples:
+                self._samples[endpoint] = deque(maxlen=self.window)
+            self._samples[endpoint].append(seconds)
+
+    def percentile(self, endpoint, percentile, min_samples=HEDGE_MIN_SAMPLES):
+        """Returns the given percentile (0-100) of the recent latencies, or None if there are fewer than min_samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+class HedgePolicy:
+    """
+    Decides how long an idempotent read may run before a duplicate request is sent.
+
+    Parameters:
+        percentile (float): Hedge after this percentile of the endpoint's recent latencies, e.g. 95.
+        fallback_delay (float): Delay used until enough latencies are known. None disables hedging until then.
+        min_delay (float): Never hedge sooner than this, to avoid doubling load on fast responses.
+        min_samples (int): Latencies needed before the percentile is trusted.
+    """
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, fallback_delay=None, min_delay=HEDGE_MIN_DELAY, min_samples=HEDGE_MIN_SAMPLES):
+        self.percentile = percentile
+        self.fallback_delay = fallback_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+
+    def delay(self, latencies, endpoint):
+        """Seconds to wait for the first attempt before hedging, or None to not hedge."""
+        delay = latencies.percentile(endpoint, self.percentile, self.min_samples)
+        if delay is None:
+            delay = self.fallback_delay
+        if delay is None:
+            return None
+        return max(delay, self.min_delay)
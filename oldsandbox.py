@@ -54,7 +54,6 @@ for line in lines:
         print(task.get("taskTitle"))
         print(task)
 
-        update_caseworker_task(task, access_token, Nova_URL, new_caseworker)
         status_code = update_caseworker_task(task, access_token, Nova_URL, new_caseworker)
         print(f"Updated task {task['taskUuid']} - Status: {status_code}")
 
@@ -0,0 +1,191 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+
+PROFILE_MODES = ("cprofile", "sample")
+# Seconds between two stack samples in sample mode
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Functions listed in the summary printed at the end of a run
+DEFAULT_TOP = 25
+# Innermost (file, function) of a thread that is blocked on a lock, condition or empty work queue, e.g. an
+# idle pool worker or the lease keeper between renewals; the sampler skips such threads
+IDLE_FUNCTIONS = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("thread.py", "_worker")}
+
+
+class _StackSampler:
+    """
+    Wall-clock sampling profiler: a background thread records the stacks of all other threads
+    every interval seconds while active. Cheap enough to leave on for a whole run, and it sees
+    the task update threads and time spent waiting on Nova. Threads blocked in IDLE_FUNCTIONS are
+    left out, so idle threads do not drown out the ones doing the work.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.active = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            if not self.active:
+                continue
+            # pylint: disable-next=protected-access
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class RowProfiler:
+    """
+    Profiles every Nth row (or queue element) of a run and writes one profile file for the run.
+
+    Mode "cprofile" is deterministic and writes a pstats file (open it with `python -m pstats` or
+    snakeviz). It profiles the thread the row runs on and every thread started while a row is
+    profiled, such as the task update and queue element pools, until that thread ends; their
+    profiles are merged into one file. Mode "sample" samples the stacks of all busy threads and
+    writes them in the collapsed format flame graph tools read.
+
+        profiler = RowProfiler(os.path.dirname(SQLITE_PATH), every=10)
+        for row in rows:
+            with profiler.row():
+                process(row)
+        profiler.finish()
+
+    Parameters:
+        output_dir (str): Directory the profile file is written to.
+        mode (str): "cprofile" or "sample".
+        every (int): Profile rows 1, 1 + every, 1 + 2 * every, ...; 1 profiles all rows.
+        top (int): Number of functions in the summary printed by finish.
+        label (str): Name put in the profile file name.
+        sample_interval (float): Seconds between stack samples in sample mode.
+    """
+
+    def __init__(self, output_dir, mode="cprofile", every=1, top=DEFAULT_TOP, label="run", sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}, expected one of {PROFILE_MODES}")
+        self.output_dir = output_dir or "."
+        self.mode = mode
+        self.every = max(1, every)
+        self.top = top
+        self.label = label
+        self.rows_seen = 0
+        self.rows_profiled = 0
+        self._profile = cProfile.Profile() if mode == "cprofile" else None
+        # Profiles of the threads started during profiled rows
+        self._thread_profiles = []
+        self._thread_profiles_lock = threading.Lock()
+        self._sampler = _StackSampler(sample_interval) if mode == "sample" else None
+
+    @contextmanager
+    def row(self):
+        """Profiles the enclosed block if it is one of the rows picked by every."""
+        profiled = self.rows_seen % self.every == 0
+        self.rows_seen += 1
+        if not profiled:
+            yield
+            return
+
+        self.rows_profiled += 1
+        if self._profile is not None:
+            threading.setprofile(self._profile_new_thread)
+            self._profile.enable()
+        else:
+            self._sampler.active = True
+        try:
+            yield
+        finally:
+            if self._profile is not None:
+                self._profile.disable()
+                threading.setprofile(None)
+            else:
+                self._sampler.active = False
+
+    def _profile_new_thread(self, *_):
+        """Profile function of threads started during a profiled row: replaces itself with a cProfile of the thread."""
+        profile = cProfile.Profile()
+        with self._thread_profiles_lock:
+            self._thread_profiles.append(profile)
+        profile.enable()
+
+    def finish(self):
+        """Writes the profile file, prints the top functions and returns the file's path (None if nothing was profiled)."""
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self.rows_profiled == 0:
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        if self._profile is not None:
+            path = os.path.join(self.output_dir, f"profile-{self.label}-{stamp}.prof")
+            stats = self._cprofile_stats()
+            stats.dump_stats(path)
+            print(self._cprofile_summary(stats))
+        else:
+            path = os.path.join(self.output_dir, f"profile-{self.label}-{stamp}.collapsed")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in self._sampler.stacks.most_common():
+                    f.write(f"{';'.join(stack)} {count}\n")
+            print(self._sample_summary())
+
+        print(f"Profiled {self.rows_profiled} of {self.rows_seen} row(s); profile written to {path}")
+        return path
+
+    def _cprofile_stats(self):
+        """The row threads' profile merged with the profiles of the threads they started."""
+        stats = pstats.Stats(self._profile)
+        with self._thread_profiles_lock:
+            for profile in self._thread_profiles:
+                stats.add(profile)
+        return stats
+
+    def _cprofile_summary(self, stats):
+        out = io.StringIO()
+        stats.stream = out
+        stats.strip_dirs().sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        return out.getvalue()
+
+    def _sample_summary(self):
+        own = Counter()
+        total = Counter()
+        for stack, count in self._sampler.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        samples = sum(self._sampler.stacks.values())
+
+        lines = [f"{samples} sample(s). Top {self.top} functions by own samples:", f"{'own %':>7} {'total %':>8}  function"]
+        for function, count in own.most_common(self.top):
+            lines.append(f"{count / samples * 100:>7.1f} {total[function] / samples * 100:>8.1f}  {function}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def maybe_profile_row(profiler):
+    """profiler.row() if profiler is set, otherwise a no-op; lets callers keep one code path."""
+    if profiler is None:
+        yield
+    else:
+        with profiler.row():
+            yield
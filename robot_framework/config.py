@@ -18,10 +18,35 @@ ERROR_EMAIL = "Error Email"
 # Queue specific configs
 # ----------------------
 
-# The name of the job queue (if any)
-QUEUE_NAME = None
+# The name of the job queue (if any), filled by `python sandbox.py enqueue`
+QUEUE_NAME = "NovaSagsFlyt"
 
 # The limit on how many queue elements to process
 MAX_TASK_COUNT = 100
 
+# The number of queue elements claimed at once and processed concurrently
+QUEUE_BATCH_SIZE = 10
+
+# Requests per second allowed per Nova endpoint, lowered automatically while Nova answers 429
+NOVA_RATE = 20.0
+
+# ----------------------
+
+
+# Profiling of process.process
+# ----------------------
+
+# None to not profile, "cprofile" for deterministic profiling or "sample" for a stack sampler.
+# Both see the queue framework's worker threads; "sample" also shows where they wait on Nova
+PROFILE_MODE = None
+
+# Profile only every Nth call of process.process (every Nth batch of queue elements in the queue framework)
+PROFILE_EVERY = 1
+
+# The number of functions listed in the summary printed at the end of the run
+PROFILE_TOP = 25
+
+# The directory the profile files are written to, next to the robot's database
+PROFILE_DIR = "."
+
 # ----------------------
@@ -5,6 +5,7 @@
 
 import sys
 
+from profiling import RowProfiler, maybe_profile_row
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 from robot_framework import initialize
@@ -22,11 +23,16 @@ def main():
     orchestrator_connection.log_trace("Robot Framework started.")
     initialize.initialize(orchestrator_connection)
 
+    profiler = None
+    if config.PROFILE_MODE:
+        profiler = RowProfiler(config.PROFILE_DIR, config.PROFILE_MODE, config.PROFILE_EVERY, config.PROFILE_TOP, label="process")
+
     error_count = 0
     for _ in range(config.MAX_RETRY_COUNT):
         try:
             reset.reset(orchestrator_connection)
-            process.process(orchestrator_connection)
+            with maybe_profile_row(profiler):
+                process.process(orchestrator_connection)
             break
 
         # If any business rules are broken the robot should stop entirely.
@@ -40,6 +46,9 @@ def main():
             error_count += 1
             handle_error(f"Process Error #{error_count}", error, None, orchestrator_connection)
 
+    if profiler is not None:
+        orchestrator_connection.log_info(f"Profile written to {profiler.finish()}")
+
     reset.clean_up(orchestrator_connection)
     reset.close_all(orchestrator_connection)
     reset.kill_all(orchestrator_connection)
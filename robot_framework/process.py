@@ -3,8 +3,78 @@
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 from OpenOrchestrator.database.queues import QueueElement
 
+import sandbox
+from caseworker_directory import CaseworkerDirectory
+from nova import DEFAULT_POOL_SIZE, NovaClient
+from nova_throttle import AdaptiveRateLimiter
 
-# pylint: disable-next=unused-argument
-def process(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement | None = None) -> None:
-    """Do the primary process of the robot."""
+from robot_framework import config
+from robot_framework.exceptions import BusinessError
+
+
+def open_pipeline(orchestrator_connection: OrchestratorConnection) -> sandbox.PipelineRun:
+    """Open the Nova client and caseworker directory shared by all queue elements of a run.
+
+    Args:
+        orchestrator_connection: A connection to OpenOrchestrator, used for the Nova URL and credentials.
+
+    Returns:
+        A PipelineRun to pass to process. Close it with close_pipeline.
+    """
+    nova_url, token_provider = sandbox.nova_access(orchestrator_connection)
+    # Every element of a batch may update its tasks on TASK_UPDATE_WORKERS threads at the same time
+    pool_size = max(DEFAULT_POOL_SIZE, config.QUEUE_BATCH_SIZE * sandbox.TASK_UPDATE_WORKERS)
+    client = NovaClient(nova_url, token_provider=token_provider, pool_size=pool_size, rate_limiter=AdaptiveRateLimiter(config.NOVA_RATE))
+    return sandbox.PipelineRun(client, CaseworkerDirectory(sandbox.CASEWORKER_DB_PATH))
+
+
+def close_pipeline(pipeline: sandbox.PipelineRun) -> None:
+    """Close the Nova client and caseworker directory opened by open_pipeline."""
+    pipeline.client.close()
+    pipeline.directory.close()
+
+
+def process(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement | None = None,
+            pipeline: sandbox.PipelineRun | None = None) -> str | None:
+    """Do the primary process of the robot.
+
+    Moves the case of the queue element (made by `python sandbox.py enqueue`) and its open tasks
+    from the old to the new caseworker through the Nova pipeline.
+
+    Args:
+        orchestrator_connection: A connection to OpenOrchestrator.
+        queue_element: The queue element to process.
+        pipeline: A PipelineRun from open_pipeline, shared with the other queue elements of the run.
+            If None, one is opened and closed for this element.
+
+    Returns:
+        A short summary of the steps for the queue element's message, or None without a queue element.
+
+    Raises:
+        BusinessError: If the case is not with the old caseworker or Nova does not know the new one.
+    """
     orchestrator_connection.log_trace("Running process.")
+    if queue_element is None:
+        return None
+
+    row = sandbox.decode_queue_row(queue_element.data)
+    updates = sandbox.empty_updates()
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = open_pipeline(orchestrator_connection)
+
+    try:
+        sandbox.process_row(pipeline, row.sagsnummer, row.oldazident, row.newazident, updates)
+    except sandbox.CaseNotMovableError as error:
+        raise BusinessError(f"{row.sagsnummer}: {error}") from error
+    finally:
+        if own_pipeline:
+            close_pipeline(pipeline)
+
+    # The case has been moved, but tasks that failed are still with the old caseworker.
+    # Processing the element again only sends the missing updates.
+    if not sandbox.tasks_step_done(updates):
+        raise RuntimeError(f"{row.sagsnummer}: not all tasks were moved ({updates['update_tasks_status']}). {updates['update_tasks_response']}")
+
+    return (f"{updates['fetch_case_response']}; {updates['lookup_new_caseworker_response']}; tasks {updates['update_tasks_status']}; "
+            f"case: {updates['update_case_response']}; task: {updates['create_task_response']}")
@@ -4,10 +4,18 @@
 # pylint: disable=duplicate-code
 
 import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 
+from profiling import RowProfiler, maybe_profile_row
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
-from OpenOrchestrator.database.queues import QueueStatus
+from OpenOrchestrator.database import db_util
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
 
+import sandbox
 from robot_framework import initialize
 from robot_framework import reset
 from robot_framework.exceptions import handle_error, BusinessError, log_exception
@@ -22,8 +30,12 @@ def main():
 
     orchestrator_connection.log_trace("Robot Framework started.")
     initialize.initialize(orchestrator_connection)
+    pipeline = process.open_pipeline(orchestrator_connection)
+
+    profiler = None
+    if config.PROFILE_MODE:
+        profiler = RowProfiler(config.PROFILE_DIR, config.PROFILE_MODE, config.PROFILE_EVERY, config.PROFILE_TOP, label="process")
 
-    queue_element = None
     error_count = 0
     task_count = 0
     # Retry loop
@@ -33,19 +45,15 @@ def main():
 
             # Queue loop
             while task_count < config.MAX_TASK_COUNT:
-                task_count += 1
-                queue_element = orchestrator_connection.get_next_queue_element(config.QUEUE_NAME)
+                queue_elements = claim_queue_elements(orchestrator_connection, config.QUEUE_NAME, min(config.QUEUE_BATCH_SIZE, config.MAX_TASK_COUNT - task_count))
+                task_count += len(queue_elements)
 
-                if not queue_element:
+                if not queue_elements:
                     orchestrator_connection.log_info("Queue empty.")
                     break  # Break queue loop
 
-                try:
-                    process.process(orchestrator_connection, queue_element)
-                    orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.DONE)
-
-                except BusinessError as error:
-                    handle_error("Business Error", error, queue_element, orchestrator_connection)
+                with maybe_profile_row(profiler):
+                    process_batch(orchestrator_connection, queue_elements, pipeline)
 
             break  # Break retry loop
 
@@ -53,11 +61,117 @@ def main():
         # pylint: disable-next = broad-exception-caught
         except Exception as error:
             error_count += 1
-            handle_error(f"Process Error #{error_count}", error, queue_element, orchestrator_connection)
+            # Queue elements of a failed batch have already been marked as failed by process_batch
+            handle_error(f"Process Error #{error_count}", error, None, orchestrator_connection)
+
+    if profiler is not None:
+        orchestrator_connection.log_info(f"Profile written to {profiler.finish()}")
 
+    process.close_pipeline(pipeline)
     reset.clean_up(orchestrator_connection)
     reset.close_all(orchestrator_connection)
     reset.kill_all(orchestrator_connection)
 
     if config.FAIL_ROBOT_ON_TOO_MANY_ERRORS and error_count == config.MAX_RETRY_COUNT:
         raise RuntimeError("Process failed too many times.")
+
+
+def orchestrator_session() -> Session | None:
+    """Open a session on the orchestrator database.
+
+    OpenOrchestrator has no API for claiming several queue elements at once, so claim_queue_elements
+    uses the session of its db_util module directly. That function is private and may change between
+    OpenOrchestrator versions, so this is the only place it is used.
+
+    Returns:
+        A new session, or None if the installed OpenOrchestrator does not provide one.
+    """
+    get_session = getattr(db_util, "_get_session", None)
+    return get_session() if get_session is not None else None
+
+
+def claim_queue_elements(orchestrator_connection: OrchestratorConnection, queue_name: str, count: int) -> list[QueueElement]:
+    """Claim the next new queue elements of a queue in one round trip to the orchestrator database,
+    instead of one get_next_queue_element call per element.
+    The elements are marked 'in progress' and their start time is noted, like get_next_queue_element does.
+    Rows locked by another robot claiming at the same time are skipped on databases that support it.
+
+    Args:
+        orchestrator_connection: A connection to OpenOrchestrator, used if no database session is available.
+        queue_name: The name of the queue to claim from.
+        count: The maximum number of queue elements to claim.
+
+    Returns:
+        The claimed queue elements, oldest first. Empty if the queue has no new elements.
+    """
+    session = orchestrator_session()
+    if session is None:
+        # Claim one element per round trip through the public API instead
+        queue_elements = []
+        while len(queue_elements) < count and (queue_element := orchestrator_connection.get_next_queue_element(queue_name)):
+            queue_elements.append(queue_element)
+        return queue_elements
+
+    with session:
+        # Keep the claimed elements readable after the session is closed
+        session.expire_on_commit = False
+        query = (
+            select(QueueElement)
+            .where(QueueElement.queue_name == queue_name)
+            .where(QueueElement.status == QueueStatus.NEW)
+            .order_by(QueueElement.created_date)
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        )
+        queue_elements = list(session.scalars(query))
+
+        if queue_elements:
+            session.execute(
+                update(QueueElement)
+                .where(QueueElement.id.in_([queue_element.id for queue_element in queue_elements]))
+                .values(status=QueueStatus.IN_PROGRESS, start_date=datetime.now())
+            )
+        session.commit()
+
+    return queue_elements
+
+
+def process_batch(orchestrator_connection: OrchestratorConnection, queue_elements: list[QueueElement], pipeline: sandbox.PipelineRun) -> None:
+    """Process a batch of queue elements concurrently and set the status of each as soon as it is done.
+    Elements that break business rules are handled like in the single element queue loop.
+
+    Args:
+        orchestrator_connection: A connection to OpenOrchestrator.
+        queue_elements: The claimed queue elements.
+        pipeline: The PipelineRun from process.open_pipeline shared by all elements.
+
+    Raises:
+        Exception: The first process error of the batch, after every element of the batch has a status.
+            Elements that failed with a process error are marked as failed.
+    """
+    process_error = None
+    with ThreadPoolExecutor(max_workers=len(queue_elements)) as executor:
+        futures = {
+            executor.submit(process.process, orchestrator_connection, queue_element, pipeline): queue_element
+            for queue_element in queue_elements
+        }
+
+        for future in as_completed(futures):
+            queue_element = futures[future]
+            try:
+                message = future.result()
+                orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.DONE, message)
+
+            except BusinessError as error:
+                handle_error("Business Error", error, queue_element, orchestrator_connection)
+
+            # The first process error is raised to the retry loop once the whole batch has a status.
+            # pylint: disable-next = broad-exception-caught
+            except Exception as error:
+                orchestrator_connection.set_queue_element_status(
+                    queue_element.id, QueueStatus.FAILED, f"Process Error: {repr(error)}\n\nTrace:\n{traceback.format_exc()}"
+                )
+                process_error = process_error or error
+
+    if process_error is not None:
+        raise process_error
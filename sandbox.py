@@ -1,20 +1,30 @@
 import os
-import json
 import uuid
+import socket
 import sqlite3
+import threading
+import time
+import asyncio
+import argparse
+import hashlib
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
-import pandas as pd
-
-from nova import (
-    get_access_token,
-    fetch_case,
-    get_task_list,
-    lookup_caseworker_by_racfId,
-    update_caseworker_case,
-    update_caseworker_task,
-    create_task,
-)
+import requests
+import aiohttp
+import msgspec
+
+from nova import DEFAULT_POOL_SIZE, AccessTokenProvider, NovaClient, index_cases_by_number
+from nova_async import AsyncNovaClient, DEFAULT_MAX_IN_FLIGHT
+from nova_models import CaseList, Caseworker, Task
+from nova_metrics import MetricsRecorder, print_report
+from nova_replay import REPLAY_URL, RecordingAdapter, ReplayAdapter, ReplayTokenProvider, TrafficArchive
+from nova_throttle import DEFAULT_RATE, AdaptiveRateLimiter, HedgePolicy
+from input_rows import batched, read_input_rows
+from profiling import PROFILE_MODES, RowProfiler, maybe_profile_row
+from caseworker_directory import CaseworkerDirectory, DEFAULT_NEGATIVE_TTL, DEFAULT_TTL
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 
@@ -22,28 +32,99 @@ from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConn
 XLSX_PATH = "input_cases.xlsx"
 SQLITE_PATH = "sagsflyt.sqlite3"
 TABLE_NAME = "sagsflyt"
-# Exact Excel column names (as provided)
-EXCEL_COLS = ["Oprindelig sagsbehandler", "Ny sagsbehandler", "Sagsnummer"]
+# Resolved reads per row, written by the plan command and applied by execute
+PLAN_TABLE_NAME = "sagsflyt_plan"
+# Outcome of every task update, one row per task
+TASK_RESULTS_TABLE_NAME = "sagsflyt_tasks"
+# Compressed read responses per row and step, only written with --keep-responses
+RESPONSES_TABLE_NAME = "sagsflyt_responses"
+# Token cache shared by all robot processes of this user, kept in the user's app data directory and out of the checkout
+TOKEN_CACHE_PATH = os.path.join(os.getenv("LOCALAPPDATA") or os.path.expanduser("~/.cache"), "NovaSagsFlyt", "nova_token.json")
+# Persistent caseworker directory shared across runs
+CASEWORKER_DB_PATH = "caseworker_directory.sqlite3"
+# Rows worked on at once by run-async
+DEFAULT_ROWS_IN_FLIGHT = 20
+# Threads updating the tasks of one case at once
+TASK_UPDATE_WORKERS = 8
+# Extra attempts for a task update that failed with a connection error, timeout or 5xx; the client already retries 429s
+TASK_UPDATE_RETRIES = 2
+# Seconds to wait before the first retry, doubled for each further retry
+TASK_UPDATE_BACKOFF = 0.5
+# Old caseworkers with at least this many pending rows get all their cases prefetched in bulk
+PREFETCH_MIN_ROWS = 10
+# Input rows upserted per executemany call while ingesting a file
+INGEST_BATCH_SIZE = 1000
+# Rows a worker claims at once; other workers skip them while the lease lasts
+CLAIM_BATCH_SIZE = 50
+# Seconds a claim lasts without renewal; rows of a crashed worker are free again after this
+LEASE_SECONDS = 300
+# Seconds between lease renewals of a running worker
+LEASE_RENEW_INTERVAL = 60
+# Pragmas set on every connection to SQLITE_PATH. WAL lets the metrics recorder, the caseworker
+# directory and several workers read while one writes; NORMAL sync is safe in WAL mode
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,       # KiB
+    "mmap_size": 268435456,
+}
+# Row results buffered by RowWriter before they are written in one transaction
+ROW_WRITE_BATCH_SIZE = 100
+# Seconds after which buffered row results are written even if the batch is not full
+ROW_WRITE_FLUSH_INTERVAL = 5.0
+# OpenOrchestrator queue filled by the enqueue command; robot_framework/config.py QUEUE_NAME must match
+QUEUE_NAME = "NovaSagsFlyt"
+# Queue elements created per insert by the enqueue command
+ENQUEUE_BATCH_SIZE = 1000
 # ----------------------------
 
+# Step checkpoints added to TABLE_NAME after the first release; connect_db adds them to older databases
+CHECKPOINT_COLUMNS = {
+    "case_uuid": "TEXT",
+    "old_caseworker_fullname": "TEXT",
+    "new_caseworker": "TEXT",
+    "completed_task_uuids": "TEXT",
+}
+# Row leases, see claim_rows
+LEASE_COLUMNS = {
+    "worker_id": "TEXT",
+    "lease_expires_at": "REAL",
+}
+
+
+class CaseNotMovableError(RuntimeError):
+    """A row that cannot be carried out as given: the case is not with the old caseworker, or Nova does not know the new one."""
+
+
+def add_missing_columns(conn, table, columns):
+    """Adds the columns (name -> SQL type) that table does not have yet, leaving existing data alone."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    with conn:
+        for name, sql_type in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+
 
 def connect_db():
-    conn = sqlite3.connect(SQLITE_PATH)
+    conn = sqlite3.connect(SQLITE_PATH, timeout=30)
+    for pragma, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
     conn.execute(f"""
     CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
         sagsnummer TEXT PRIMARY KEY,
         oprindelig_sagsbehandler TEXT,
         ny_sagsbehandler TEXT,
 
-        -- Step responses / statuses
+        -- Step responses / statuses; full responses are in RESPONSES_TABLE_NAME if kept
         fetch_case_status INTEGER,
-        fetch_case_response TEXT,
+        fetch_case_response TEXT,               -- e.g. "1 case(s)"
 
         lookup_new_caseworker_status INTEGER,   -- 200 if found, 404 if not found/error
-        lookup_new_caseworker_response TEXT,    -- short JSON (kspIdentity etc.)
+        lookup_new_caseworker_response TEXT,    -- "racfId: full name"
 
-        update_tasks_status TEXT,               -- e.g. summary "updated:3;skipped:2"
-        update_tasks_response TEXT,             -- JSON array with taskUuid + status
+        update_tasks_status TEXT,               -- e.g. summary "updated:3;failed:2"
+        update_tasks_response TEXT,             -- the failed tasks and their errors; every task is in TASK_RESULTS_TABLE_NAME
 
         update_case_status INTEGER,
         update_case_response TEXT,
@@ -51,205 +132,1426 @@ def connect_db():
         create_task_status INTEGER,
         create_task_response TEXT,
 
+        -- Step checkpoints, read back by `run --resume`
+        case_uuid TEXT,                         -- case found by fetch_case
+        old_caseworker_fullname TEXT,
+        new_caseworker TEXT,                    -- JSON caseworker block found by lookup_caseworker
+        completed_task_uuids TEXT,              -- JSON array of the tasks already moved
+
+        row_hash TEXT,                          -- hash of the input row; unchanged rows are skipped on re-import
+        worker_id TEXT,                         -- worker that claimed the row last
+        lease_expires_at REAL,                  -- unix time the claim runs out; NULL once released
         processed_at TEXT
     );
     """)
+    add_missing_columns(conn, TABLE_NAME, CHECKPOINT_COLUMNS)
+    add_missing_columns(conn, TABLE_NAME, {"row_hash": "TEXT"})
+    add_missing_columns(conn, TABLE_NAME, LEASE_COLUMNS)
+    # Partial indexes holding only the rows still to do, so the pending-row queries do not scan the table
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_unprocessed ON {TABLE_NAME} (sagsnummer) WHERE {UNPROCESSED_CONDITION}")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE_NAME}_unfinished ON {TABLE_NAME} (sagsnummer) WHERE processed_at IS NULL")
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {PLAN_TABLE_NAME} (
+        sagsnummer TEXT PRIMARY KEY,
+        oprindelig_sagsbehandler TEXT,          -- input the plan was made for; a changed row is re-planned
+        ny_sagsbehandler TEXT,
+
+        plan_status TEXT NOT NULL,              -- 'ready' or 'invalid'
+        plan_error TEXT,                        -- why an invalid row cannot be executed
+
+        case_uuid TEXT,
+        old_caseworker_fullname TEXT,
+        new_caseworker TEXT,                    -- JSON caseworker block of the new caseworker
+        tasks TEXT,                             -- JSON array of the tasks to move
+        skip_steps TEXT,                        -- JSON array of the write steps Nova needs no call for
+
+        planned_at TEXT,
+        executed_at TEXT
+    );
+    """)
+    add_missing_columns(conn, PLAN_TABLE_NAME, {"skip_steps": "TEXT"})
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {TASK_RESULTS_TABLE_NAME} (
+        sagsnummer TEXT NOT NULL,
+        task_uuid TEXT NOT NULL,
+        title TEXT,
+        status INTEGER,                         -- HTTP status of Task/Update; NULL if it failed without one
+        error TEXT,
+        seconds REAL,                           -- time spent on the task, retries included
+        recorded_at TEXT,
+        PRIMARY KEY (sagsnummer, task_uuid)
+    );
+    """)
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {RESPONSES_TABLE_NAME} (
+        sagsnummer TEXT NOT NULL,
+        step TEXT NOT NULL,                     -- 'fetch_case', 'lookup_caseworker' or 'get_task_list'
+        body BLOB NOT NULL,                     -- zlib-compressed JSON array of the raw response bodies, in order
+        recorded_at TEXT,
+        PRIMARY KEY (sagsnummer, step)
+    );
+    """)
     return conn
 
 
 def load_xlsx_into_db(conn):
-    # Read Excel (only needed columns)
-    df = pd.read_excel(XLSX_PATH, dtype=str, engine="openpyxl")[EXCEL_COLS].fillna("")
+    return load_input_into_db(conn, XLSX_PATH)
 
-    # Standardize whitespace
-    for c in EXCEL_COLS:
-        df[c] = df[c].map(lambda v: v.strip() if isinstance(v, str) else v)
 
-    # Upsert rows based on Sagsnummer
-    # Use a temp table approach to avoid pandas dtype surprises
+def load_input_into_db(conn, path, batch_size=INGEST_BATCH_SIZE):
+    """
+    Streams the rows of an .xlsx, .csv or input_cases.txt file (see input_rows.py) into TABLE_NAME in
+    batches of batch_size, all in one transaction. Returns (rows read, rows inserted or changed).
+    """
+    read = changed = 0
     with conn:
-        conn.execute("BEGIN")
-        for _, row in df.iterrows():
-            original = row["Oprindelig sagsbehandler"]
-            new = row["Ny sagsbehandler"]
-            sagsnr = row["Sagsnummer"]
-
-            # Insert if not exists; otherwise update caseworkers (but do NOT touch response columns)
-            conn.execute(f"""
-            INSERT INTO {TABLE_NAME} (sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler)
-            VALUES (?, ?, ?)
-            ON CONFLICT(sagsnummer) DO UPDATE SET
-                oprindelig_sagsbehandler=excluded.oprindelig_sagsbehandler,
-                ny_sagsbehandler=excluded.ny_sagsbehandler
-            """, (sagsnr, original, new))
-        conn.execute("COMMIT")
-
-
-def dict_preview(d, max_len=2000):
-    """Safely JSON-dumps a dict and truncates (SQLite TEXT is fine, but keep it readable)."""
-    try:
-        s = json.dumps(d, ensure_ascii=False)
-    except Exception:
-        s = str(d)
-    if len(s) > max_len:
-        return s[:max_len] + "…"
-    return s
+        for batch in batched(read_input_rows(path), batch_size):
+            read += len(batch)
+            changed += _upsert_input_batch(conn, batch)
+    print(f"Read {read} row(s) from {path}: {changed} new or changed, {read - changed} unchanged.")
+    return read, changed
 
 
-def run_pipeline_for_unprocessed_rows():
-    conn = connect_db()
-    # load_xlsx_into_db(conn)
+def input_row_hash(sagsnr, oldazident, newazident):
+    return hashlib.sha1("\x1f".join((sagsnr, oldazident or "", newazident or "")).encode("utf-8")).hexdigest()
 
-    # Prepare Orchestrator/Nova access
-    orchestrator_connection = OrchestratorConnection(
+
+def _upsert_input_batch(conn, rows):
+    before = conn.total_changes
+    # Rows whose hash is unchanged are not written, so re-importing the same file costs only the lookups
+    conn.executemany(f"""
+    INSERT INTO {TABLE_NAME} (sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler, row_hash)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(sagsnummer) DO UPDATE SET
+        oprindelig_sagsbehandler=excluded.oprindelig_sagsbehandler,
+        ny_sagsbehandler=excluded.ny_sagsbehandler,
+        row_hash=excluded.row_hash
+    WHERE row_hash IS NOT excluded.row_hash
+    """, [(sagsnr, oldazident, newazident, input_row_hash(sagsnr, oldazident, newazident)) for sagsnr, oldazident, newazident in rows])
+    return conn.total_changes - before
+
+
+def upsert_input_rows(conn, rows):
+    """
+    Inserts (sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler) rows in one transaction and returns how many
+    were new or changed. Existing rows get their caseworkers updated, but their response columns are not touched.
+    """
+    with conn:
+        return _upsert_input_batch(conn, rows)
+
+
+def connect_orchestrator():
+    return OrchestratorConnection(
         "NovaSagsFlyt",
         os.getenv("OpenOrchestratorSQL"),
         os.getenv("OpenOrchestratorKey"),
         None
     )
-    access_token = get_access_token(orchestrator_connection)
+
+
+def nova_access(orchestrator_connection):
+    """Returns (Nova_URL, token_provider) for the Nova API, with the token shared through TOKEN_CACHE_PATH."""
+    token_provider = AccessTokenProvider.from_orchestrator(orchestrator_connection, cache_path=TOKEN_CACHE_PATH)
     Nova_URL = orchestrator_connection.get_constant("KMDNovaURL").value
+    return Nova_URL, token_provider
 
-    # Only pick rows where ALL response columns are NULL (=> never processed)
-    query = f"""
-    SELECT sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler
-    FROM {TABLE_NAME}
-    WHERE fetch_case_status IS NULL
+
+class QueueRow(msgspec.Struct):
+    """Data of one queue element made by enqueue_input_rows; the element's reference is the sagsnummer."""
+    sagsnummer: str
+    oldazident: str
+    newazident: str
+
+
+def enqueue_input_rows(orchestrator_connection, path, queue_name=QUEUE_NAME, batch_size=ENQUEUE_BATCH_SIZE):
+    """
+    Streams the rows of an .xlsx, .csv or .txt input file (see input_rows.py) into an OpenOrchestrator queue
+    for robot_framework/queue_framework.py, batch_size elements per insert, and returns the number of elements.
+    Rows without both caseworkers are left out. Every call queues all rows again; rows that were already
+    moved cost the robot only reads, see process_row.
+    """
+    queued = skipped = 0
+    for batch in batched(read_input_rows(path), batch_size):
+        rows = [QueueRow(*row) for row in batch if row[1] and row[2]]
+        skipped += len(batch) - len(rows)
+        if rows:
+            orchestrator_connection.bulk_create_queue_elements(
+                queue_name,
+                tuple(row.sagsnummer for row in rows),
+                tuple(msgspec.json.encode(row).decode("utf-8") for row in rows),
+                created_by=orchestrator_connection.process_name,
+            )
+            queued += len(rows)
+    print(f"Queued {queued} row(s) from {path} in {queue_name}; {skipped} row(s) without both caseworkers left out.")
+    return queued
+
+
+def decode_queue_row(data):
+    """Returns the QueueRow held in the data of a queue element made by enqueue_input_rows."""
+    return msgspec.json.decode(data, type=QueueRow)
+
+
+# Only pick rows where ALL response columns are NULL (=> never processed)
+UNPROCESSED_CONDITION = """
+      fetch_case_status IS NULL
       AND lookup_new_caseworker_status IS NULL
       AND update_tasks_status IS NULL
       AND update_case_status IS NULL
       AND create_task_status IS NULL
+"""
+
+
+def fetch_unprocessed_rows(conn):
+    """Returns (sagsnummer, oldazident, newazident) of the unprocessed rows that no worker holds a lease on."""
+    query = f"""
+    SELECT sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler
+    FROM {TABLE_NAME}
+    WHERE {UNPROCESSED_CONDITION}
+      AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+    """
+    return conn.execute(query, (time.time(),)).fetchall()
+
+
+def new_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def claim_rows(conn, worker_id, batch_size=CLAIM_BATCH_SIZE, lease_seconds=LEASE_SECONDS, resume=False):
+    """
+    Claims up to batch_size pending rows for worker_id and returns them as (sagsnummer, oldazident, newazident, updates),
+    with updates holding the statuses and checkpoints stored so far, so process_row continues where a row stopped.
+
+    Pending means unprocessed, or with resume not fully processed. Rows leased by another worker are skipped until
+    the lease expires, and rows worker_id claimed before are skipped too, so a failed row is tried once per run.
+    The select and the update run in one BEGIN IMMEDIATE transaction, so two workers never claim the same row.
+    """
+    columns = list(empty_updates())
+    pending = "processed_at IS NULL" if resume else UNPROCESSED_CONDITION
+    now = time.time()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(f"""
+        SELECT sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler, {", ".join(columns)}
+        FROM {TABLE_NAME}
+        WHERE {pending}
+          AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+          AND worker_id IS NOT ?
+        LIMIT ?
+        """, (now, worker_id, batch_size)).fetchall()
+        lease_rows(conn, worker_id, [row[0] for row in rows], now + lease_seconds)
+    return [(row[0], row[1], row[2], dict(zip(columns, row[3:]))) for row in rows]
+
+
+def lease_rows(conn, worker_id, sagsnrs, expires_at):
+    """Leases sagsnrs to worker_id until unix time expires_at; run it in the transaction that selected them."""
+    conn.executemany(f"UPDATE {TABLE_NAME} SET worker_id = ?, lease_expires_at = ? WHERE sagsnummer = ?",
+                     [(worker_id, expires_at, sagsnr) for sagsnr in sagsnrs])
+
+
+def renew_leases(conn, worker_id, lease_seconds=LEASE_SECONDS):
+    with conn:
+        conn.execute(f"UPDATE {TABLE_NAME} SET lease_expires_at = ? WHERE worker_id = ? AND lease_expires_at IS NOT NULL",
+                     (time.time() + lease_seconds, worker_id))
+
+
+def release_leases(conn, worker_id, sagsnrs):
+    """Ends the leases of worker_id on sagsnrs; call it only once their results are written."""
+    with conn:
+        conn.executemany(f"UPDATE {TABLE_NAME} SET lease_expires_at = NULL WHERE sagsnummer = ? AND worker_id = ?",
+                         [(sagsnr, worker_id) for sagsnr in sagsnrs])
+
+
+class LeaseKeeper:
+    """
+    Background thread renewing the leases of worker_id every interval seconds on its own connection,
+    so rows stay claimed however long a batch takes, and expire soon after the worker dies.
+    """
+
+    def __init__(self, worker_id, lease_seconds=LEASE_SECONDS, interval=LEASE_RENEW_INTERVAL):
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = connect_db()
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    renew_leases(conn, self.worker_id, self.lease_seconds)
+                except sqlite3.OperationalError as e:
+                    print(f"Could not renew the leases of {self.worker_id}: {e}")
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def save_plans(conn, plans, failures):
+    """
+    Stores the ready RowPlans and the (sagsnummer, oldazident, newazident, error) of the rows that failed
+    planning in one transaction, replacing any earlier plan for the same rows.
+    """
+    planned_at = datetime.now().isoformat(timespec="seconds")
+    records = [
+        (plan.sagsnummer, plan.oprindelig_sagsbehandler, plan.ny_sagsbehandler, "ready", None, plan.case_uuid, plan.old_caseworker_fullname,
+         msgspec.json.encode(plan.new_caseworker).decode("utf-8"), msgspec.json.encode(plan.tasks).decode("utf-8"),
+         msgspec.json.encode(plan.skip_steps).decode("utf-8"), planned_at)
+        for plan in plans
+    ]
+    records += [
+        (sagsnr, oldazident, newazident, "invalid", error, None, None, None, None, None, planned_at)
+        for sagsnr, oldazident, newazident, error in failures
+    ]
+    with conn:
+        conn.executemany(f"""
+        INSERT INTO {PLAN_TABLE_NAME} (sagsnummer, oprindelig_sagsbehandler, ny_sagsbehandler, plan_status, plan_error,
+                                       case_uuid, old_caseworker_fullname, new_caseworker, tasks, skip_steps, planned_at, executed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)
+        ON CONFLICT(sagsnummer) DO UPDATE SET
+            oprindelig_sagsbehandler=excluded.oprindelig_sagsbehandler,
+            ny_sagsbehandler=excluded.ny_sagsbehandler,
+            plan_status=excluded.plan_status,
+            plan_error=excluded.plan_error,
+            case_uuid=excluded.case_uuid,
+            old_caseworker_fullname=excluded.old_caseworker_fullname,
+            new_caseworker=excluded.new_caseworker,
+            tasks=excluded.tasks,
+            skip_steps=excluded.skip_steps,
+            planned_at=excluded.planned_at,
+            executed_at=NULL
+        """, records)
+
+
+def claim_planned_rows(conn, worker_id, batch_size=CLAIM_BATCH_SIZE, lease_seconds=LEASE_SECONDS):
+    """
+    Claims up to batch_size RowPlans that are ready to execute for worker_id: planned, not executed yet, the row
+    is still unprocessed and its caseworkers have not changed since it was planned. Their rows in TABLE_NAME are
+    leased like in claim_rows, so a run worker cannot move a row while its plan is being executed, and the other way round.
+    """
+    now = time.time()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(f"""
+        SELECT p.sagsnummer, p.oprindelig_sagsbehandler, p.ny_sagsbehandler, p.case_uuid, p.old_caseworker_fullname, p.new_caseworker, p.tasks,
+               p.skip_steps
+        FROM {PLAN_TABLE_NAME} p
+        JOIN {TABLE_NAME} s ON s.sagsnummer = p.sagsnummer
+        WHERE p.plan_status = 'ready'
+          AND p.executed_at IS NULL
+          AND s.oprindelig_sagsbehandler IS p.oprindelig_sagsbehandler
+          AND s.ny_sagsbehandler IS p.ny_sagsbehandler
+          AND {UNPROCESSED_CONDITION}
+          AND (s.lease_expires_at IS NULL OR s.lease_expires_at < ?)
+          AND s.worker_id IS NOT ?
+        LIMIT ?
+        """, (now, worker_id, batch_size)).fetchall()
+        lease_rows(conn, worker_id, [row[0] for row in rows], now + lease_seconds)
+    return [
+        RowPlan(sagsnr, oldazident, newazident, case_uuid, fullname,
+                msgspec.json.decode(new_caseworker, type=Caseworker), msgspec.json.decode(tasks, type=list[Task]),
+                msgspec.json.decode(skip_steps or "[]", type=list[str]))
+        for sagsnr, oldazident, newazident, case_uuid, fullname, new_caseworker, tasks, skip_steps in rows
+    ]
+
+
+def mark_plan_executed(conn, sagsnr):
+    with conn:
+        conn.execute(f"UPDATE {PLAN_TABLE_NAME} SET executed_at = ? WHERE sagsnummer = ?", (datetime.now().isoformat(timespec="seconds"), sagsnr))
+
+
+def count_rows_to_fetch(conn, resume=False):
+    """
+    Returns the number of pending rows whose case is not fetched yet per lowercased old caseworker, over the whole table.
+    Pass it to prefetch_case_index as pending_counts, so a caseworker whose rows are spread over several claimed
+    batches is still prefetched.
+    """
+    pending = "processed_at IS NULL" if resume else UNPROCESSED_CONDITION
+    return dict(conn.execute(f"""
+    SELECT lower(trim(oprindelig_sagsbehandler)), COUNT(*)
+    FROM {TABLE_NAME}
+    WHERE {pending}
+      AND case_uuid IS NULL
+    GROUP BY lower(trim(oprindelig_sagsbehandler))
+    """).fetchall())
+
+
+def caseworkers_to_prefetch(rows, min_rows=PREFETCH_MIN_ROWS, prefetched=(), pending_counts=None):
+    """
+    Returns the racfIds of the old caseworkers that have at least min_rows pending rows, leaving out the lowercased racfIds in prefetched.
+    The rows are counted in rows, or in pending_counts (see count_rows_to_fetch) for the caseworkers of rows if given.
+    """
+    counts = {}
+    spelling = {}
+    for _, oldazident, _ in rows:
+        key = (oldazident or "").strip().lower()
+        if key and key not in prefetched:
+            counts[key] = counts.get(key, 0) + 1
+            spelling.setdefault(key, oldazident.strip())
+    if pending_counts is not None:
+        counts = {key: pending_counts.get(key, count) for key, count in counts.items()}
+    return [spelling[key] for key, count in counts.items() if count >= min_rows]
+
+
+def prefetch_case_index(client, rows, min_rows=PREFETCH_MIN_ROWS, prefetched=None, pending_counts=None):
+    """
+    Fetches all cases of each old caseworker with many pending rows in a few paged Case/GetList calls,
+    and indexes them on userFriendlyCaseNumber. Replaces one fetch_case per row with about one request
+    per 500 cases.
+    prefetched is an optional set of lowercased racfIds whose cases are already indexed; they are
+    skipped, and the caseworkers fetched now are added to it. pending_counts is passed to caseworkers_to_prefetch.
+    """
+    case_index = {}
+    for racfId in caseworkers_to_prefetch(rows, min_rows, prefetched or (), pending_counts):
+        cases = client.list_cases_by_caseworker(racfId)
+        print(f"Prefetched {len(cases)} case(s) for {racfId}.")
+        case_index.update(index_cases_by_number(cases))
+        if prefetched is not None:
+            prefetched.add(racfId.lower())
+    return case_index
+
+
+def empty_updates():
+    # Default row fields to update
+    return {
+        "fetch_case_status": None,
+        "fetch_case_response": None,
+        "lookup_new_caseworker_status": None,
+        "lookup_new_caseworker_response": None,
+        "update_tasks_status": None,
+        "update_tasks_response": None,
+        "update_case_status": None,
+        "update_case_response": None,
+        "create_task_status": None,
+        "create_task_response": None,
+        "case_uuid": None,
+        "old_caseworker_fullname": None,
+        "new_caseworker": None,
+        "completed_task_uuids": None,
+        "processed_at": None,
+    }
+
+
+def save_row(conn, sagsnr, updates):
+    set_clause = ", ".join([f"{k} = ?" for k in updates.keys()])
+    params = [updates[k] for k in updates.keys()] + [sagsnr]
+    with conn:
+        conn.execute(f"UPDATE {TABLE_NAME} SET {set_clause} WHERE sagsnummer = ?", params)
+
+
+class RowWriter:
     """
-    to_process = conn.execute(query).fetchall()
-
-    print(f"Found {len(to_process)} row(s) to process.")
-    
-    caseworker_cache: dict[str, dict | None] = {}
-
-
-    for sagsnr, oldazident, newazident in to_process:
-        print(f"\nProcessing {sagsnr}: {oldazident} ➝ {newazident}")
-
-        # Default row fields to update
-        updates = {
-            "fetch_case_status": None,
-            "fetch_case_response": None,
-            "lookup_new_caseworker_status": None,
-            "lookup_new_caseworker_response": None,
-            "update_tasks_status": None,
-            "update_tasks_response": None,
-            "update_case_status": None,
-            "update_case_response": None,
-            "create_task_status": None,
-            "create_task_response": None,
-            "processed_at": None,
+    Buffers row updates and writes them to TABLE_NAME with executemany, one transaction per batch
+    instead of one per row and step. Only the latest updates of a row are kept until the next write.
+    Task results and raw responses are buffered alongside and written in the same transaction.
+
+    Rows lost from the buffer by a crash are done again by the next run; the write elision in
+    process_row makes that cost reads and task updates, which Nova can take twice. The checkpoints
+    after Case/Update and Task/Import are written at once (see PipelineRun.save_checkpoint).
+
+    Parameters:
+        conn (sqlite3.Connection): Connection from connect_db; used from one thread only.
+        batch_size (int): Rows buffered before they are written.
+        flush_interval (float): Seconds after which a partial batch is written anyway.
+        keep_responses (bool): Store the read responses in RESPONSES_TABLE_NAME; they are dropped otherwise.
+    """
+
+    def __init__(self, conn, batch_size=ROW_WRITE_BATCH_SIZE, flush_interval=ROW_WRITE_FLUSH_INTERVAL, keep_responses=False):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.keep_responses = keep_responses
+        self.columns = list(empty_updates())
+        self._pending = {}
+        self._task_results = []
+        self._responses = {}
+        self._flushed_at = time.monotonic()
+
+    def save_task_results(self, sagsnr, per_task_results):
+        recorded_at = datetime.now().isoformat(timespec="seconds")
+        self._task_results.extend(
+            (sagsnr, result["taskUuid"], result["title"], None if result["status"] == "ERROR" else result["status"],
+             result.get("error"), result["seconds"], recorded_at)
+            for result in per_task_results
+        )
+
+    def save_response(self, sagsnr, step, bodies):
+        """Keeps the raw response bodies of step as one compressed JSON array, if keep_responses is set and step sent any requests."""
+        if self.keep_responses and bodies:
+            self._responses[(sagsnr, step)] = (zlib.compress(b"[" + b",".join(bodies) + b"]"), datetime.now().isoformat(timespec="seconds"))
+
+    def save(self, sagsnr, updates):
+        self._pending[sagsnr] = [updates[column] for column in self.columns]
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        batch, self._pending = self._pending, {}
+        task_results, self._task_results = self._task_results, []
+        responses, self._responses = self._responses, {}
+        self._flushed_at = time.monotonic()
+        set_clause = ", ".join(f"{column} = ?" for column in self.columns)
+        with self.conn:
+            self.conn.executemany(f"UPDATE {TABLE_NAME} SET {set_clause} WHERE sagsnummer = ?",
+                                  [values + [sagsnr] for sagsnr, values in batch.items()])
+            self.conn.executemany(f"""
+            INSERT OR REPLACE INTO {TASK_RESULTS_TABLE_NAME} (sagsnummer, task_uuid, title, status, error, seconds, recorded_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, task_results)
+            self.conn.executemany(f"INSERT OR REPLACE INTO {RESPONSES_TABLE_NAME} (sagsnummer, step, body, recorded_at) VALUES (?, ?, ?, ?)",
+                                  [(sagsnr, step, body, recorded_at) for (sagsnr, step), (body, recorded_at) in responses.items()])
+
+
+def find_case(case_list, sagsnr, oldazident, newazident=None):
+    """
+    Returns (case_uuid, caseworker_fullname, already_moved) of the case in case_list with sagsnr owned by
+    oldazident, or (None, None, False). A case already owned by newazident (moved by an earlier run or by hand)
+    is returned with already_moved True and oldazident in place of the old caseworker's name.
+    """
+    moved_uuid = None
+    for case in case_list.cases:
+        caseworker = case.caseworker
+        if caseworker is None or caseworker.racf_id is None or case.case_number is None:
+            continue
+        if case.case_number.lower() != sagsnr.strip().lower():
+            continue
+        if caseworker.racf_id.lower() == (oldazident).lower():
+            return case.uuid, caseworker.full_name, False
+        if newazident and caseworker.racf_id.lower() == newazident.strip().lower():
+            moved_uuid = moved_uuid or case.uuid
+    if moved_uuid:
+        return moved_uuid, oldazident, True
+    return None, None, False
+
+
+def select_tasks_to_update(task_list, oldazident):
+    return [
+        t for t in (task_list or [])
+        if t.caseworker is not None and t.caseworker.racf_id == oldazident
+        and t.task_status_code != "F"
+    ]
+
+
+def task_result(task, status_code=None, error=None, seconds=None):
+    if error is not None:
+        return {
+            "taskUuid": task.task_uuid,
+            "title": task.task_title,
+            "status": "ERROR",
+            "error": str(error),
+            "seconds": seconds
         }
+    return {
+        "taskUuid": task.task_uuid,
+        "title": task.task_title,
+        "status": status_code,
+        "seconds": seconds
+    }
+
+
+def is_retried_update_error(error):
+    """
+    True for task update errors worth another attempt: connection problems, timeouts and 5xx answers.
+    The Nova clients do not retry these for writes. They already retry a 429 themselves, so it is not retried again here.
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return False
+
 
+def update_task_with_retry(client, task, new_caseworker, retries=TASK_UPDATE_RETRIES):
+    """Updates one task, retrying the errors is_retried_update_error accepts on their own. Returns the task's result record."""
+    started = time.perf_counter()
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(TASK_UPDATE_BACKOFF * 2 ** (attempt - 1))
         try:
-            # --- 1) Fetch case list and locate the specific case by old caseworker ---
+            status_code = client.update_caseworker_task(task, new_caseworker)
+            return task_result(task, status_code, seconds=time.perf_counter() - started)
+        except Exception as e:
+            error = e
+            if not is_retried_update_error(e):
+                break
+    return task_result(task, error=error, seconds=time.perf_counter() - started)
+
+
+async def update_task_with_retry_async(client, task, new_caseworker, retries=TASK_UPDATE_RETRIES):
+    started = time.perf_counter()
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(TASK_UPDATE_BACKOFF * 2 ** (attempt - 1))
+        try:
+            status_code = await client.update_caseworker_task(task, new_caseworker)
+            return task_result(task, status_code, seconds=time.perf_counter() - started)
+        except Exception as e:
+            error = e
+            if not is_retried_update_error(e):
+                break
+    return task_result(task, error=error, seconds=time.perf_counter() - started)
+
+
+def update_tasks(client, tasks, new_caseworker, workers=TASK_UPDATE_WORKERS, retries=TASK_UPDATE_RETRIES):
+    """
+    Updates tasks on a bounded thread pool. The result records come back in the same order as tasks,
+    whatever order the updates finish in.
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [update_task_with_retry(client, t, new_caseworker, retries) for t in tasks]
+    with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        return list(pool.map(lambda t: update_task_with_retry(client, t, new_caseworker, retries), tasks))
+
+
+def is_success(status):
+    """True for a 2xx HTTP status; False for None, errors and everything else."""
+    return isinstance(status, int) and 200 <= status < 300
+
+
+def summarize_task_results(per_task_results, already_updated=0):
+    updated_count = already_updated
+    skipped_count = 0
+    for result in per_task_results:
+        if is_success(result["status"]):
+            updated_count += 1
+        else:
+            skipped_count += 1
+    return f"updated:{updated_count};failed:{skipped_count}"
+
+
+def failed_tasks_summary(per_task_results):
+    """The failed tasks of per_task_results as "taskUuid: error; ...", or None if all succeeded."""
+    failed = [f"{result['taskUuid']}: {result.get('error') or result['status']}" for result in per_task_results if not is_success(result["status"])]
+    return "; ".join(failed) or None
+
+
+def transfer_description(caseworker_fullname, new_caseworker_fullname):
+    return (
+        f"Robotten har overført sagen fra {caseworker_fullname} til {new_caseworker_fullname}. "
+        f"Husk at ændre assistent på opgaverne hvis det er relevant."
+    )
+
+
+def record_lookup(updates, new_caseworker):
+    if new_caseworker:
+        updates["lookup_new_caseworker_status"] = 200
+        updates["lookup_new_caseworker_response"] = f"{new_caseworker.racf_id}: {new_caseworker.full_name}"
+    else:
+        updates["lookup_new_caseworker_status"] = 404
+        updates["lookup_new_caseworker_response"] = "Not found"
+        raise CaseNotMovableError("New caseworker not found")
+
+
+def skip_case_update(updates, case_uuid):
+    """Records step 4 as done without a Case/Update call, for a case that already belongs to the new caseworker."""
+    updates["update_case_status"] = 200
+    updates["update_case_response"] = f"case_uuid:{case_uuid} already assigned, not updated"
+
+
+def skip_create_task(updates):
+    """Records step 5 as done without a Task/Import call, for a case that already has the transfer task."""
+    updates["create_task_status"] = 200
+    updates["create_task_response"] = "Transfer task already exists, not created"
+
+
+def record_completed_tasks(updates, completed, per_task_results):
+    """Adds the tasks moved in per_task_results to the completed task uuids and stores them in updates."""
+    completed = set(completed) | {result["taskUuid"] for result in per_task_results if is_success(result["status"])}
+    updates["completed_task_uuids"] = msgspec.json.encode(sorted(completed)).decode("utf-8")
+
+
+def completed_tasks(updates):
+    """The uuids of the tasks already moved for a row, from its completed_task_uuids checkpoint."""
+    return set(msgspec.json.decode(updates["completed_task_uuids"] or "[]", type=list[str]))
+
+
+def tasks_step_done(updates):
+    """True once update_tasks has moved every task of the row; a run with failed tasks is continued on resume."""
+    return (updates["update_tasks_status"] or "").endswith(";failed:0")
+
+
+def finish_row(updates):
+    """
+    Stamps processed_at on a row whose steps all ran. A row with failed task updates is left without it,
+    so `run --resume` picks it up and moves the remaining tasks.
+    """
+    if tasks_step_done(updates):
+        updates["processed_at"] = datetime.now().isoformat(timespec="seconds")
+
+
+def checkpointed_caseworker(updates, newazident):
+    """The new caseworker checkpointed for a row, or None if there is none or it was looked up for another racfId."""
+    if updates["new_caseworker"] is None:
+        return None
+    caseworker = msgspec.json.decode(updates["new_caseworker"], type=Caseworker)
+    if (caseworker.racf_id or "").lower() != (newazident).strip().lower():
+        return None
+    return caseworker
+
+
+def first_incomplete_step(updates):
+    """Name of the first step process_row still has to run for a row with the given stored updates."""
+    if updates["case_uuid"] is None:
+        return "fetch_case"
+    if updates["new_caseworker"] is None:
+        return "lookup_caseworker"
+    if not tasks_step_done(updates):
+        return "update_tasks"
+    if not is_success(updates["update_case_status"]):
+        return "update_case"
+    return "create_task"
+
+
+class PipelineRun:
+    """
+    State shared by all rows of one pipeline run.
+
+    Parameters:
+        client (NovaClient | AsyncNovaClient): Client used for all Nova calls.
+        directory (CaseworkerDirectory): Optional persistent caseworker cache, see caseworker_directory.py.
+        case_index (dict): Prefetched cases keyed on lowercased userFriendlyCaseNumber, see prefetch_case_index.
+            The lowercased racfIds whose cases it holds are kept in prefetched_caseworkers, and the drivers
+            keep the pending rows per old caseworker of the whole run in pending_counts (see count_rows_to_fetch).
+        task_workers (int): Threads updating the tasks of one case (sync driver only).
+        metrics (MetricsRecorder): Optional recorder for the step and row durations, see nova_metrics.py.
+        writer (RowWriter): Optional writer for the row checkpoints process_row saves after each step,
+            the task results and the raw responses.
+    """
+
+    def __init__(self, client, directory=None, case_index=None, task_workers=TASK_UPDATE_WORKERS, metrics=None, writer=None):
+        self.client = client
+        self.directory = directory
+        self.case_index = case_index or {}
+        self.prefetched_caseworkers = set()
+        self.pending_counts = None
+        self.task_workers = task_workers
+        self.metrics = metrics
+        self.writer = writer
+        # Per-run cache of new caseworker lookups; values are futures, so rows asking at the same time share one lookup
+        self.caseworker_cache = {}
+        self._caseworker_cache_lock = threading.Lock()
+        # Step name -> seconds each row spent in it
+        self.step_seconds = {}
+
+    @contextmanager
+    def timed(self, step, sagsnr=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.step_seconds.setdefault(step, []).append(seconds)
+            if self.metrics is not None:
+                self.metrics.record_step(step, seconds, sagsnr)
+
+    def save_checkpoint(self, sagsnr, updates, durable=False):
+        """
+        Saves the checkpoint of a row. durable writes it, and everything buffered before it, at once;
+        use it after a write that must not be sent to Nova twice.
+        """
+        if self.writer is not None:
+            self.writer.save(sagsnr, updates)
+            if durable:
+                self.writer.flush()
+
+    def save_task_results(self, sagsnr, per_task_results):
+        if self.writer is not None:
+            self.writer.save_task_results(sagsnr, per_task_results)
+
+    def response_bodies(self):
+        """Returns a list for the client to append the raw response bodies of a step to, or None if responses are not kept."""
+        return [] if self.writer is not None and self.writer.keep_responses else None
+
+    def save_response(self, sagsnr, step, bodies):
+        if self.writer is not None:
+            self.writer.save_response(sagsnr, step, bodies)
+
+    def record_row(self, sagsnr, started, updates):
+        """Records the duration of one row, started at time.perf_counter() value started."""
+        if self.metrics is not None:
+            self.metrics.record_row(sagsnr, time.perf_counter() - started, updates["processed_at"] is not None)
+
+    def prefetched_case_response(self, sagsnr):
+        """Returns a fetch_case-shaped CaseList for sagsnr from case_index, or None if not prefetched."""
+        case = self.case_index.get(sagsnr.strip().lower())
+        return CaseList(cases=[case]) if case else None
+
+    def lookup_new_caseworker(self, newazident, raw_responses=None):
+        """
+        Looks up newazident via the per-run cache, then the directory, then Nova. Safe to call from several
+        threads: rows asking for the same racfId at once share one lookup, and only the row that started it
+        gets the response bodies in raw_responses. A failed lookup is dropped from the cache, so the next row tries again.
+        """
+        cache_key = (newazident).strip().lower()
+        with self._caseworker_cache_lock:
+            future = self.caseworker_cache.get(cache_key)
+            started_here = future is None
+            if started_here:
+                future = self.caseworker_cache[cache_key] = Future()
+
+        if started_here:
+            try:
+                if self.directory is not None:
+                    future.set_result(self.directory.resolve(self.client, newazident, raw_responses))
+                else:
+                    future.set_result(self.client.lookup_caseworker_by_racfId(newazident, str(uuid.uuid4()), raw_responses=raw_responses))
+            # Also on Ctrl-C, so rows waiting on the future are not left hanging
+            except BaseException as error:
+                with self._caseworker_cache_lock:
+                    del self.caseworker_cache[cache_key]
+                future.set_exception(error)
+        return future.result()
+
+    async def lookup_new_caseworker_async(self, newazident, raw_responses=None):
+        """
+        Async version of lookup_new_caseworker. Rows waiting on the same racfId share one lookup,
+        and only the row that started it gets the response bodies in raw_responses.
+        A failed lookup is dropped from the cache, so the next row tries again.
+        """
+        cache_key = (newazident).strip().lower()
+        if cache_key not in self.caseworker_cache:
+            self.caseworker_cache[cache_key] = asyncio.ensure_future(self._resolve_async(newazident, raw_responses))
+        future = self.caseworker_cache[cache_key]
+        try:
+            return await future
+        except Exception:
+            # Rows already waiting share this failure; only the first of them removes the entry
+            if self.caseworker_cache.get(cache_key) is future:
+                del self.caseworker_cache[cache_key]
+            raise
+
+    async def _resolve_async(self, newazident, raw_responses=None):
+        if self.directory is not None:
+            hit, caseworker = self.directory.get(newazident)
+            if hit:
+                return caseworker
+        caseworker = await self.client.lookup_caseworker_by_racfId(newazident, str(uuid.uuid4()), raw_responses=raw_responses)
+        if self.directory is not None:
+            self.directory.put(newazident, caseworker)
+        return caseworker
+
+
+def process_row(run, sagsnr, oldazident, newazident, updates):
+    """
+    Runs all five steps for one row, filling in updates as each step completes.
+    Cases found in run.case_index (see prefetch_case_index) are not fetched again.
+
+    Steps already recorded in updates (rows from fetch_resumable_rows) are skipped: a checkpointed
+    case_uuid and new caseworker replace steps 1 and 2, tasks in completed_task_uuids are not moved
+    again, and the case update and confirmation task are only sent if they have not succeeded yet.
+    updates is passed to run.save_checkpoint after each step, so a failed row can be resumed.
+
+    Writes that would not change anything are left out: a case that already belongs to the new
+    caseworker is not updated, and no transfer task is created if the case already has one.
+    A row with failed task updates gets no processed_at (see finish_row).
+    """
+    client = run.client
+
+    # --- 1) Fetch case list and locate the specific case by old caseworker ---
+    case_uuid = updates["case_uuid"]
+    caseworker_fullname = updates["old_caseworker_fullname"]
+    if case_uuid is None:
+        bodies = run.response_bodies()
+        case_list = run.prefetched_case_response(sagsnr)
+        if case_list is None:
             txn1 = str(uuid.uuid4())
-            response_json = fetch_case(sagsnr, txn1, access_token, Nova_URL, orchestrator_connection)
-            updates["fetch_case_status"] = 200
-            updates["fetch_case_response"] = dict_preview(response_json)
-
-            cases = response_json.get("cases", []) or []
-            case_uuid = None
-            caseworker_fullname = None
-            userFriendlyCaseNumber = case.get("caseAttributes").get("userFriendlyCaseNumber")
-
-            for case in cases:
-                ksp = case.get("caseworker").get("kspIdentity")
-                if ksp.get("racfId").lower() == (oldazident).lower() and userFriendlyCaseNumber.lower() == sagsnr.strip().lower():
-                    case_uuid = case.get("common").get("uuid")
-                    caseworker_fullname = ksp.get("fullName")
-                    break
-
-            if not case_uuid:
-                raise RuntimeError("No caseuuid matched the original caseworker")
-
-            # --- 2) Lookup new caseworker by racfId, with per-run cache ---
-            cache_key = (newazident).strip().lower()
-            if cache_key in caseworker_cache:
-                new_caseworker = caseworker_cache[cache_key]
-            else:
-                new_caseworker = lookup_caseworker_by_racfId(newazident, str(uuid.uuid4()), access_token, Nova_URL)
-                caseworker_cache[cache_key] = new_caseworker
-
-            if new_caseworker:
-                updates["lookup_new_caseworker_status"] = 200
-                updates["lookup_new_caseworker_response"] = dict_preview(new_caseworker)
-            else:
-                updates["lookup_new_caseworker_status"] = 404
-                updates["lookup_new_caseworker_response"] = "Not found"
-                raise RuntimeError("New caseworker not found")
-
-            new_caseworker_fullname = new_caseworker.get("kspIdentity").get("fullName")
-
-            # --- 3) Get task list and update tasks that belong to old caseworker and are not 'F' ---
-            task_list = get_task_list(str(uuid.uuid4()), case_uuid, access_token, Nova_URL)
-            tasks_to_update = [
-                t for t in (task_list or [])
-                if t.get("caseworker", {}).get("kspIdentity", {}).get("racfId", "") == oldazident
-                and t.get("taskStatusCode") != "F"
-            ]
-
-            per_task_results = []
-            updated_count = 0
-            skipped_count = 0
-            for t in tasks_to_update:
-                try:
-                    status_code = update_caseworker_task(t, access_token, Nova_URL, new_caseworker)
-                    per_task_results.append({
-                        "taskUuid": t.get("taskUuid"),
-                        "title": t.get("taskTitle"),
-                        "status": status_code
-                    })
-                    if 200 <= int(status_code) < 300:
-                        updated_count += 1
-                    else:
-                        skipped_count += 1
-                except Exception as e:
-                    per_task_results.append({
-                        "taskUuid": t.get("taskUuid"),
-                        "title": t.get("taskTitle"),
-                        "status": "ERROR",
-                        "error": str(e)
-                    })
-                    skipped_count += 1
-
-            updates["update_tasks_status"] = f"updated:{updated_count};failed:{skipped_count}"
-            updates["update_tasks_response"] = dict_preview(per_task_results)
-
-            # --- 4) Update the case caseworker ---
-            status_code_case = update_caseworker_case(case_uuid, new_caseworker, access_token, Nova_URL)
-            updates["update_case_status"] = status_code_case
-            updates["update_case_response"] = f"case_uuid:{case_uuid}"
-
-            # --- 5) Create a confirmation task on the case ---
-            desc = (
-                f"Robotten har overført sagen fra {caseworker_fullname} til {new_caseworker_fullname}. "
-                f"Husk at ændre assistent på opgaverne hvis det er relevant."
-            )
-            status_code_task = create_task(case_uuid, new_caseworker, desc, access_token, Nova_URL)
+            with run.timed("fetch_case", sagsnr):
+                case_list = client.fetch_case(sagsnr, txn1, raw_responses=bodies)
+        updates["fetch_case_status"] = 200
+        updates["fetch_case_response"] = f"{len(case_list.cases)} case(s)"
+        run.save_response(sagsnr, "fetch_case", bodies)
+
+        case_uuid, caseworker_fullname, already_moved = find_case(case_list, sagsnr, oldazident, newazident)
+        if not case_uuid:
+            raise CaseNotMovableError("No caseuuid matched the original caseworker")
+        updates["case_uuid"] = case_uuid
+        updates["old_caseworker_fullname"] = caseworker_fullname
+        if already_moved:
+            skip_case_update(updates, case_uuid)
+        run.save_checkpoint(sagsnr, updates)
+
+    # --- 2) Lookup new caseworker by racfId, with per-run cache and persistent directory ---
+    new_caseworker = checkpointed_caseworker(updates, newazident)
+    if new_caseworker is None:
+        bodies = run.response_bodies()
+        with run.timed("lookup_caseworker", sagsnr):
+            new_caseworker = run.lookup_new_caseworker(newazident, bodies)
+
+        run.save_response(sagsnr, "lookup_caseworker", bodies)
+        record_lookup(updates, new_caseworker)
+        updates["new_caseworker"] = msgspec.json.encode(new_caseworker).decode("utf-8")
+        run.save_checkpoint(sagsnr, updates)
+    new_caseworker_fullname = new_caseworker.full_name
+
+    # --- 3) Get task list and update tasks that belong to old caseworker and are not 'F' ---
+    # Nova filters on caseworker; select_tasks_to_update leaves out closed tasks and re-checks the caseworker.
+    # Status is not filtered on the Nova side, as a list of open status codes would silently drop any other open status.
+    if not tasks_step_done(updates):
+        completed = completed_tasks(updates)
+        bodies = run.response_bodies()
+        with run.timed("get_task_list", sagsnr):
+            task_list = client.get_task_list(case_uuid, str(uuid.uuid4()), caseworker_racfId=oldazident, raw_responses=bodies)
+        run.save_response(sagsnr, "get_task_list", bodies)
+        tasks_to_update = [t for t in select_tasks_to_update(task_list, oldazident) if t.task_uuid not in completed]
+
+        with run.timed("update_tasks", sagsnr):
+            per_task_results = update_tasks(client, tasks_to_update, new_caseworker, run.task_workers)
+
+        updates["update_tasks_status"] = summarize_task_results(per_task_results, len(completed))
+        updates["update_tasks_response"] = failed_tasks_summary(per_task_results)
+        record_completed_tasks(updates, completed, per_task_results)
+        run.save_task_results(sagsnr, per_task_results)
+        run.save_checkpoint(sagsnr, updates)
+
+    # --- 4) Update the case caseworker, unless it already belongs to the new caseworker ---
+    case_updated_now = False
+    if not is_success(updates["update_case_status"]):
+        with run.timed("update_case", sagsnr):
+            status_code_case = client.update_caseworker_case(case_uuid, new_caseworker)
+        updates["update_case_status"] = status_code_case
+        updates["update_case_response"] = f"case_uuid:{case_uuid}"
+        case_updated_now = True
+        run.save_checkpoint(sagsnr, updates, durable=True)
+
+    # --- 5) Create a confirmation task on the case ---
+    # A transfer task can only exist if the case was moved before this call, so only then is it looked for
+    if not is_success(updates["create_task_status"]):
+        transfer_task_exists = False
+        if not case_updated_now:
+            with run.timed("find_transfer_task", sagsnr):
+                transfer_task_exists = client.has_transfer_task(case_uuid, new_caseworker.racf_id, str(uuid.uuid4()))
+        if transfer_task_exists:
+            skip_create_task(updates)
+        else:
+            desc = transfer_description(caseworker_fullname, new_caseworker_fullname)
+            with run.timed("create_task", sagsnr):
+                status_code_task = client.create_task(case_uuid, new_caseworker, desc)
             updates["create_task_status"] = status_code_task
             updates["create_task_response"] = "Task created"
+            run.save_checkpoint(sagsnr, updates, durable=True)
 
-            updates["processed_at"] = datetime.now().isoformat(timespec="seconds")
+    finish_row(updates)
+
+
+def row_profiler(mode, every, top):
+    """Returns a RowProfiler writing next to SQLITE_PATH, or None if mode is None."""
+    if mode is None:
+        return None
+    return RowProfiler(os.path.dirname(os.path.abspath(SQLITE_PATH)), mode, every, top, label="sagsflyt")
 
-        except Exception as e:
-            # Even on failure, we persist what we have so far (some columns may be NULL)
-            # No processed_at to keep it eligible for another run (or you can choose to stamp it)
-            print(f"Error on {sagsnr}: {e}")
 
-        # Persist updates to SQLite
-        set_clause = ", ".join([f"{k} = ?" for k in updates.keys()])
-        params = [updates[k] for k in updates.keys()] + [sagsnr]
-        with conn:
-            conn.execute(f"UPDATE {TABLE_NAME} SET {set_clause} WHERE sagsnummer = ?", params)
+def close_metrics(metrics):
+    metrics.close()
+    print(f"Metrics saved as run {metrics.run_id}; see `python sandbox.py metrics`.")
 
+
+def show_metrics(run_id=None):
+    conn = connect_db()
+    print_report(conn, run_id)
     conn.close()
+
+
+def hedge_policy(hedge_percentile):
+    """Returns a HedgePolicy for hedging reads at the given latency percentile, or None to not hedge."""
+    return HedgePolicy(hedge_percentile) if hedge_percentile else None
+
+
+def run_pipeline_for_unprocessed_rows(task_workers=TASK_UPDATE_WORKERS, hedge_percentile=None, nova=None, adapter=None, profiler=None, resume=False,
+                                      keep_responses=False, claim_batch_size=CLAIM_BATCH_SIZE, rate=DEFAULT_RATE):
+    """
+    Processes the unprocessed rows one at a time and returns the PipelineRun, whose step_seconds holds
+    how long each step took per row. Each row is checkpointed after every step; with resume, rows that
+    failed part way are picked up as well and continue from their first incomplete step.
+    Rows are claimed claim_batch_size at a time under a lease (see claim_rows), so several processes can
+    work through the same database.
+    nova is an optional (Nova_URL, token_provider) pair, e.g. pointing at nova_standin.py; by default
+    both come from OpenOrchestrator. adapter is an optional transport for NovaClient, see nova_replay.py.
+    profiler is an optional RowProfiler (see profiling.py); its summary is printed at the end of the run.
+    keep_responses stores the compressed read responses of every row in RESPONSES_TABLE_NAME.
+    rate is the requests per second allowed per Nova endpoint; the client lowers it while Nova answers 429.
+    """
+    conn = connect_db()
+    # load_xlsx_into_db(conn)
+
+    # Prepare Orchestrator/Nova access
+    Nova_URL, token_provider = nova or nova_access(connect_orchestrator())
+    metrics = MetricsRecorder(SQLITE_PATH)
+    client = NovaClient(Nova_URL, token_provider=token_provider, pool_size=max(DEFAULT_POOL_SIZE, task_workers), hedge=hedge_policy(hedge_percentile),
+                        adapter=adapter, metrics=metrics, rate_limiter=AdaptiveRateLimiter(rate))
+
+    worker_id = new_worker_id()
+    directory = CaseworkerDirectory(CASEWORKER_DB_PATH)
+    writer = RowWriter(conn, keep_responses=keep_responses)
+    run = PipelineRun(client, directory, task_workers=task_workers, metrics=metrics, writer=writer)
+    lease_keeper = LeaseKeeper(worker_id)
+    claimed = 0
+
+    try:
+        run.pending_counts = count_rows_to_fetch(conn, resume)
+        while to_process := claim_rows(conn, worker_id, claim_batch_size, resume=resume):
+            claimed += len(to_process)
+            print(f"Worker {worker_id} claimed {len(to_process)} row(s).")
+            to_fetch = [(sagsnr, oldazident, newazident) for sagsnr, oldazident, newazident, updates in to_process if updates["case_uuid"] is None]
+            run.case_index.update(prefetch_case_index(client, to_fetch, prefetched=run.prefetched_caseworkers, pending_counts=run.pending_counts))
+
+            for sagsnr, oldazident, newazident, updates in to_process:
+                print(f"\nProcessing {sagsnr}: {oldazident} ➝ {newazident}")
+                if updates["fetch_case_status"] is not None:
+                    print(f"Resuming at {first_incomplete_step(updates)}")
+
+                started = time.perf_counter()
+                with maybe_profile_row(profiler):
+                    try:
+                        process_row(run, sagsnr, oldazident, newazident, updates)
+                    except Exception as e:
+                        # Even on failure, we persist what we have so far (some columns may be NULL)
+                        # No processed_at to keep it eligible for another run (or you can choose to stamp it)
+                        print(f"Error on {sagsnr}: {e}")
+
+                    # Persist updates to SQLite, batched with the other rows
+                    writer.save(sagsnr, updates)
+                run.record_row(sagsnr, started, updates)
+
+            # Results first, so no other worker can claim a row whose results are still buffered
+            writer.flush()
+            release_leases(conn, worker_id, [row[0] for row in to_process])
+    finally:
+        # Also on Ctrl-C or a failed claim: closing the client finishes a --record archive, which is unreadable without it
+        try:
+            writer.flush()
+        finally:
+            lease_keeper.stop()
+            if profiler is not None:
+                profiler.finish()
+            client.close()
+            directory.close()
+            close_metrics(metrics)
+            conn.close()
+    print(f"\nProcessed {claimed} claimed row(s).")
     print("\nDone.")
+    return run
+
+
+def warm_caseworker_directory(ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+    """Resolves every new caseworker racfId in the pending rows into the caseworker directory up front."""
+    conn = connect_db()
+    racfIds = [newazident for _, _, newazident in fetch_unprocessed_rows(conn) if newazident]
+    conn.close()
+
+    Nova_URL, token_provider = nova_access(connect_orchestrator())
+    directory = CaseworkerDirectory(CASEWORKER_DB_PATH, ttl, negative_ttl)
+    with NovaClient(Nova_URL, token_provider=token_provider) as client:
+        resolved = directory.warm_up(client, racfIds)
+    directory.close()
+
+    missing = sorted(racfId for racfId, caseworker in resolved.items() if caseworker is None)
+    print(f"Resolved {len(resolved) - len(missing)} of {len(resolved)} caseworker(s).")
+    for racfId in missing:
+        print(f"Not found in Nova: {racfId}")
+
+
+async def prefetch_case_index_async(client, rows, min_rows=PREFETCH_MIN_ROWS, prefetched=None, pending_counts=None):
+    """Async version of prefetch_case_index, fetching the caseworkers' case lists concurrently."""
+    racfIds = caseworkers_to_prefetch(rows, min_rows, prefetched or (), pending_counts)
+    case_lists = await asyncio.gather(*(client.list_cases_by_caseworker(racfId) for racfId in racfIds))
+    case_index = {}
+    for racfId, cases in zip(racfIds, case_lists):
+        print(f"Prefetched {len(cases)} case(s) for {racfId}.")
+        case_index.update(index_cases_by_number(cases))
+        if prefetched is not None:
+            prefetched.add(racfId.lower())
+    return case_index
+
+
+class RowPlan(msgspec.Struct):
+    """Everything the write steps of one row need, resolved up front by plan_row_async."""
+    sagsnummer: str
+    oprindelig_sagsbehandler: str
+    ny_sagsbehandler: str
+    case_uuid: str
+    old_caseworker_fullname: str | None
+    new_caseworker: Caseworker
+    tasks: list[Task]
+    # Write steps left out because Nova is already in the target state: "update_case", "create_task"
+    skip_steps: list[str] = []
+
+
+async def plan_row_async(run, sagsnr, oldazident, newazident, updates):
+    """
+    Runs the read steps for one row (fetch case, look up the new caseworker, list the tasks to move)
+    and returns them as a RowPlan. Nothing is changed in Nova.
+    """
+    client = run.client
+
+    # --- 1) Fetch case list and locate the specific case by old caseworker ---
+    bodies = run.response_bodies()
+    case_list = run.prefetched_case_response(sagsnr)
+    if case_list is None:
+        with run.timed("fetch_case", sagsnr):
+            case_list = await client.fetch_case(sagsnr, str(uuid.uuid4()), raw_responses=bodies)
+    updates["fetch_case_status"] = 200
+    updates["fetch_case_response"] = f"{len(case_list.cases)} case(s)"
+    run.save_response(sagsnr, "fetch_case", bodies)
+
+    case_uuid, caseworker_fullname, already_moved = find_case(case_list, sagsnr, oldazident, newazident)
+    if not case_uuid:
+        raise CaseNotMovableError("No caseuuid matched the original caseworker")
+    updates["case_uuid"] = case_uuid
+    updates["old_caseworker_fullname"] = caseworker_fullname
+
+    # --- 2) Lookup new caseworker by racfId; rows waiting on the same racfId share one lookup ---
+    bodies = run.response_bodies()
+    with run.timed("lookup_caseworker", sagsnr):
+        new_caseworker = await run.lookup_new_caseworker_async(newazident, bodies)
+
+    run.save_response(sagsnr, "lookup_caseworker", bodies)
+    record_lookup(updates, new_caseworker)
+    updates["new_caseworker"] = msgspec.json.encode(new_caseworker).decode("utf-8")
+
+    # --- 3a) Get the old caseworker's open tasks ---
+    bodies = run.response_bodies()
+    with run.timed("get_task_list", sagsnr):
+        task_list = await client.get_task_list(case_uuid, str(uuid.uuid4()), caseworker_racfId=oldazident, raw_responses=bodies)
+    run.save_response(sagsnr, "get_task_list", bodies)
+
+    # --- 3c) A case that was already moved needs no update, and maybe no transfer task ---
+    skip_steps = []
+    if already_moved:
+        skip_steps.append("update_case")
+        with run.timed("find_transfer_task", sagsnr):
+            if await client.has_transfer_task(case_uuid, new_caseworker.racf_id, str(uuid.uuid4())):
+                skip_steps.append("create_task")
+
+    return RowPlan(sagsnr, oldazident, newazident, case_uuid, caseworker_fullname, new_caseworker, select_tasks_to_update(task_list, oldazident),
+                   skip_steps)
+
+
+async def apply_plan_async(run, plan, updates):
+    """Runs the write steps for one row from its RowPlan, without any further reads."""
+    client = run.client
+    new_caseworker = plan.new_caseworker
+
+    # --- 3b) Update the old caseworker's open tasks concurrently ---
+    with run.timed("update_tasks", plan.sagsnummer):
+        per_task_results = await asyncio.gather(
+            *(update_task_with_retry_async(client, t, new_caseworker) for t in plan.tasks)
+        )
+
+    updates["update_tasks_status"] = summarize_task_results(per_task_results)
+    updates["update_tasks_response"] = failed_tasks_summary(per_task_results)
+    record_completed_tasks(updates, (), per_task_results)
+    run.save_task_results(plan.sagsnummer, per_task_results)
+
+    # --- 4) Update the case caseworker, unless it already belongs to the new caseworker ---
+    if "update_case" in plan.skip_steps:
+        skip_case_update(updates, plan.case_uuid)
+    else:
+        with run.timed("update_case", plan.sagsnummer):
+            updates["update_case_status"] = await client.update_caseworker_case(plan.case_uuid, new_caseworker)
+        updates["update_case_response"] = f"case_uuid:{plan.case_uuid}"
+        run.save_checkpoint(plan.sagsnummer, updates, durable=True)
+
+    # --- 5) Create a confirmation task on the case, unless it already has one ---
+    if "create_task" in plan.skip_steps:
+        skip_create_task(updates)
+    else:
+        desc = transfer_description(plan.old_caseworker_fullname, new_caseworker.full_name)
+        with run.timed("create_task", plan.sagsnummer):
+            updates["create_task_status"] = await client.create_task(plan.case_uuid, new_caseworker, desc)
+        updates["create_task_response"] = "Task created"
+        run.save_checkpoint(plan.sagsnummer, updates, durable=True)
+
+    finish_row(updates)
+
+
+async def process_row_async(run, sagsnr, oldazident, newazident, updates):
+    """Async version of process_row: the read steps of plan_row_async followed by the writes of apply_plan_async."""
+    plan = await plan_row_async(run, sagsnr, oldazident, newazident, updates)
+    await apply_plan_async(run, plan, updates)
+
+
+async def run_pipeline_async(max_rows_in_flight=DEFAULT_ROWS_IN_FLIGHT, max_in_flight=DEFAULT_MAX_IN_FLIGHT, hedge_percentile=None, keep_responses=False,
+                             rate=DEFAULT_RATE, claim_batch_size=CLAIM_BATCH_SIZE):
+    """
+    Processes the unprocessed rows concurrently with AsyncNovaClient.
+    max_rows_in_flight caps how many rows are worked on at once, max_in_flight caps the
+    Nova requests in flight across all rows. SQLite is only touched from the event loop
+    thread, one row at a time, as each row finishes.
+    Rows are claimed and leased claim_batch_size at a time like in run_pipeline_for_unprocessed_rows,
+    so run-async can work next to run workers on the same database.
+    """
+    conn = connect_db()
+
+    Nova_URL, token_provider = nova_access(connect_orchestrator())
+
+    worker_id = new_worker_id()
+    directory = CaseworkerDirectory(CASEWORKER_DB_PATH)
+    metrics = MetricsRecorder(SQLITE_PATH)
+    writer = RowWriter(conn, keep_responses=keep_responses)
+    row_semaphore = asyncio.Semaphore(max_rows_in_flight)
+    lease_keeper = LeaseKeeper(worker_id)
+
+    try:
+        async with AsyncNovaClient(Nova_URL, max_in_flight=max_in_flight, token_provider=token_provider, hedge=hedge_policy(hedge_percentile),
+                                   metrics=metrics, rate_limiter=AdaptiveRateLimiter(rate)) as client:
+            run = PipelineRun(client, directory, metrics=metrics, writer=writer)
+
+            async def run_row(sagsnr, oldazident, newazident):
+                async with row_semaphore:
+                    updates = empty_updates()
+                    started = time.perf_counter()
+                    try:
+                        await process_row_async(run, sagsnr, oldazident, newazident, updates)
+                        print(f"Processed {sagsnr}: {oldazident} ➝ {newazident}")
+                    except Exception as e:
+                        print(f"Error on {sagsnr}: {e}")
+                    writer.save(sagsnr, updates)
+                    run.record_row(sagsnr, started, updates)
+
+            try:
+                run.pending_counts = count_rows_to_fetch(conn)
+                while to_process := claim_rows(conn, worker_id, claim_batch_size):
+                    print(f"Worker {worker_id} claimed {len(to_process)} row(s).")
+                    rows = [(sagsnr, oldazident, newazident) for sagsnr, oldazident, newazident, _ in to_process]
+                    run.case_index.update(await prefetch_case_index_async(client, rows, prefetched=run.prefetched_caseworkers, pending_counts=run.pending_counts))
+                    await asyncio.gather(*(run_row(*row) for row in rows))
+                    # Results first, so no other worker can claim a row whose results are still buffered
+                    writer.flush()
+                    release_leases(conn, worker_id, [row[0] for row in rows])
+            finally:
+                writer.flush()
+    finally:
+        lease_keeper.stop()
+        directory.close()
+        close_metrics(metrics)
+        conn.close()
+    print("\nDone.")
+
+
+async def run_plan_async(max_rows_in_flight=DEFAULT_ROWS_IN_FLIGHT, max_in_flight=DEFAULT_MAX_IN_FLIGHT, hedge_percentile=None, rate=DEFAULT_RATE,
+                         claim_batch_size=CLAIM_BATCH_SIZE, keep_responses=False):
+    """
+    Plans every unprocessed row with high read concurrency and stores the plans in PLAN_TABLE_NAME.
+    Nothing is written to Nova, and TABLE_NAME only gets the leases of the rows being planned, so rows that
+    fail planning (unknown case, unknown new caseworker, ...) are reported before any case has been changed
+    and stay pending. Rows are claimed claim_batch_size at a time and their plans saved per batch.
+    keep_responses stores the compressed read responses of every row in RESPONSES_TABLE_NAME.
+    """
+    conn = connect_db()
+
+    Nova_URL, token_provider = nova_access(connect_orchestrator())
+
+    worker_id = new_worker_id()
+    directory = CaseworkerDirectory(CASEWORKER_DB_PATH)
+    metrics = MetricsRecorder(SQLITE_PATH)
+    # Only holds the read responses; the plans are saved by save_plans
+    writer = RowWriter(conn, keep_responses=keep_responses)
+    row_semaphore = asyncio.Semaphore(max_rows_in_flight)
+    lease_keeper = LeaseKeeper(worker_id)
+    planned = []
+    all_failures = []
+
+    try:
+        async with AsyncNovaClient(Nova_URL, max_in_flight=max_in_flight, token_provider=token_provider, hedge=hedge_policy(hedge_percentile),
+                                   metrics=metrics, rate_limiter=AdaptiveRateLimiter(rate)) as client:
+            run = PipelineRun(client, directory, metrics=metrics, writer=writer)
+
+            async def plan_row(sagsnr, oldazident, newazident, plans, failures):
+                async with row_semaphore:
+                    try:
+                        plans.append(await plan_row_async(run, sagsnr, oldazident, newazident, empty_updates()))
+                    except Exception as e:
+                        failures.append((sagsnr, oldazident, newazident, str(e)))
+
+            try:
+                run.pending_counts = count_rows_to_fetch(conn)
+                while to_plan := claim_rows(conn, worker_id, claim_batch_size):
+                    print(f"Worker {worker_id} claimed {len(to_plan)} row(s).")
+                    rows = [(sagsnr, oldazident, newazident) for sagsnr, oldazident, newazident, _ in to_plan]
+                    run.case_index.update(await prefetch_case_index_async(client, rows, prefetched=run.prefetched_caseworkers, pending_counts=run.pending_counts))
+                    plans, failures = [], []
+                    await asyncio.gather(*(plan_row(*row, plans, failures) for row in rows))
+                    save_plans(conn, plans, failures)
+                    writer.flush()
+                    release_leases(conn, worker_id, [row[0] for row in rows])
+                    planned += [len(plan.tasks) for plan in plans]
+                    all_failures += failures
+            finally:
+                writer.flush()
+    finally:
+        lease_keeper.stop()
+        directory.close()
+        close_metrics(metrics)
+        conn.close()
+
+    print(f"\nPlanned {len(planned)} row(s), moving {sum(planned)} task(s).")
+    if all_failures:
+        print(f"{len(all_failures)} row(s) cannot be executed:")
+        for sagsnr, oldazident, newazident, error in sorted(all_failures):
+            print(f"  {sagsnr}: {oldazident} ➝ {newazident}: {error}")
+
+
+async def run_execute_async(max_rows_in_flight=DEFAULT_ROWS_IN_FLIGHT, max_in_flight=DEFAULT_MAX_IN_FLIGHT, rate=DEFAULT_RATE,
+                            claim_batch_size=CLAIM_BATCH_SIZE):
+    """
+    Applies the ready plans from PLAN_TABLE_NAME with write-side concurrency. No reads are sent to Nova;
+    the case, new caseworker and tasks are taken from the plan as they were when it was made.
+    Plans are claimed claim_batch_size at a time with claim_planned_rows, which leases their rows.
+    """
+    conn = connect_db()
+
+    Nova_URL, token_provider = nova_access(connect_orchestrator())
+
+    worker_id = new_worker_id()
+    metrics = MetricsRecorder(SQLITE_PATH)
+    writer = RowWriter(conn)
+    row_semaphore = asyncio.Semaphore(max_rows_in_flight)
+    lease_keeper = LeaseKeeper(worker_id)
+
+    try:
+        async with AsyncNovaClient(Nova_URL, max_in_flight=max_in_flight, token_provider=token_provider, metrics=metrics,
+                                   rate_limiter=AdaptiveRateLimiter(rate)) as client:
+            run = PipelineRun(client, metrics=metrics, writer=writer)
+
+            async def execute_row(plan):
+                async with row_semaphore:
+                    updates = empty_updates()
+                    started = time.perf_counter()
+                    updates["fetch_case_status"] = 200
+                    updates["fetch_case_response"] = f"planned case_uuid:{plan.case_uuid}"
+                    updates["case_uuid"] = plan.case_uuid
+                    updates["old_caseworker_fullname"] = plan.old_caseworker_fullname
+                    record_lookup(updates, plan.new_caseworker)
+                    updates["new_caseworker"] = msgspec.json.encode(plan.new_caseworker).decode("utf-8")
+                    try:
+                        await apply_plan_async(run, plan, updates)
+                        print(f"Processed {plan.sagsnummer}: {plan.oprindelig_sagsbehandler} ➝ {plan.ny_sagsbehandler}")
+                    except Exception as e:
+                        print(f"Error on {plan.sagsnummer}: {e}")
+                    writer.save(plan.sagsnummer, updates)
+                    mark_plan_executed(conn, plan.sagsnummer)
+                    run.record_row(plan.sagsnummer, started, updates)
+
+            try:
+                while to_execute := claim_planned_rows(conn, worker_id, claim_batch_size):
+                    print(f"Worker {worker_id} claimed {len(to_execute)} planned row(s).")
+                    await asyncio.gather(*(execute_row(plan) for plan in to_execute))
+                    # Results first, so no other worker can claim a row whose results are still buffered
+                    writer.flush()
+                    release_leases(conn, worker_id, [plan.sagsnummer for plan in to_execute])
+            finally:
+                writer.flush()
+    finally:
+        lease_keeper.stop()
+        close_metrics(metrics)
+        conn.close()
+    print("\nDone.")
+
+
+def run_command(args):
+    """Runs the `run` command, recording or replaying the Nova traffic if asked to."""
+    nova = adapter = None
+    if args.replay:
+        adapter = ReplayAdapter(TrafficArchive(args.replay), args.replay_latency_scale)
+        nova = (REPLAY_URL, ReplayTokenProvider())
+    elif args.record:
+        adapter = RecordingAdapter(TrafficArchive(args.record), pool_maxsize=max(DEFAULT_POOL_SIZE, args.task_workers))
+
+    profiler = row_profiler(args.profile, args.profile_every, args.profile_top)
+    run_pipeline_for_unprocessed_rows(args.task_workers, args.hedge_percentile, nova, adapter, profiler, args.resume, args.keep_responses, args.claim_batch_size,
+                                      args.rate)
+
+    if args.replay:
+        print(f"Replayed {adapter.hits} request(s), {adapter.misses} not in the recording.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nova Sagsflyt caseworker reassignment pipeline.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Process unprocessed rows one at a time (default).")
+    run_parser.add_argument("--task-workers", type=int, default=TASK_UPDATE_WORKERS, help="Threads updating the tasks of one case.")
+    run_parser.add_argument("--hedge-percentile", type=float, help="Hedge reads slower than this latency percentile, e.g. 95. Off by default.")
+    run_parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"Requests per second allowed per Nova endpoint, lowered automatically while Nova answers 429. {DEFAULT_RATE:g} by default.")
+    run_parser.add_argument("--resume", action="store_true", help="Also continue rows that failed part way, from their first incomplete step.")
+    run_parser.add_argument("--claim-batch-size", type=int, default=CLAIM_BATCH_SIZE, help="Rows claimed at once; other workers skip them while this one works.")
+    run_parser.add_argument("--keep-responses", action="store_true", help=f"Store the compressed read responses of every row in {RESPONSES_TABLE_NAME}.")
+    run_parser.add_argument("--record", metavar="ARCHIVE", help="Write the sanitized Nova traffic of the run to this .jsonl.gz archive.")
+    run_parser.add_argument("--replay", metavar="ARCHIVE", help="Answer Nova requests from a recorded archive instead of Nova.")
+    run_parser.add_argument("--replay-latency-scale", type=float, default=1.0, help="Factor on the recorded response times when replaying; 0 for none.")
+    run_parser.add_argument("--profile", choices=PROFILE_MODES, help="Profile rows with cProfile or a stack sampler; the profile is written next to the database.")
+    run_parser.add_argument("--profile-every", type=int, default=1, help="Profile only every Nth row.")
+    run_parser.add_argument("--profile-top", type=int, default=25, help="Functions listed in the summary at the end of the run.")
+
+    run_async_parser = subparsers.add_parser("run-async", help="Process unprocessed rows concurrently.")
+    run_async_parser.add_argument("--rows", type=int, default=DEFAULT_ROWS_IN_FLIGHT, help="Rows worked on at once.")
+    run_async_parser.add_argument("--requests", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Nova requests in flight at once.")
+    run_async_parser.add_argument("--hedge-percentile", type=float, help="Hedge reads slower than this latency percentile, e.g. 95. Off by default.")
+    run_async_parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"Requests per second allowed per Nova endpoint, lowered automatically while Nova answers 429. {DEFAULT_RATE:g} by default.")
+    run_async_parser.add_argument("--claim-batch-size", type=int, default=CLAIM_BATCH_SIZE, help="Rows claimed at once; keep it at least --rows so every row slot stays busy.")
+    run_async_parser.add_argument("--keep-responses", action="store_true", help=f"Store the compressed read responses of every row in {RESPONSES_TABLE_NAME}.")
+
+    plan_parser = subparsers.add_parser("plan", help="Resolve all unprocessed rows into a plan without changing anything in Nova.")
+    plan_parser.add_argument("--rows", type=int, default=DEFAULT_ROWS_IN_FLIGHT, help="Rows planned at once.")
+    plan_parser.add_argument("--requests", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Nova requests in flight at once.")
+    plan_parser.add_argument("--hedge-percentile", type=float, help="Hedge reads slower than this latency percentile, e.g. 95. Off by default.")
+    plan_parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"Requests per second allowed per Nova endpoint, lowered automatically while Nova answers 429. {DEFAULT_RATE:g} by default.")
+    plan_parser.add_argument("--claim-batch-size", type=int, default=CLAIM_BATCH_SIZE, help="Rows claimed at once; keep it at least --rows so every row slot stays busy.")
+    plan_parser.add_argument("--keep-responses", action="store_true", help=f"Store the compressed read responses of every row in {RESPONSES_TABLE_NAME}.")
+
+    execute_parser = subparsers.add_parser("execute", help="Apply the plan made by the plan command.")
+    execute_parser.add_argument("--rows", type=int, default=DEFAULT_ROWS_IN_FLIGHT, help="Rows executed at once.")
+    execute_parser.add_argument("--requests", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Nova requests in flight at once.")
+    execute_parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"Requests per second allowed per Nova endpoint, lowered automatically while Nova answers 429. {DEFAULT_RATE:g} by default.")
+    execute_parser.add_argument("--claim-batch-size", type=int, default=CLAIM_BATCH_SIZE, help="Rows claimed at once; keep it at least --rows so every row slot stays busy.")
+
+    metrics_parser = subparsers.add_parser("metrics", help="Report request latencies, step durations and rows per minute of a run.")
+    metrics_parser.add_argument("--run", help="Run id to report on. The latest run by default.")
+
+    ingest_parser = subparsers.add_parser("ingest", help="Load input rows from an .xlsx, .csv or .txt file; unchanged rows are skipped.")
+    ingest_parser.add_argument("path", nargs="?", default=XLSX_PATH, help=f"Input file. {XLSX_PATH} by default.")
+    ingest_parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="Rows upserted per batch.")
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Create an OpenOrchestrator queue element per row of an .xlsx, .csv or .txt file for the queue robot.")
+    enqueue_parser.add_argument("path", nargs="?", default=XLSX_PATH, help=f"Input file. {XLSX_PATH} by default.")
+    enqueue_parser.add_argument("--queue", default=QUEUE_NAME, help=f"Queue name. {QUEUE_NAME} by default.")
+    enqueue_parser.add_argument("--batch-size", type=int, default=ENQUEUE_BATCH_SIZE, help="Queue elements created per insert.")
+
+    warm_parser = subparsers.add_parser("warm-caseworkers", help="Resolve all new caseworkers of the pending rows into the caseworker directory.")
+    warm_parser.add_argument("--ttl", type=float, default=DEFAULT_TTL, help="Seconds a found caseworker stays valid.")
+    warm_parser.add_argument("--negative-ttl", type=float, default=DEFAULT_NEGATIVE_TTL, help="Seconds a not-found answer stays valid.")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run-async":
+        asyncio.run(run_pipeline_async(args.rows, args.requests, args.hedge_percentile, args.keep_responses, args.rate, args.claim_batch_size))
+    elif args.command == "plan":
+        asyncio.run(run_plan_async(args.rows, args.requests, args.hedge_percentile, args.rate, args.claim_batch_size, args.keep_responses))
+    elif args.command == "execute":
+        asyncio.run(run_execute_async(args.rows, args.requests, args.rate, args.claim_batch_size))
+    elif args.command == "metrics":
+        show_metrics(args.run)
+    elif args.command == "ingest":
+        conn = connect_db()
+        load_input_into_db(conn, args.path, args.batch_size)
+        conn.close()
+    elif args.command == "enqueue":
+        enqueue_input_rows(connect_orchestrator(), args.path, args.queue, args.batch_size)
+    elif args.command == "warm-caseworkers":
+        warm_caseworker_directory(args.ttl, args.negative_ttl)
+    elif args.command == "run":
+        run_command(args)
+    else:
+        run_pipeline_for_unprocessed_rows()
 
 
 if __name__ == "__main__":
-    run_pipeline_for_unprocessed_rows()
+    main()
@@ -0,0 +1,60 @@
+"""Connection reuse of NovaClient, measured against the local Nova stand-in."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from nova import NovaClient
+from nova_standin import FaultProfile, NovaStandIn, SyntheticNova
+from nova_throttle import AdaptiveRateLimiter
+
+CASE_NUMBERS = [f"S2024-{i:06d}" for i in range(1, 31)]
+
+
+@pytest.fixture(name="standin")
+def fixture_standin():
+    """A running stand-in without latency, whose connections_opened lists the address of every accepted connection."""
+    with NovaStandIn(SyntheticNova(caseworkers=5, cases=len(CASE_NUMBERS), tasks_per_case=2), FaultProfile(latency_scale=0)) as standin:
+        standin.connections_opened = []
+        process_request = standin.server.process_request
+
+        def counting_process_request(request, client_address):
+            standin.connections_opened.append(client_address)
+            process_request(request, client_address)
+
+        standin.server.process_request = counting_process_request
+        yield standin
+
+
+def make_client(standin, pool_size=4):
+    """A NovaClient for the stand-in whose rate limit does not slow the tests down."""
+    return NovaClient(standin.url, token_provider=standin.token_provider(), pool_size=pool_size, rate_limiter=AdaptiveRateLimiter(1000))
+
+
+def test_plain_requests_open_one_connection_per_call(standin):
+    """The baseline the client replaces: module-level requests calls never reuse a connection."""
+    for _ in range(5):
+        requests.post(f"{standin.url}/token", timeout=5).raise_for_status()
+
+    assert len(standin.connections_opened) == 5
+
+
+def test_sequential_calls_reuse_one_connection(standin):
+    """All calls of one client go over a single keep-alive connection."""
+    with make_client(standin) as client:
+        for case_number in CASE_NUMBERS:
+            assert client.fetch_case(case_number).cases[0].case_number == case_number
+
+    # One for the token request and one for all Nova calls
+    assert len(standin.connections_opened) <= 2
+
+
+def test_concurrent_calls_stay_within_pool_size(standin):
+    """Calls from several threads open at most pool_size connections."""
+    pool_size = 4
+    with make_client(standin, pool_size) as client, ThreadPoolExecutor(max_workers=pool_size) as executor:
+        found = list(executor.map(lambda case_number: client.fetch_case(case_number).cases[0].case_number, CASE_NUMBERS * 3))
+
+    assert found == CASE_NUMBERS * 3
+    assert len(standin.connections_opened) <= pool_size + 1